@@ -12,6 +12,50 @@ def is_string(data):
     return isinstance(data, str)
 
 
+# Setting any one of these puts a light in a different color mode, so an
+# earlier value for one of the others would only get in the way
+COLOR_MODES = (('xy',), ('ct',), ('hue', 'sat'))
+
+# What the API accepts, so that folding an increment into a pending value
+# can't produce a command the bridge would reject; hue wraps around instead
+RANGES = {'bri': (1, 254), 'sat': (0, 254), 'ct': (153, 500),
+          'bri_inc': (-254, 254), 'sat_inc': (-254, 254),
+          'hue_inc': (-65534, 65534), 'ct_inc': (-65534, 65534)}
+
+
+def merge_state(pending, data):
+    """Utility method to fold a newer state command into an unsent one, attribute by attribute."""
+    if 'scene' in data:
+        pending.clear()
+    for keys in COLOR_MODES:
+        if any(key in data for key in keys):
+            for other in COLOR_MODES:
+                if other is not keys:
+                    for key in other:
+                        pending.pop(key, None)
+                        pending.pop(key + '_inc', None)
+    for key, value in data.items():
+        if key.endswith('_inc'):
+            absolute = key[:-len('_inc')]
+            if absolute in pending and not isinstance(value, list):
+                pending[absolute] = _fit(absolute, pending[absolute] + value)  # still an absolute value
+                continue
+            if key in pending and not isinstance(value, list):
+                value = _fit(key, value + pending[key])
+        else:
+            pending.pop(key + '_inc', None)
+        pending[key] = value
+
+
+def _fit(key, value):
+    if key == 'hue':
+        return value % 65536
+    if key in RANGES:
+        low, high = RANGES[key]
+        return min(max(value, low), high)
+    return value
+
+
 class PhueException(Exception):
 
     def __init__(self, id, message):
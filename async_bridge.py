@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+from uPHue import *
+from uPHue.bridge import Bridge
+from uPHue.pool import Pool
+
+
+class AsyncBridge(Bridge):
+
+    """ asyncio interface to the Hue ZigBee bridge
+
+    Configuration and registration work (and block) just like `Bridge`, but
+    `get()`, `put()`, `post()`, `delete()`, their `_many()` and `read()`
+    variants, `get_api()` and `bootstrap()` are coroutines, sent over
+    asyncio streams. Up to `pool_size` requests are in flight at once, each
+    on its own keep-alive connection; further requests wait their turn.
+
+    >>> b = AsyncBridge(ip='192.168.1.100')
+    >>> lb = Light.AsyncBridge(b)
+    >>> await lb.set_light([1, 2, 3], 'on', True)
+
+    """
+
+    def __init__(self, ip=None, username=None, config_file_path=None, pool_size=4,
+                 timeout=10, throttle=None):
+        Bridge.__init__(self, ip, username, config_file_path, pool_size, throttle=throttle)
+        self.timeout = timeout
+        self._streams = []
+        self._slots = None
+        self._check = None  # the warm start's topology check, see bootstrap()
+
+    @property
+    def name(self):
+        '''Get the name of the bridge [awaitable string]. Use set_name() to change it'''
+        return self._get_name()
+
+    async def _get_name(self):
+        self._name = (await self.get('/config'))['name']
+        return self._name
+
+    async def set_name(self, value):
+        self._name = value
+        return await self.put('/config', {'name': self._name})
+
+    async def get(self, req):
+        self._revalidated()
+        return await self.arequest('GET', self.api + req)
+
+    async def read(self, req, field=None):
+        # no cache or background refresh to answer from
+        return await self.get(req)
+
+    async def put(self, req, data):
+        return await self.arequest('PUT', self.api + req, data)
+
+    async def post(self, req, data):
+        return await self.arequest('POST', self.api + req, data)
+
+    async def delete(self, req):
+        return await self.arequest('DELETE', self.api + req)
+
+    async def get_many(self, requests):
+        """ GET a list of reqs concurrently, returning the list of responses """
+        self._revalidated()
+        return await self.request_many([('GET', self.api + req, None) for req in requests])
+
+    async def read_many(self, requests, field=None):
+        return await self.get_many(requests)
+
+    async def get_api(self):
+        """ Returns the full api dictionary """
+        return await self.get('')
+
+    async def bootstrap(self, *managers, warm=False):
+        """ Build managers from a single GET /api - see Bridge.bootstrap().
+        With warm=True the saved topology is checked against the bridge
+        from a task on the running event loop rather than a thread """
+        if warm:
+            topology = self._warm_start(managers)
+            if topology is not None:
+                self._check = asyncio.ensure_future(self._revalidate_async(managers, topology))
+                return topology
+
+        snapshot = await self.get_api()
+        self._bootstrapped(managers, snapshot)
+        return snapshot
+
+    async def _revalidate_async(self, managers, topology):
+        try:
+            responses = await self.get_many(['/' + collection for collection in sorted(self.TOPOLOGY)])
+            self._checked(managers, topology, responses)
+        except Exception:
+            logger.exception('Unable to check the saved topology against the bridge')
+
+    async def put_many(self, requests):
+        """ PUT a list of (req, data) pairs concurrently, returning the list of responses """
+        return await self.request_many([('PUT', self.api + req, data) for req, data in requests])
+
+    async def request_many(self, requests):
+        """ Send a list of (mode, address, data) requests concurrently,
+        returning the list of responses in the same order """
+        return await asyncio.gather(
+            *[self.arequest(mode, address, data) for mode, address, data in requests])
+
+    async def arequest(self, mode='GET', address=None, data=None):
+        """ Coroutine for HTTP GET/PUT/POST/DELETE requests for the API """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(self.pool_size, 1))
+        body = self._body(mode, data)
+        if self.throttle is not None:
+            delay = self.throttle.reserve(mode, address)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        async with self._slots:
+            start = time.time()
+            while True:
+                reader, writer, reused = await self._acquire()
+                sent = False
+                try:
+                    await asyncio.wait_for(self._send(writer, mode, address, body), self.timeout)
+                    sent = True
+                    response, keep_alive = await asyncio.wait_for(
+                        self._receive(reader), self.timeout)
+                    logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+                except asyncio.TimeoutError:
+                    writer.close()
+                    error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
+
+                    logger.exception(error)
+                    if self.throttle is not None:
+                        self.throttle.observe(mode, address, None, None)
+                    raise PhueRequestTimeout(None, error)
+                except (OSError, EOFError, ValueError):
+                    writer.close()
+                    # as Pool.request(): the bridge may have acted on what was sent
+                    if not reused or (sent and not Pool.idempotent(mode, body)):
+                        raise
+                    logger.debug('Bridge dropped idle connection, reconnecting')
+                    continue
+                break
+
+            if keep_alive and len(self._streams) < self.pool_size:
+                self._streams.append((reader, writer))
+            else:
+                writer.close()
+
+        elapsed = time.time() - start
+        self.latency.record(elapsed)
+        response = self._response(response)
+        if self.throttle is not None:
+            self.throttle.observe(mode, address, elapsed, response)
+        return response
+
+    async def _acquire(self):
+        if self._streams:
+            reader, writer = self._streams.pop()
+            return reader, writer, True
+        host, _, port = self.ip.partition(':')
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port or 80)), self.timeout)
+        return reader, writer, False
+
+    async def _send(self, writer, mode, address, body):
+        """ Send one request """
+        lines = ['{0} {1} HTTP/1.1'.format(mode, address),
+                 'Host: ' + self.ip,
+                 'Accept-Encoding: identity']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+            lines.append('Content-Length: {0}'.format(len(body)))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii') + (body or b''))
+        await writer.drain()
+
+    async def _receive(self, reader):
+        """ Read the response to a request.
+        Returns (body, keep_alive) """
+        status = await reader.readline()
+        if not status:
+            raise EOFError('Connection closed by the bridge')
+        version = status.split(b' ', 1)[0]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('iso-8859-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            response = await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            response = b''.join(chunks)
+        else:
+            return await reader.read(), False
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' and (version != b'HTTP/1.0' or connection == 'keep-alive')
+        return response, keep_alive
+
+    def close(self):
+        """ Close any kept-alive connections to the bridge """
+        Bridge.close(self)
+        while self._streams:
+            self._streams.pop()[1].close()
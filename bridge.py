@@ -3,9 +3,16 @@
 import os
 import socket
 import json
+import time
 import http.client as httplib
 
 from uPHue import *
+from uPHue.pool import Latency, NullLock, Pool
+
+try:
+    import threading
+except ImportError:
+    threading = None  # MicroPython without _thread: no threads=
 
 
 class Bridge(object):
@@ -13,7 +20,8 @@ class Bridge(object):
     """ Interface to the Hue ZigBee bridge
 
     """
-    def __init__(self, ip=None, username=None, config_file_path=None):
+    def __init__(self, ip=None, username=None, config_file_path=None, pool_size=1,
+                 pipelining=False, threads=0, throttle=None, queued=False, cache=None, refresh=None):
         """ Initialization function.
 
         Parameters:
@@ -21,6 +29,32 @@ class Bridge(object):
         ip : string
             IP address as dotted quad
         username : string, optional
+        pool_size : int, optional
+            Number of idle keep-alive connections to hold open to the bridge.
+            0 opens (and closes) a new connection for every request.
+        pipelining : bool, optional
+            Send multi-target commands back-to-back on one connection,
+            reading the responses afterwards (HTTP/1.1 pipelining).
+        threads : int, optional
+            Send multi-target commands from a pool of up to this many threads.
+            Any non-zero value also makes this Bridge (and the .Bridges using
+            it) safe to share between threads.
+        throttle : throttle.Throttle, optional
+            Rate limits for light and group commands; commands beyond them
+            are queued until the bridge can take them.
+        queued : bool, optional
+            Send light state and group action commands from a background
+            queue, merging newer commands into queued ones for the same
+            light or group (see dispatch.Dispatcher). These commands then
+            return straight away, with the response the bridge would give
+            if it accepts them. Use flush() to wait for them to be sent.
+        cache : cache.Cache, optional
+            Answer reads of lights, groups and sensors from what the bridge
+            last returned, for as long as each field stays fresh.
+        refresh : float, optional
+            Poll the lights, groups and sensors every this many seconds from
+            a background thread, and answer reads of them from the latest
+            poll without any request (see refresher.Refresher).
 
         """
 
@@ -28,18 +62,51 @@ class Bridge(object):
             self.config_file_path = config_file_path
         else:
             self.config_file_path = os.path.join(os.getcwd(), '.python_hue')
+        self.topology_file_path = self.config_file_path + '.topology'
+        self._revalidation = None  # (managers, snapshot, topology) to rebuild from, see bootstrap()
 
         self.ip = ip
         self.username = username
         if username is not None:
             self.api = '/api/' + username
         self._name = None
+        self.pool_size = pool_size
+        self.pool = None
+        self.pipelining = pipelining
+        self.pipeline_depth = 16  # requests in flight before reading responses
+        self.threads = threads
+        self.executor = None
+        if threads:
+            if threading is None:
+                raise PhueException(None, 'threads= needs the threading module')
+            self.lock = threading.RLock()
+            self.pool_size = max(pool_size, threads)
+        else:
+            self.lock = NullLock()
+        self.pool_lock = self.lock  # guards the connection pool and latency figures
+        self.latency = Latency(self.pool_lock)
+        self.identities = {}  # 'lights', 'groups', 'sensors' -> identity.IdentityMap shared by the .Bridges
+        self.throttle = throttle
+        self.cache = cache
+        if cache is not None and cache.stale is not None:
+            self._share_pool()  # stale entries are re-fetched from another thread
+        self.dispatcher = None
+        if queued:
+            from uPHue.dispatch import Dispatcher
+            self.dispatcher = Dispatcher(self)
 
         # self.minutes = 600 # these do not seem to be used anywhere?
         # self.seconds = 10
 
         self.connect()
 
+        self.refresher = None
+        if refresh is not None:
+            self._share_pool()
+            from uPHue.refresher import Refresher
+            self.refresher = Refresher(self, refresh)
+            self.refresher.start()
+
     @property
     def name(self):
         '''Get or set the name of the bridge [string]'''
@@ -53,42 +120,290 @@ class Bridge(object):
         self.put('/config', data)
 
     def get(self, req):
+        self._revalidated()
         return self.request('GET', self.api + req)
 
     def put(self, req, data):
-        return self.request('PUT', self.api + req, data)
+        undo = self._write_through(req, data)
+        if self.dispatcher is not None and self.dispatcher.accepts('PUT', req):
+            return self.dispatcher.enqueue(req, data)
+        response = self.request('PUT', self.api + req, data)
+        self._confirm(req, response, undo)
+        return response
 
     def post(self, req, data):
+        self._invalidate(req)
         return self.request('POST', self.api + req, data)
 
     def delete(self, req):
+        self._invalidate(req)
         return self.request('DELETE', self.api + req)
 
+    def _invalidate(self, req):
+        if self.refresher is not None:
+            self.refresher.expire(req)
+        if self.cache is not None:
+            self.cache.invalidate(req)
+
+    COLORMODE = {'xy': 'xy', 'ct': 'ct', 'hue': 'hs', 'sat': 'hs'}
+
+    def _write_through(self, req, data):
+        """ Apply a PUT to what is cached of its resource before it is sent,
+        so reads straight after it need no GET. Returns the changes that
+        undo it, per store, for _confirm() """
+        stores = [store for store in (self.refresher, self.cache) if store is not None]
+        if not stores:
+            return None
+        keys = tuple(part for part in req.split('/') if part)[2:]
+        changes = []
+        for key, value in data.items():
+            if key == 'transitiontime':
+                continue
+            if key == 'scene' or key.endswith('_inc'):
+                # the outcome isn't known until the bridge is asked
+                self._invalidate(req)
+                return None
+            changes.append((keys + (key,), value))
+            if key in self.COLORMODE and keys in (('state',), ('action',)):
+                changes.append((keys + ('colormode',), self.COLORMODE[key]))
+
+        from uPHue.cache import Cache
+        path = Cache.path(req)
+        undo = {}
+        for store in stores:
+            if path.startswith('/groups'):
+                store.discard('/lights')  # a group command changes its lights as well
+            changes_undo = store.update(path, changes)
+            if changes_undo is not None:
+                undo[store] = changes_undo
+                if 'transitiontime' in data:
+                    store.transitions.start(path, changes, changes_undo, data['transitiontime'] / 10.0)
+        return undo
+
+    def _confirm(self, req, response, undo):
+        """ Settle a written-through PUT against the bridge's response: keep
+        the values it reports, and roll back any field it returned an error for """
+        if not undo:
+            return
+        if not isinstance(response, list):
+            self._invalidate(req)
+            return
+        from uPHue.cache import Cache
+        path = Cache.path(req)
+        confirmed = []
+        failed = []
+        for item in response:
+            if 'success' in item:
+                for address, value in item['success'].items():
+                    keys = tuple(part for part in address.split('/') if part)
+                    if '/' + '/'.join(keys[:2]) == path and keys[-1] != 'transitiontime':
+                        confirmed.append((keys[2:], value))
+            elif 'error' in item:
+                address = item['error'].get('address', '')
+                failed.append(tuple(part for part in address.split('/') if part)[2:])
+        if not any(keys[-1] in self.COLORMODE for keys, value in confirmed):
+            # the colormode written through with a refused color goes too
+            failed.extend([keys[:-1] + ('colormode',) for keys in failed
+                           if keys and keys[-1] in self.COLORMODE])
+        for store, changes in undo.items():
+            rollback = [(keys, value) for keys, value in changes
+                        if any(keys[:len(error)] == error for error in failed)]
+            if rollback:
+                store.transitions.stop(path)
+            store.update(path, confirmed + rollback)
+
+    def read(self, req, field=None):
+        """ GET req - from the latest background refresh, or the cache if
+        field is fresh in it, before asking the bridge """
+        self._revalidated()
+        if self.refresher is not None:
+            data = self.refresher.get(req)
+            if data is not None:
+                return data
+        if self.cache is None:
+            return self.get(req)
+        return self.cache.lookup(self.cache.path(req), field, lambda: self.get(req))
+
+    def get_many(self, requests):
+        """ GET a list of reqs, returning the list of responses """
+        return self.request_many([('GET', self.api + req, None) for req in requests])
+
+    def read_many(self, requests, field=None):
+        """ As get_many(), but from the cache where field is fresh in it """
+        self._revalidated()
+        if self.refresher is not None:
+            responses = [self.refresher.get(req) for req in requests]
+            if None not in responses:
+                return responses
+        if self.cache is None:
+            return self.get_many(requests)
+        paths = [self.cache.path(req) for req in requests]
+        responses = [self.cache.get(path, field) for path in paths]
+        misses = [i for i, response in enumerate(responses) if response is None]
+        self.cache.hits += len(requests) - len(misses)
+        self.cache.misses += len(misses)
+        for i, response in zip(misses, self.get_many([requests[i] for i in misses])):
+            self.cache.store(paths[i], response)
+            responses[i] = response
+        return responses
+
+    def put_many(self, requests):
+        """ PUT a list of (req, data) pairs, returning the list of responses """
+        if self.dispatcher is not None:
+            return [self.put(req, data) for req, data in requests]
+        undos = [self._write_through(req, data) for req, data in requests]
+        responses = self.request_many([('PUT', self.api + req, data) for req, data in requests])
+        for (req, data), response, undo in zip(requests, responses, undos):
+            self._confirm(req, response, undo)
+        return responses
+
+    def _pool(self):
+        with self.pool_lock:
+            if self.pool is None or self.pool.host != self.ip:
+                if self.pool is not None:
+                    self.pool.close()
+                self.pool = Pool(self.ip, self.pool_size, lock=self.pool_lock)
+            return self.pool
+
+    def _share_pool(self):
+        """ Make the connection pool and latency figures safe to use from a
+        background thread as well as the caller's, even without threads= """
+        if threading is None or not isinstance(self.pool_lock, NullLock):
+            return
+        self.pool_lock = threading.RLock()
+        self.latency.lock = self.pool_lock
+        if self.pool is not None:
+            self.pool.lock = self.pool_lock
+
+    @staticmethod
+    def _body(mode, data):
+        if mode == 'PUT' or mode == 'POST':
+            return json.dumps(data).encode('utf-8')  # bytes go out with the headers
+        return None
+
+    @staticmethod
+    def _response(response):
+        response = response.decode('utf-8')
+        logger.debug(response)
+        return json.loads(response)
+
     def request(self, mode='GET', address=None, data=None):
         """ Utility function for HTTP GET/PUT requests for the API"""
-        connection = httplib.HTTPConnection(self.ip, timeout=10)
-
+        pool = self._pool()
+        if self.throttle is not None:
+            self.throttle.wait(mode, address)
+        start = time.time()
         try:
-            if mode == 'GET' or mode == 'DELETE':
-                connection.request(mode, address)
-            if mode == 'PUT' or mode == 'POST':
-                connection.request(mode, address, json.dumps(data))
-
+            response = pool.request(mode, address, self._body(mode, data))
             logger.debug("{0} {1} {2}".format(mode, address, str(data)))
 
         except socket.timeout:
             error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
 
             logger.exception(error)
+            if self.throttle is not None:
+                self.throttle.observe(mode, address, None, None)
             raise PhueRequestTimeout(None, error)
 
-        result = connection.getresponse()
-        response = result.read()
-        connection.close()
-        response = response.decode('utf-8')
+        elapsed = time.time() - start
+        self.latency.record(elapsed)
+        response = self._response(response)
+        if self.throttle is not None:
+            self.throttle.observe(mode, address, elapsed, response)
+        return response
 
-        logger.debug(response)
-        return json.loads(response)
+    def request_many(self, requests):
+        """ Send a list of (mode, address, data) requests, returning the list of responses.
+
+        With pipelining enabled the requests don't wait on each other's
+        responses, so a batch costs about one round trip instead of one each.
+        Otherwise, with threads enabled, up to that many are sent at once.
+
+        """
+        if len(requests) < 2 or not (self.pipelining or self.threads):
+            return [self.request(mode, address, data) for mode, address, data in requests]
+        if not self.pipelining:
+            return list(self._executor().map(lambda r: self.request(*r), requests))
+        if self.throttle is None:
+            return self._pipeline(requests)
+
+        # Pipeline whatever the throttle lets through now, then wait for the rest
+        responses = []
+        batch = []
+        for request in requests:
+            delay = self.throttle.reserve(request[0], request[1])
+            if delay > 0:
+                start = time.time()
+                responses.extend(self._pipeline(batch))
+                batch = []
+                time.sleep(max(0.0, delay - (time.time() - start)))
+            batch.append(request)
+        responses.extend(self._pipeline(batch))
+        return responses
+
+    def _pipeline(self, requests):
+        if not requests:
+            return []
+        pool = self._pool()
+        start = time.time()
+        try:
+            responses = pool.pipeline(
+                [(mode, address, self._body(mode, data)) for mode, address, data in requests],
+                self.pipeline_depth)
+            for mode, address, data in requests:
+                logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+
+        except socket.timeout:
+            error = "Pipelined requests to {} timed out.".format(self.ip)
+
+            logger.exception(error)
+            if self.throttle is not None:
+                self.throttle.observe(requests[0][0], requests[0][1], None, None)
+            raise PhueRequestTimeout(None, error)
+
+        elapsed = (time.time() - start) / len(requests)
+        responses = [self._response(response) for response in responses]
+        for request, response in zip(requests, responses):
+            self.latency.record(elapsed)
+            if self.throttle is not None:
+                self.throttle.observe(request[0], request[1], elapsed, response)
+        return responses
+
+    @property
+    def capacity(self):
+        '''Get the commands per second the throttle currently allows, or None if unthrottled [dict]'''
+        if self.throttle is None:
+            return None
+        return self.throttle.capacity
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=self.threads)
+            return self.executor
+
+    def flush(self, timeout=None):
+        """ Wait for queued commands to be sent. Returns False if that didn't
+        happen within timeout seconds """
+        if self.dispatcher is None:
+            return True
+        return self.dispatcher.flush(timeout)
+
+    def close(self):
+        """ Send any queued commands, stop refreshing, shut down the threads
+        sending multi-target commands, and close any kept-alive connections
+        to the bridge """
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        if self.refresher is not None:
+            self.refresher.stop()
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+        if self.pool is not None:
+            self.pool.close()
 
     def get_ip_address(self, set_result=False):
 
@@ -172,3 +487,146 @@ class Bridge(object):
     def get_api(self):
         """ Returns the full api dictionary """
         return self.get('')
+
+    # What is kept on disk of each collection, to warm start from
+    TOPOLOGY = {
+        'lights': ('name', 'type', 'modelid', 'uniqueid'),
+        'groups': ('name', 'type', 'lights'),
+        'sensors': ('name', 'type', 'modelid', 'uniqueid'),
+        'scenes': ('name', 'group', 'lights'),
+    }
+
+    @staticmethod
+    def topology(snapshot):
+        """ The part of a datastore snapshot that only changes when lights,
+        groups, sensors or scenes are added, removed or renamed """
+        topology = {}
+        for collection, fields in Bridge.TOPOLOGY.items():
+            topology[collection] = dict(
+                (key, dict((field, value[field]) for field in fields if field in value))
+                for key, value in snapshot.get(collection, {}).items())
+        return topology
+
+    def load_topology(self):
+        """ The topology saved for this bridge, or None """
+        try:
+            with open(self.topology_file_path) as f:
+                saved = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        return saved.get(self.ip)
+
+    def save_topology(self, topology):
+        with open(self.topology_file_path, 'w') as f:
+            f.write(json.dumps({self.ip: topology}))
+
+    def bootstrap(self, *managers, warm=False):
+        """ Fetch the whole datastore with a single GET /api, and have each of
+        managers (Light.Bridge, Group.Bridge, Sensor.Bridge, Scene.Bridge, ...)
+        build its indexes and objects from it instead of fetching its own.
+        With a cache every collection is stored in it too, so the first reads
+        of lights, groups, sensors, scenes and schedules cost nothing.
+        Without one, the managers' indexes (names, membership, scenes) are
+        built, and Schedule.Bridge answers its next get_schedule() from the
+        snapshot, but reads of light and group state go to the bridge, as
+        nothing else would tell when they had become stale.
+
+        >>> lb, sb = Light.Bridge(b), Sensor.Bridge(b)
+        >>> b.bootstrap(lb, sb)
+
+        The topology (ids, names, types, group membership, scenes) is saved
+        next to the config file. With warm=True the managers are built from
+        that saved topology straight away, without waiting on the bridge;
+        it is then checked against the bridge in the background, and if
+        anything has changed the managers are rebuilt on the next read
+        through this Bridge (from the thread making it).
+
+        Returns the snapshot: a dict of collection name ('lights', 'groups',
+        'sensors', 'scenes', 'schedules', 'config', ...) -> its contents
+        (just the topology collections, if warm started).
+
+        """
+        if warm:
+            topology = self._warm_start(managers)
+            if topology is not None:
+                self._revalidate(managers, topology)
+                return topology
+
+        snapshot = self.get_api()
+        self._bootstrapped(managers, snapshot)
+        return snapshot
+
+    def _warm_start(self, managers):
+        topology = self.load_topology()
+        if topology is not None:
+            for manager in managers:
+                if hasattr(manager, 'populate'):
+                    manager.populate(topology)
+            logger.debug("Warm started {0} managers from {1}".format(
+                len(managers), self.topology_file_path))
+        return topology
+
+    def _bootstrapped(self, managers, snapshot):
+        if not isinstance(snapshot, dict):
+            raise PhueException(snapshot[0]['error']['type'],
+                                'Unable to fetch the datastore: ' + snapshot[0]['error']['description'])
+        self._populate(managers, snapshot)
+        logger.debug("Bootstrapped {0} managers from one GET /api".format(len(managers)))
+
+    def _populate(self, managers, snapshot, topology=None):
+        if self.cache is not None:
+            for collection, data in snapshot.items():
+                self.cache.store('/' + collection, data)
+        current = self.topology(snapshot)
+        if current == topology:
+            return
+        for manager in managers:
+            if hasattr(manager, 'populate'):
+                manager.populate(snapshot)
+        try:
+            self.save_topology(current)
+        except OSError:
+            logger.info('Unable to write ' + self.topology_file_path)
+
+    def _revalidate(self, managers, topology):
+        # Only the collections the topology covers are fetched, which is
+        # much less than GET /api (no rules, schedules, resourcelinks or
+        # config). The fetch runs in the background, but the rebuild is
+        # left to _revalidated(), as the managers' indexes are not locked.
+        def check():
+            try:
+                responses = self.get_many(['/' + collection for collection in sorted(self.TOPOLOGY)])
+                self._checked(managers, topology, responses)
+            except Exception:
+                logger.exception('Unable to check the saved topology against the bridge')
+
+        if threading is None:
+            check()
+            self._revalidated()
+            return
+        self._share_pool()
+        thread = threading.Thread(target=check)
+        thread.daemon = True
+        thread.start()
+
+    def _checked(self, managers, topology, responses):
+        """ Keep the responses to the topology check for _revalidated(),
+        if every collection came back """
+        snapshot = dict((collection, data) for collection, data in zip(sorted(self.TOPOLOGY), responses)
+                        if isinstance(data, dict))
+        if len(snapshot) == len(self.TOPOLOGY):
+            self._revalidation = (managers, snapshot, topology)
+
+    def _revalidated(self):
+        """ Rebuild the managers from the background check of the saved
+        topology, if it has finished since the last call """
+        if self._revalidation is None:
+            return
+        with self.lock:
+            revalidation, self._revalidation = self._revalidation, None
+        if revalidation is None:
+            return
+        managers, snapshot, topology = revalidation
+        if self.topology(snapshot) != topology:
+            logger.info('Bridge topology has changed since it was saved, rebuilding')
+        self._populate(managers, snapshot, topology)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from uPHue import *
+from uPHue.pool import NullLock
+
+try:
+    import threading
+except ImportError:
+    threading = None
+
+
+MISSING = object()  # stands for a field that isn't there, in undo lists
+
+
+def patch(data, changes):
+    """ A copy of data with each (keys, value) of changes applied, keys being
+    the path to a field within it, e.g. ('state', 'bri'). Only the dicts along
+    the way are copied; data itself is left alone. A value of MISSING removes
+    the field. Returns (copy, undo), undo being the changes that reverse them """
+    data = dict(data)
+    undo = []
+    for keys, value in changes:
+        node = data
+        for key in keys[:-1]:
+            child = node.get(key)
+            node[key] = dict(child) if isinstance(child, dict) else {}
+            node = node[key]
+        undo.append((keys, node.get(keys[-1], MISSING)))
+        if value is MISSING:
+            node.pop(keys[-1], None)
+        else:
+            node[keys[-1]] = value
+    undo.reverse()
+    return data, undo
+
+
+def field(data, keys):
+    """ data[keys[0]][keys[1]]..., or MISSING """
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return MISSING
+        data = data[key]
+    return data
+
+
+class Transitions(object):
+
+    """ The fades lights and groups are going through, so their current
+    state can be predicted rather than polled while they last
+
+    A command with a transitiontime has the bridge move each of bri, hue,
+    sat, ct and xy from its start value to its target over that time. This
+    keeps the start and target of each, and when the fade started, and
+    interpolates between them for reads during it. Whenever a real value
+    comes back from the bridge, it replaces the start value from then on.
+
+    Reads take the current dict of fades without locking; changes copy it
+    under a lock, so that writers on different threads don't lose each
+    other's fades.
+
+    """
+
+    FIELDS = ('bri', 'hue', 'sat', 'ct', 'xy')
+
+    def __init__(self):
+        self._active = {}  # path -> (start time, duration, {keys: (start, target)})
+        self._lock = threading.Lock() if threading is not None else NullLock()
+
+    def __len__(self):
+        return len(self._active)
+
+    def start(self, path, changes, undo, duration):
+        """ Record a fade of path to changes over duration seconds,
+        from the values in undo (as returned by patch()) """
+        previous = dict(undo)
+        fields = {}
+        for keys, target in changes:
+            start = previous.get(keys, MISSING)
+            if keys[-1] in self.FIELDS and start is not MISSING and start != target:
+                fields[keys] = (start, target)
+        with self._lock:
+            active = dict(self._active)
+            if fields and duration > 0:
+                active[path] = (time.time(), duration, fields)
+            else:
+                active.pop(path, None)
+            self._active = active
+
+    def stop(self, path):
+        with self._lock:
+            if path in self._active:
+                active = dict(self._active)
+                active.pop(path, None)
+                self._active = active
+
+    @staticmethod
+    def interpolate(name, start, target, fraction):
+        if name == 'xy':
+            return [round(a + (b - a) * fraction, 4) for a, b in zip(start, target)]
+        if name == 'hue':
+            # hue is an angle, so take the short way round
+            delta = (target - start + 32768) % 65536 - 32768
+            return int(round(start + delta * fraction)) % 65536
+        return int(round(start + (target - start) * fraction))
+
+    def predict(self, path, data):
+        """ data, with what path is fading predicted for now """
+        transition = self._active.get(path)
+        if transition is None or data is None:
+            return data
+        started, duration, fields = transition
+        fraction = (time.time() - started) / duration
+        if fraction >= 1:
+            self.stop(path)
+            return data
+        return patch(data, [(keys, self.interpolate(keys[-1], start, target, fraction))
+                            for keys, (start, target) in fields.items()])[0]
+
+    def correct(self, path, data):
+        """ Restart a fade from what the bridge has just reported for path """
+        with self._lock:
+            transition = self._active.get(path)
+            if transition is None:
+                return
+            started, duration, fields = transition
+            now = time.time()
+            remaining = started + duration - now
+            corrected = {}
+            for keys, (start, target) in fields.items():
+                actual = field(data, keys)
+                if actual is not MISSING and actual != target:
+                    corrected[keys] = (actual, target)
+            active = dict(self._active)
+            if remaining > 0 and corrected:
+                active[path] = (now, remaining, corrected)
+            else:
+                active.pop(path, None)
+            self._active = active
+
+
+class Cache(object):
+
+    """ Read-through cache of what the bridge last said about each resource
+
+    Resources (e.g. '/lights/1') are kept whole, as the bridge returns them,
+    but how long they stay fresh depends on which field is being read:
+
+     * Fields that never change (type, uniqueid, ...) are kept indefinitely
+     * Everything else is fresh for `ttl` seconds, unless `policies` says
+       otherwise (a dict of field -> seconds, or None for indefinitely)
+     * With `stale` set, a value up to `stale` seconds past its ttl is
+       returned straight away while it is re-fetched in the background
+
+    So reading several properties of a Light in a row costs at most one
+    request:
+
+    >>> b = Bridge(ip='192.168.1.100', cache=Cache(ttl=1.0))
+
+    """
+
+    STATIC = ('type', 'uniqueid', 'swversion', 'modelid', 'manufacturername',
+              'productname', 'productid', 'luminaireuniqueid')
+
+    def __init__(self, ttl=1.0, stale=None, policies=None):
+        self.ttl = ttl
+        self.stale = stale
+        self.policies = dict((field, None) for field in Cache.STATIC)
+        if policies is not None:
+            self.policies.update(policies)
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # path -> (time fetched, data)
+        self._refreshing = set()
+        self.transitions = Transitions()
+
+    def __repr__(self):
+        return '<{0}.{1} entries={2} hits={3} misses={4}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            len(self._entries),
+            self.hits,
+            self.misses)
+
+    @staticmethod
+    def path(req):
+        """ The resource a request is about: '/lights/1/state' -> '/lights/1' """
+        parts = [part for part in req.split('/') if part]
+        return '/' + '/'.join(parts[:2])
+
+    def policy(self, field):
+        """ How long a field stays fresh, in seconds (None for indefinitely) """
+        return self.policies.get(field, self.ttl)
+
+    def get(self, path, field=None):
+        """ The cached data for path if field is still fresh, otherwise None """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        ttl = self.policy(field)
+        if ttl is not None and time.time() - entry[0] > ttl:
+            return None
+        return self.transitions.predict(path, entry[1])
+
+    def store(self, path, data):
+        """ Remember what the bridge returned for path. A collection
+        ('/lights') also stores each of its members ('/lights/1', ...) """
+        if not isinstance(data, dict):
+            return  # an error response
+        now = time.time()
+        self._entries[path] = (now, data)
+        self.transitions.correct(path, data)
+        if path.count('/') == 1:
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    self._entries[path + '/' + key] = (now, value)
+                    self.transitions.correct(path + '/' + key, value)
+
+    def invalidate(self, req=None):
+        """ Forget what a request (or, by default, everything) could have changed """
+        if req is None:
+            self._entries = {}
+            return
+        path = self.path(req)
+        collection = path[:path.index('/', 1)] if path.count('/') > 1 else path
+        self._entries.pop(path, None)
+        self._entries.pop(collection, None)
+        if collection == '/groups':
+            # a group command changes its lights as well
+            self.discard('/lights')
+
+    def update(self, path, changes):
+        """ Apply changes (see patch()) to what is cached for path, keeping
+        it as fresh as it was. Returns the changes that would undo them,
+        or None if path isn't cached """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        data, undo = patch(entry[1], changes)
+        self._entries[path] = (entry[0], data)
+        collection, _, key = path.rpartition('/')
+        if collection in self._entries:
+            members = dict(self._entries[collection][1])
+            members[key] = data
+            self._entries[collection] = (self._entries[collection][0], members)
+        return undo
+
+    def discard(self, prefix):
+        """ Forget every path starting with prefix """
+        self._entries = dict((key, entry) for key, entry in self._entries.items()
+                             if not key.startswith(prefix))
+
+    def lookup(self, path, field, fetch):
+        """ The data for path, from the cache if field is fresh enough,
+        otherwise from fetch() (which should GET it from the bridge) """
+        data = self.get(path, field)
+        if data is not None:
+            self.hits += 1
+            return data
+        if self.stale is not None:
+            entry = self._entries.get(path)
+            ttl = self.policy(field)
+            if entry is not None and time.time() - entry[0] <= ttl + self.stale:
+                self.hits += 1
+                self._revalidate(path, fetch)
+                return self.transitions.predict(path, entry[1])
+        self.misses += 1
+        data = fetch()
+        self.store(path, data)
+        return data
+
+    def _revalidate(self, path, fetch):
+        if path in self._refreshing:
+            return
+        self._refreshing.add(path)
+
+        def refresh():
+            try:
+                self.store(path, fetch())
+            except Exception:
+                logger.exception("Background refresh of {0} failed".format(path))
+            finally:
+                self._refreshing.discard(path)
+
+        if threading is None:
+            refresh()
+        else:
+            thread = threading.Thread(target=refresh)
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from uPHue import *
+
+
+class Changes(object):
+
+    """ What a refresh of the lights, groups or sensors found had changed
+    since they were last indexed
+
+    added : list of (collection, id, name)
+    removed : list of (collection, id, name)
+    renamed : list of (collection, id, old name, new name)
+
+    A resource whose type has changed (e.g. a bulb swapped for another
+    kind under the same id) is reported as removed and added.
+
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.renamed = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.renamed)
+
+    def __repr__(self):
+        return '<{0}.{1} added={2} removed={3} renamed={4}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            len(self.added),
+            len(self.removed),
+            len(self.renamed))
+
+    @staticmethod
+    def known(current):
+        """ id -> (name, type) for a collection as the bridge returns it """
+        return dict((int(key), (item.get('name'), item.get('type')))
+                    for key, item in current.items() if isinstance(item, dict))
+
+    def diff(self, collection, known, current):
+        """ Compare known (as from Changes.known()) with current, a collection
+        as the bridge returns it. Returns the new known dict """
+        now = self.known(current)
+        for key in sorted(known):
+            if key not in now or now[key][1] != known[key][1]:
+                self.removed.append((collection, key, known[key][0]))
+        for key in sorted(now):
+            if key not in known or now[key][1] != known[key][1]:
+                self.added.append((collection, key, now[key][0]))
+            elif now[key][0] != known[key][0]:
+                self.renamed.append((collection, key, known[key][0], now[key][0]))
+        return now
+
+    def notify(self, listeners):
+        """ Call each listener(collection, event, id, name) for every change,
+        event being 'removed', 'added' or 'renamed' """
+        events = [('removed', change) for change in self.removed] + \
+                 [('added', change) for change in self.added] + \
+                 [('renamed', change) for change in self.renamed]
+        for event, change in events:
+            for listener in listeners:
+                try:
+                    listener(change[0], event, change[1], change[-1])
+                except Exception:
+                    logger.exception("Listener failed on {0} {1}".format(event, change))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from uPHue import *
+from uPHue.throttle import command_kind
+
+try:
+    import threading
+except ImportError:
+    threading = None
+
+
+class Dispatcher(object):
+
+    """ Sends light state and group action commands from a queue, last write wins
+
+    Each light or group has at most one queued command. A newer command for
+    the same light or group is merged into the queued one, so values that
+    have been superseded before they were sent are dropped. The queue thus
+    never holds more commands than there are lights and groups, however fast
+    they are written (e.g. from a brightness slider).
+
+    Commands are sent, oldest first, by a background thread, at whatever pace
+    the Bridge's throttle allows. Errors from the bridge are logged.
+
+    """
+
+    def __init__(self, bridge):
+        if threading is None:
+            raise PhueException(None, 'queued=True needs the threading module')
+        self.bridge = bridge
+        self.merged = 0  # number of commands folded into a queued one
+        self._pending = {}
+        self._order = []
+        self._sending = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def accepts(self, mode, address):
+        return command_kind(mode, address) is not None
+
+    def enqueue(self, req, data):
+        """ Queue a PUT of data to req (e.g. '/lights/1/state'). Returns the
+        response the bridge would give if it accepts the command """
+        with self._condition:
+            if req in self._pending:
+                merge_state(self._pending[req], data)
+                self.merged += 1
+            else:
+                self._pending[req] = dict(data)
+                self._order.append(req)
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+        # the bridge reports addresses from below /api/<username>, and
+        # leaves transitiontime out
+        return [{'success': {req + '/' + key: value}} for key, value in data.items()
+                if key != 'transitiontime']
+
+    def flush(self, timeout=None):
+        """ Wait until everything queued has been sent.
+        Returns False if that didn't happen within timeout seconds """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._sending, timeout)
+
+    def stop(self, timeout=None):
+        """ Send what is queued, then end the background thread (a later
+        command starts it again) """
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    self._thread = None
+                    return
+                req = self._order.pop(0)
+                data = self._pending.pop(req)
+                self._sending += 1
+            try:
+                result = self.bridge.request('PUT', self.bridge.api + req, data)
+                for response in result:
+                    if 'error' in response:
+                        logger.warn("ERROR: {0} for {1}".format(
+                            response['error']['description'], req))
+                        # what was written through is wrong; fetch it afresh
+                        self.bridge._invalidate(req)
+            except Exception:
+                logger.exception("Queued PUT to {0} failed".format(req))
+            finally:
+                with self._condition:
+                    self._sending -= 1
+                    self._condition.notify_all()
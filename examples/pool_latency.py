@@ -0,0 +1,44 @@
+#!/usr/bin/python
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from uPHue.bridge import Bridge
+
+'''
+This example compares per-request latency with and without keep-alive
+connections, against a local stand-in for the bridge.
+Pass a real bridge's ip and username to Bridge() to measure that instead.
+'''
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        body = json.dumps([{'success': {self.path: True}}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = reply
+
+
+server = HTTPServer(('127.0.0.1', 0), StandIn)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+ip = '127.0.0.1:{0}'.format(server.server_address[1])
+
+for pool_size in (0, 1):
+    b = Bridge(ip=ip, username='stand-in', pool_size=pool_size)
+    for i in range(200):
+        b.put('/lights/1/state', {'bri': i % 254})
+    print('pool_size={0}: {1} connections, {2}'.format(
+        pool_size, b.pool.connects, b.latency))
+    b.close()
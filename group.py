@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from uPHue import *
+from uPHue.changes import Changes
+from uPHue.identity import shared
+from uPHue.names import NameIndex
+from uPHue.query import select
 from uPHue.light import Light
 
 
@@ -25,19 +29,28 @@ class Group(Light):
 
         def __init__(self, bridge):
             Light.Bridge.__init__(self, bridge)
+            self.group_names = NameIndex(lambda: self.get_group())
+            self._groups = shared(bridge, 'groups', lambda group_id: Group(self, group_id))
+            self._membership = None  # group id -> light ids
+            self._groups_of = None  # light id -> group ids
+            self._known_groups = {}  # id -> (name, type) as last indexed
 
         @property
         def groups(self):
             """ Access groups as a list """
-            return [Group(self, int(groupid)) for groupid in self.get_group().keys()]
+            return [self.group(groupid) for groupid in self.get_group().keys()]
+
+        def group(self, group_id):
+            """ The Group object for group_id: the same one for as long as it's in use """
+            return self._groups.get(int(group_id))
 
         def get_group_id_by_name(self, name):
-            """ Lookup a group id based on string name. Case-sensitive. """
-            groups = self.get_group()
-            for group_id in groups:
-                if name == groups[group_id]['name']:
-                    return int(group_id)
-            return False
+            """ Lookup a group id based on string name. Case-sensitive,
+            unless group_names.ignore_case is set """
+            group_id = self.group_names.lookup(name)
+            if group_id is False:
+                return False
+            return int(group_id)
 
         def get_group(self, group_id=None, parameter=None):
             if is_string(group_id):
@@ -46,13 +59,13 @@ class Group(Light):
                 logger.error('Group name does not exist')
                 return
             if group_id is None:
-                return self.bridge.get('/groups/')
+                return self.bridge.read('/groups/')
             if parameter is None:
-                return self.bridge.get('/groups/' + str(group_id))
+                return self.bridge.read('/groups/' + str(group_id))
             elif parameter == 'name' or parameter == 'lights':
-                return self.bridge.get('/groups/' + str(group_id))[parameter]
+                return self.bridge.read('/groups/' + str(group_id), parameter)[parameter]
             else:
-                return self.bridge.get('/groups/' + str(group_id))['action'][parameter]
+                return self.bridge.read('/groups/' + str(group_id), parameter)['action'][parameter]
 
         def set_group(self, group_id, parameter, value=None, transitiontime=None):
             """ Change light settings for a group
@@ -79,20 +92,30 @@ class Group(Light):
             group_id_array = group_id
             if isinstance(group_id, int) or is_string(group_id):
                 group_id_array = [group_id]
-            result = []
+            found = self.group_names.resolve([group for group in group_id_array if is_string(group)])
+            requests = []
+            converted_groups = []
             for group in group_id_array:
                 logger.debug(str(data))
                 if is_string(group):
-                    converted_group = self.get_group_id_by_name(group)
+                    converted_group = found[group]
                 else:
                     converted_group = group
                 if converted_group is False:
                     logger.error('Group name does not exist')
                     return
+                converted_groups.append(int(converted_group))
                 if parameter == 'name' or parameter == 'lights':
-                    result.append(self.bridge.put('/groups/' + str(converted_group), data))
+                    requests.append(('/groups/' + str(converted_group), data))
                 else:
-                    result.append(self.bridge.put('/groups/' + str(converted_group) + '/action', data))
+                    requests.append(('/groups/' + str(converted_group) + '/action', data))
+            result = self.bridge.put_many(requests)
+            if 'name' in data:
+                self.group_names.invalidate()
+            if 'lights' in data:
+                for converted_group, response in zip(converted_groups, result):
+                    if not any('error' in item for item in response):
+                        self._set_members(converted_group, data['lights'])
 
             if 'error' in list(result[-1][0].keys()):
                 logger.warn("ERROR: {0} for group {1}".format(
@@ -113,10 +136,278 @@ class Group(Light):
 
             """
             data = {'lights': [str(x) for x in lights], 'name': name}
-            return self.bridge.post('/groups/', data)
+            self.group_names.invalidate()
+            result = self.bridge.post('/groups/', data)
+            if 'success' in result[0]:
+                self._set_members(int(result[0]['success']['id']), data['lights'])
+            return result
 
         def delete_group(self, group_id):
-            return self.bridge.delete('/groups/' + str(group_id))
+            self.group_names.invalidate()
+            self._groups.discard(int(group_id))
+            result = self.bridge.delete('/groups/' + str(group_id))
+            if 'success' in result[0]:
+                self._set_members(int(group_id), None)
+            return result
+
+        def get_membership(self, refresh=False):
+            """ Returns a dict of group id -> list of the light ids in it, including
+            group 0 (all lights). Fetched once, then cached until refresh=True """
+            if refresh or self._membership is None:
+                self._index_members(self.get_group(), self.get_light())
+            return self._membership
+
+        def where_groups(self, **criteria):
+            """ Select groups by their fields, e.g. where_groups(type='Room'),
+            as where() does lights. Returns a query.Selection """
+            return select(self, 'groups', self.get_group()).where(**criteria)
+
+        def _in_groups(self, groups):
+            """ The ids of the lights in any of groups (ids or names) """
+            if not isinstance(groups, (list, tuple, set, frozenset)):
+                groups = [groups]
+            membership = self.get_membership()
+            ids = set()
+            for group in groups:
+                group_id = self.get_group_id_by_name(group) if is_string(group) else int(group)
+                ids.update(membership.get(group_id, ()))
+            return ids
+
+        def get_groups_of(self, light_id):
+            """ Returns the ids of the groups a light (id or name) is in,
+            including group 0, from the same index as get_membership() """
+            if is_string(light_id):
+                light_id = self.get_light_ids([light_id])[light_id]
+            self.get_membership()
+            return sorted(self._groups_of.get(int(light_id), ()))
+
+        def refresh(self):
+            """ Bring the light and group indexes (names, membership) up to date
+            with the bridge, as Light.Bridge.refresh() does for lights """
+            lights, groups = self.bridge.get_many(['/lights/', '/groups/'])
+            changes = Changes()
+            self._refresh(changes, lights)
+            if not isinstance(groups, dict):
+                raise PhueException(groups[0]['error']['type'],
+                                    'Unable to refresh groups: ' + groups[0]['error']['description'])
+            self._known_groups = changes.diff('groups', self._known_groups, groups)
+            for collection, group_id, name in changes.removed:
+                if collection == 'groups':
+                    self._groups.discard(group_id)
+            self.group_names.build(groups)
+            if self._membership is not None:
+                self._index_members(groups, lights)
+            changes.notify(self.listeners)
+            return changes
+
+        def _index_members(self, groups, lights):
+            membership = dict((int(group_id), sorted(int(light) for light in groups[group_id]['lights']))
+                              for group_id in groups)
+            membership[0] = sorted(int(light) for light in lights)
+            groups_of = {}
+            for group_id, members in membership.items():
+                for light in members:
+                    groups_of.setdefault(light, set()).add(group_id)
+            with self.bridge.lock:
+                self._membership, self._groups_of = membership, groups_of
+                self._known_groups = Changes.known(groups)
+
+        def _set_members(self, group_id, lights):
+            """ Record in the membership index that a group now has lights
+            (None: that it has been deleted) """
+            if self._membership is None:
+                return
+            with self.bridge.lock:
+                for light in self._membership.pop(group_id, ()):
+                    self._groups_of[light].discard(group_id)
+                if lights is not None:
+                    self._membership[group_id] = sorted(int(light) for light in lights)
+                    for light in self._membership[group_id]:
+                        self._groups_of.setdefault(light, set()).add(group_id)
+
+        def populate(self, snapshot):
+            """ Build the light index and group membership from a full
+            datastore snapshot (see Bridge.bootstrap()) rather than fetching them """
+            Light.Bridge.populate(self, snapshot)
+            self.group_names.build(snapshot.get('groups', {}))
+            self._index_members(snapshot.get('groups', {}), snapshot.get('lights', {}))
+
+        @staticmethod
+        def _key(state):
+            return tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                                for k, v in state.items()))
+
+        def plan(self, states, membership=None, light_cost=None, group_cost=None):
+            """ Work out how to reach a state per light with as few commands as possible.
+
+            states : dict of light id -> state dict
+            membership : dict of group id -> light ids, see get_membership()
+            light_cost, group_cost : what one light or group command costs;
+                                     by default the time the throttle spaces
+                                     them by (0.1s and 1s without one)
+
+            Returns a list of ('groups', group_id, state) commands, to be sent in
+            order, followed by ('lights', light_id, state) fix-ups, that together
+            leave every light in exactly its state and no other light touched.
+            A group is only used if all its lights are in states, and only for
+            lights whose state either matches or overwrites everything it sets.
+
+            """
+            if membership is None:
+                membership = self.get_membership()
+            capacity = self.bridge.capacity or {'lights': 10.0, 'groups': 1.0}
+            if light_cost is None:
+                light_cost = 1.0 / capacity['lights']
+            if group_cost is None:
+                group_cost = 1.0 / capacity['groups']
+
+            states = dict((int(light), state) for light, state in states.items())
+            keys = dict((light, self._key(state)) for light, state in states.items())
+
+            candidates = []
+            for group_id, lights in membership.items():
+                if not lights or any(light not in states for light in lights):
+                    continue
+                for light in set(lights):
+                    state = states[light]
+                    candidate = (group_id, keys[light], state)
+                    if candidate[:2] in [c[:2] for c in candidates]:
+                        continue
+                    # every other light in the group must overwrite what this sets
+                    if all(keys[other] == keys[light] or set(state) <= set(states[other])
+                           for other in lights):
+                        candidates.append(candidate)
+
+            def fixups(actions):
+                final = {}
+                for group_id, key, state in actions:
+                    for light in membership[group_id]:
+                        final[light] = key
+                return [light for light in sorted(states) if final.get(light) != keys[light]]
+
+            actions = []
+            best = len(states) * light_cost
+            while True:
+                choice = None
+                for candidate in candidates:
+                    cost = (len(actions) + 1) * group_cost + \
+                        len(fixups(actions + [candidate])) * light_cost
+                    if cost < best:
+                        best, choice = cost, candidate
+                if choice is None:
+                    break
+                actions.append(choice)
+
+            return [('groups', group_id, state) for group_id, key, state in actions] + \
+                [('lights', light, states[light]) for light in fixups(actions)]
+
+        def set_lights_planned(self, states, transitiontime=None, membership=None):
+            """ Like set_lights(), but sends group commands wherever they save
+            commands overall (see plan()). Lights whose group command fails
+            are sent their own command instead. Returns a Light.Result for
+            the per-light commands """
+            light_ids = self.get_light_ids(states)
+            unknown = [light for light in light_ids if light_ids[light] is False]
+            if unknown:
+                logger.warn("Lights not available: {0}".format(unknown))
+            targets = dict((int(light_ids[light]), state) for light, state in states.items()
+                           if light_ids[light] is not False)
+            if membership is None:
+                membership = self.get_membership()
+
+            fix = {}
+            for kind, target, state in self.plan(targets, membership):
+                if kind == 'lights':
+                    fix[target] = state
+                    continue
+                data = dict(state)
+                if transitiontime is not None and 'transitiontime' not in data:
+                    data['transitiontime'] = int(round(transitiontime))
+                response = self.bridge.put('/groups/' + str(target) + '/action', data)
+                if any('error' in item for item in response):
+                    logger.warn("ERROR: group {0} command failed, setting its lights one by one".format(target))
+                    for light in membership[target]:
+                        fix[light] = targets[light]
+            return self.set_lights(fix, transitiontime)
+
+    class AsyncBridge(Light.AsyncBridge):
+
+        """ The asyncio counterpart of Group.Bridge, for use with an AsyncBridge """
+
+        async def get_group_id_by_name(self, name):
+            """ Lookup a group id based on string name. Case-sensitive. """
+            groups = await self.get_group()
+            for group_id in groups:
+                if name == groups[group_id]['name']:
+                    return int(group_id)
+            return False
+
+        async def get_group(self, group_id=None, parameter=None):
+            if is_string(group_id):
+                group_id = await self.get_group_id_by_name(group_id)
+            if group_id is False:
+                logger.error('Group name does not exist')
+                return
+            if group_id is None:
+                return await self.bridge.get('/groups/')
+            group = await self.bridge.get('/groups/' + str(group_id))
+            if parameter is None:
+                return group
+            elif parameter == 'name' or parameter == 'lights':
+                return group[parameter]
+            else:
+                return group['action'][parameter]
+
+        async def set_group(self, group_id, parameter, value=None, transitiontime=None):
+            """ Change light settings for one or more groups, concurrently.
+
+            Takes the same arguments as Group.Bridge.set_group()
+
+            """
+            if isinstance(parameter, dict):
+                data = parameter
+            elif parameter == 'lights' and (isinstance(value, list) or isinstance(value, int)):
+                if isinstance(value, int):
+                    value = [value]
+                data = {parameter: [str(x) for x in value]}
+            else:
+                data = {parameter: value}
+
+            if transitiontime is not None:
+                data['transitiontime'] = int(round(
+                    transitiontime))  # must be int for request format
+
+            group_id_array = group_id
+            if isinstance(group_id, int) or is_string(group_id):
+                group_id_array = [group_id]
+            requests = []
+            for group in group_id_array:
+                if is_string(group):
+                    group = await self.get_group_id_by_name(group)
+                if group is False:
+                    logger.error('Group name does not exist')
+                    return
+                if parameter == 'name' or parameter == 'lights':
+                    requests.append(('/groups/' + str(group), data))
+                else:
+                    requests.append(('/groups/' + str(group) + '/action', data))
+            result = await self.bridge.put_many(requests)
+
+            for group, response in zip(group_id_array, result):
+                if 'error' in list(response[0].keys()):
+                    logger.warn("ERROR: {0} for group {1}".format(
+                        response[0]['error']['description'], group))
+
+            logger.debug(result)
+            return result
+
+        async def create_group(self, name, lights=None):
+            """ Create a group of lights - see Group.Bridge.create_group() """
+            data = {'lights': [str(x) for x in lights], 'name': name}
+            return await self.bridge.post('/groups/', data)
+
+        async def delete_group(self, group_id):
+            return await self.bridge.delete('/groups/' + str(group_id))
 
     def __init__(self, group_bridge, group_id):
         Light.__init__(self, group_bridge, None)
@@ -140,6 +431,9 @@ class Group(Light):
         return self.bridge.get_group(self.group_id, *args, **kwargs)
 
     def _set(self, *args, **kwargs):
+        if self._collect(args):
+            return
+
         # let's get basic group functionality working first before adding
         # transition time...
         if self.transitiontime is not None:
@@ -148,7 +442,8 @@ class Group(Light):
                 self.transitiontime, float(self.transitiontime) / 10))
 
             if (args[0] == 'on' and args[1] is False) or (
-                    kwargs.get('on', True) is False):
+                    kwargs.get('on', True) is False) or (
+                    isinstance(args[0], dict) and args[0].get('on', True) is False):
                 self._reset_bri_after_on = True
         return self.bridge.set_group(self.group_id, *args, **kwargs)
 
@@ -168,9 +463,12 @@ class Group(Light):
     @property
     def lights(self):
         """ Return a list of all lights in this group"""
-        # response = self.bridge.request('GET', '/api/{0}/groups/{1}'.format(self.bridge.username, self.group_id))
-        # return [Light(self.bridge, int(l)) for l in response['lights']]
-        return [Light(self.bridge, int(l)) for l in self._get('lights')]
+        lights = self.bridge.get_membership().get(self.group_id)
+        if lights is None:
+            # made behind our back; fetch it and remember it
+            lights = self._get('lights')
+            self.bridge._set_members(self.group_id, lights)
+        return [self.bridge.light(l) for l in lights]
 
     @lights.setter
     def lights(self, value):
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from uPHue.pool import NullLock
+
+try:
+    from weakref import WeakValueDictionary
+except ImportError:
+    WeakValueDictionary = dict  # MicroPython: objects are simply kept
+
+
+class IdentityMap(object):
+
+    """ Hands out one object per resource id, made by `factory(id)` the
+    first time it is asked for
+
+    Objects are only held weakly, so one nobody uses any more is dropped,
+    and made afresh if asked for again. While one is in use, though, every
+    lookup of its id gets that same object (and whatever it has cached).
+
+    """
+
+    def __init__(self, factory, lock=None):
+        self.factory = factory
+        self.lock = lock or NullLock()
+        self._objects = WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def get(self, key):
+        obj = self._objects.get(key)
+        if obj is not None:
+            return obj
+        with self.lock:
+            obj = self._objects.get(key)
+            if obj is None:
+                obj = self.factory(key)
+                self._objects[key] = obj
+            return obj
+
+    def discard(self, key):
+        self._objects.pop(key, None)
+
+
+def shared(bridge, kind, factory):
+    """ The IdentityMap of kind ('lights', 'groups' or 'sensors') kept on
+    bridge (a bridge.Bridge), so that every .Bridge over it hands out the
+    same objects. It is made, with factory, for the first .Bridge to ask """
+    with bridge.lock:
+        identities = bridge.identities.get(kind)
+        if identities is None:
+            identities = bridge.identities[kind] = IdentityMap(factory, bridge.lock)
+        return identities
@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from uPHue import *
+from uPHue.changes import Changes
+from uPHue.identity import shared
+from uPHue.names import NameIndex
+from uPHue.pool import NullLocal
+from uPHue.query import select
+
+try:
+    import threading
+except ImportError:
+    threading = None
 
 
 class Light(object):
@@ -11,6 +21,84 @@ class Light(object):
 
     """
 
+    class Result(object):
+
+        """ Per-light outcome of Light.Bridge.set_lights()
+
+        responses : dict of light -> the bridge's response
+        errors : dict of light -> list of error dicts, for lights with any error
+        failed : dict of light -> the part of its state that wasn't applied
+        succeeded : list of lights whose whole state was applied
+
+        A Result is true if every light succeeded. retry() sends the failed
+        part again, and returns a new Result for just those lights.
+
+        """
+
+        def __init__(self, light_bridge, states, responses):
+            self.bridge = light_bridge
+            self.responses = responses
+            self.errors = {}
+            self.failed = {}
+            self.succeeded = []
+            for light, response in responses.items():
+                errors = [item['error'] for item in response if 'error' in item]
+                if not errors:
+                    self.succeeded.append(light)
+                    continue
+                self.errors[light] = errors
+                state = states[light]
+                retry = {}
+                for error in errors:
+                    attribute = error.get('address', '').rstrip('/').split('/')[-1]
+                    if attribute not in state:  # not down to one attribute
+                        retry = dict(state)
+                        break
+                    retry[attribute] = state[attribute]
+                if 'transitiontime' in state:
+                    retry['transitiontime'] = state['transitiontime']
+                self.failed[light] = retry
+
+        def __bool__(self):
+            return not self.failed
+
+        __nonzero__ = __bool__
+
+        def __repr__(self):
+            return '<{0}.{1} succeeded={2} failed={3}>'.format(
+                self.__class__.__module__,
+                self.__class__.__name__,
+                len(self.succeeded),
+                len(self.failed))
+
+        def retry(self):
+            return self.bridge.set_lights(self.failed)
+
+    class Batch(object):
+
+        """ Collects a Light's (or Group's) property settings while in a
+        `with` block, and sends them as one command when it ends. Only the
+        settings made from the thread that opened the block are collected """
+
+        def __init__(self, light):
+            self.light = light
+            self._outermost = False
+
+        def __enter__(self):
+            # a batch inside a batch just adds to the outer one
+            self._outermost = self.light._batch is None
+            if self._outermost:
+                self.light._batch = {}
+            return self.light
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if not self._outermost:
+                return False
+            data, self.light._batch = self.light._batch, None
+            if exc_type is None and data:
+                self.light._set(data)
+            return False
+
     class Bridge(object):
 
         """
@@ -34,47 +122,114 @@ class Light(object):
             self.bridge = bridge
             self.lights_by_id = {}
             self.lights_by_name = {}
+            self.light_names = NameIndex(lambda: self.get_light())
+            self._lights = shared(bridge, 'lights', lambda light_id: Light(self, light_id))
+            self._known_lights = {}  # id -> (name, type) as last indexed
+            self.listeners = []  # called as listener(collection, event, id, name) by refresh()
+            self._selections = {}  # kind -> (snapshot, query.Index over it)
+
+        def light(self, light_id):
+            """ The Light object for light_id: the same one for as long as it's in use """
+            return self._lights.get(int(light_id))
 
         def get_light_id_by_name(self, name):
-            """ Lookup a light id based on string name. Case-sensitive. """
-            lights = self.get_light()
-            for light_id in lights:
-                if name == lights[light_id]['name']:
-                    return light_id
-            return False
+            """ Lookup a light id based on string name. Case-sensitive,
+            unless light_names.ignore_case is set """
+            return self.light_names.lookup(name)
+
+        def get_light_ids(self, lights):
+            """ Lookup the ids of several lights at once. Returns a dict of
+            light (id or name) -> id, or False for names that don't exist """
+            found = self.light_names.resolve([light for light in lights if is_string(light)])
+            light_ids = {}
+            for light in lights:
+                if is_string(light):
+                    light_ids[light] = found[light] if found[light] is False else int(found[light])
+                else:
+                    light_ids[light] = light
+            return light_ids
 
         def get_light_objects(self, mode='list'):
             """Returns a collection containing the lights, either by name or id (use 'id' or 'name' as the mode)
             The returned collection can be either a list (default), or a dict.
             Set mode='id' for a dict by light ID, or mode='name' for a dict by light name.   """
             if self.lights_by_id == {}:
-                lights = self.bridge.get('/lights/')
-                for light in lights:
-                    self.lights_by_id[int(light)] = Light(self, int(light))
-                    self.lights_by_name[lights[light][
-                        'name']] = self.lights_by_id[int(light)]
+                lights = self.bridge.read('/lights/')
+                with self.bridge.lock:
+                    if self.lights_by_id == {}:
+                        self._index(lights)
             if mode == 'id':
                 return self.lights_by_id
             if mode == 'name':
                 return self.lights_by_name
             if mode == 'list':
                 # return lights in sorted id order, dicts have no natural order
-                return [self.lights_by_id[id] for id in sorted(self.lights_by_id)]
+                with self.bridge.lock:
+                    return [self.lights_by_id[id] for id in sorted(self.lights_by_id)]
+
+        def _index(self, lights):
+            self.light_names.build(lights)
+            self._known_lights = Changes.known(lights)
+            for light in lights:
+                self.lights_by_id[int(light)] = self.light(light)
+                self.lights_by_name[lights[light][
+                    'name']] = self.lights_by_id[int(light)]
+
+        def populate(self, snapshot):
+            """ Build the light index from a full datastore snapshot
+            (see Bridge.bootstrap()) rather than fetching it """
+            with self.bridge.lock:
+                self.lights_by_id.clear()
+                self.lights_by_name.clear()
+                self._index(snapshot.get('lights', {}))
+
+        def refresh(self):
+            """ Bring the light index up to date with the bridge, patching in
+            only what has changed: lights that have been added, removed or
+            renamed. The Light objects of everything else are left as they are.
+            Each change is passed to the listeners. Returns a changes.Changes """
+            changes = Changes()
+            self._refresh(changes, self.bridge.get('/lights/'))
+            changes.notify(self.listeners)
+            return changes
+
+        def _refresh(self, changes, lights):
+            if not isinstance(lights, dict):
+                raise PhueException(lights[0]['error']['type'],
+                                    'Unable to refresh lights: ' + lights[0]['error']['description'])
+            with self.bridge.lock:
+                self._known_lights = changes.diff('lights', self._known_lights, lights)
+                self.light_names.build(lights)
+                for collection, light_id, name in changes.removed:
+                    if collection == 'lights':
+                        self.lights_by_id.pop(light_id, None)
+                        self.lights_by_name.pop(name, None)
+                        self._lights.discard(light_id)
+                for collection, light_id, name in changes.added:
+                    if collection == 'lights':
+                        self.lights_by_id[light_id] = self.light(light_id)
+                        self.lights_by_name[name] = self.lights_by_id[light_id]
+                for collection, light_id, old_name, new_name in changes.renamed:
+                    if collection == 'lights':
+                        self.lights_by_name.pop(old_name, None)
+                        self.lights_by_name[new_name] = self.light(light_id)
+                        self.lights_by_id.setdefault(light_id, self.lights_by_name[new_name])
 
         def __getitem__(self, key):
             """ Lights are accessibly by indexing the bridge either with
             an integer index or string name. """
-            if self.lights_by_id == {}:
-                self.get_light_objects()
-
-            try:
+            if key in self.lights_by_id:
                 return self.lights_by_id[key]
-            except:
-                try:
-                    return self.lights_by_name[key]
-                except:
-                    raise KeyError(
-                        'Not a valid key (integer index starting with 1, or light name): ' + str(key))
+            if key in self.lights_by_name:
+                return self.lights_by_name[key]
+            if is_string(key):
+                light_id = self.light_names.lookup(key)
+            else:
+                light_id = key if str(key) in self.light_names.ids() else False
+            if light_id is False:
+                raise KeyError(
+                    'Not a valid key (integer index starting with 1, or light name): ' + str(key))
+            return self.light(light_id)
 
         @property
         def lights(self):
@@ -82,13 +237,41 @@ class Light(object):
             return self.get_light_objects()
 
         def get_light(self, light_id=None, parameter=None):
-            """ Gets state by light_id and parameter"""
+            """ Gets state by light_id and parameter
+
+            light_id can be a single lamp or a list of lamps; a list
+            returns a list of states, fetched together """
 
+            if isinstance(light_id, (list, tuple)):
+                light_ids = self.get_light_ids(light_id)
+                light_id = [light_ids[light] for light in light_id]
+                states = self.bridge.read_many(['/lights/' + str(light) for light in light_id], parameter)
+                return [self._parameter(light, state, parameter)
+                        for light, state in zip(light_id, states)]
             if is_string(light_id):
                 light_id = self.get_light_id_by_name(light_id)
             if light_id is None:
-                return self.bridge.get('/lights/')
-            state = self.bridge.get('/lights/' + str(light_id))
+                return self.bridge.read('/lights/')
+            return self._parameter(light_id, self.bridge.read('/lights/' + str(light_id), parameter), parameter)
+
+        def where(self, **criteria):
+            """ Select lights by their fields, e.g. where(on=True, type='Dimmable light'),
+            from one snapshot of /lights (the cached one, if there is a cache or
+            refresher). Selecting by group=, as in where(group='Kitchen'), needs a
+            Group.Bridge. Returns a query.Selection, which can set them all at once """
+            return select(self, 'lights', self.get_light()).where(**criteria)
+
+        def _in_groups(self, groups):
+            raise ValueError('Selecting lights by group needs a Group.Bridge')
+
+        def get_state_table(self):
+            """ The state of every light as a table.StateTable of NumPy columns,
+            from a single fetch of /lights. Needs numpy """
+            from uPHue.table import StateTable
+            return StateTable(self, self.get_light())
+
+        @staticmethod
+        def _parameter(light_id, state, parameter):
             if parameter is None:
                 return state
             if parameter in ['name', 'type', 'uniqueid', 'swversion']:
@@ -126,22 +309,142 @@ class Light(object):
             light_id_array = light_id
             if isinstance(light_id, int) or is_string(light_id):
                 light_id_array = [light_id]
-            result = []
+            light_ids = self.get_light_ids(light_id_array)
+            requests = []
             for light in light_id_array:
                 logger.debug(str(data))
                 if parameter == 'name':
-                    result.append(self.bridge.put('/lights/' + str(
-                        light_id), data))
+                    requests.append(('/lights/' + str(light_ids[light]), data))
                 else:
-                    if is_string(light):
-                        converted_light = self.get_light_id_by_name(light)
-                    else:
-                        converted_light = light
-                    result.append(self.bridge.put('/lights/' + str(
-                        converted_light) + '/state', data))
-                if 'error' in list(result[-1][0].keys()):
+                    requests.append(('/lights/' + str(light_ids[light]) + '/state', data))
+            result = self.bridge.put_many(requests)
+            if 'name' in data:
+                self.light_names.invalidate()
+            for light, response in zip(light_id_array, result):
+                if 'error' in list(response[0].keys()):
                     logger.warn("ERROR: {0} for light {1}".format(
-                        result[-1][0]['error']['description'], light))
+                        response[0]['error']['description'], light))
+
+            logger.debug(result)
+            return result
+
+        def set_lights(self, states, transitiontime=None):
+            """ Set each of several lights to its own state.
+
+            states : dict of light id (or name) -> state dict,
+                     e.g. {1: {'on': True, 'bri': 254}, 'Kitchen': {'on': False}}
+            transitiontime : in **deciseconds**, applied to every light that
+                             doesn't have its own in its state
+
+            Names are looked up once for the whole call, and the commands are
+            sent together in whichever way the Bridge is set up for (pipelined,
+            threaded, queued or one after another). Returns a Light.Result.
+
+            """
+            light_ids = self.get_light_ids(states)
+            sent = {}
+            responses = {}
+            requests = []
+            targets = []
+            for light, state in states.items():
+                data = dict(state)
+                if transitiontime is not None and 'transitiontime' not in data:
+                    data['transitiontime'] = int(round(transitiontime))
+                sent[light] = data
+                converted_light = light_ids[light]
+                if converted_light is False:
+                    responses[light] = [{'error': {
+                        'type': 3, 'address': '/lights/' + str(light),
+                        'description': 'light, ' + str(light) + ', not available'}}]
+                    continue
+                requests.append(('/lights/' + str(converted_light) + '/state', data))
+                targets.append(light)
+
+            for light, response in zip(targets, self.bridge.put_many(requests)):
+                responses[light] = response
+            result = Light.Result(self, sent, responses)
+            for light, errors in result.errors.items():
+                logger.warn("ERROR: {0} for light {1}".format(errors[0]['description'], light))
+            logger.debug(result)
+            return result
+
+    class AsyncBridge(object):
+
+        """
+            The asyncio counterpart of Light.Bridge, for use with an AsyncBridge:
+
+            >>> b = async_bridge.AsyncBridge(ip='192.168.1.100')
+            >>> lb = light.Light.AsyncBridge(b)
+            >>> await lb.get_light(1, 'bri')
+            254
+            >>> await lb.set_light(['Kitchen', 'Hallway'], 'on', False)
+        """
+
+        def __init__(self, bridge):
+            self.bridge = bridge
+
+        async def get_light_id_by_name(self, name):
+            """ Lookup a light id based on string name. Case-sensitive. """
+            lights = await self.get_light()
+            for light_id in lights:
+                if name == lights[light_id]['name']:
+                    return light_id
+            return False
+
+        async def get_light(self, light_id=None, parameter=None):
+            """ Gets state by light_id and parameter"""
+
+            if is_string(light_id):
+                light_id = await self.get_light_id_by_name(light_id)
+            if light_id is None:
+                return await self.bridge.get('/lights/')
+            state = await self.bridge.get('/lights/' + str(light_id))
+            if parameter is None:
+                return state
+            if parameter in ['name', 'type', 'uniqueid', 'swversion']:
+                return state[parameter]
+            else:
+                try:
+                    return state['state'][parameter]
+                except KeyError as e:
+                    raise KeyError(
+                        'Not a valid key, parameter %s is not associated with light %s)'
+                        % (parameter, light_id))
+
+        async def set_light(self, light_id, parameter, value=None, transitiontime=None):
+            """ Adjust properties of one or more lights, concurrently.
+
+            Takes the same arguments as Light.Bridge.set_light()
+
+            """
+            if isinstance(parameter, dict):
+                data = parameter
+            else:
+                data = {parameter: value}
+
+            if transitiontime is not None:
+                data['transitiontime'] = int(round(
+                    transitiontime))  # must be int for request format
+
+            light_id_array = light_id
+            if isinstance(light_id, int) or is_string(light_id):
+                light_id_array = [light_id]
+            lights = None
+            requests = []
+            for light in light_id_array:
+                if is_string(light):
+                    if lights is None:
+                        lights = await self.get_light()
+                    light = next((i for i in lights if lights[i]['name'] == light), False)
+                if parameter == 'name':
+                    requests.append(('/lights/' + str(light), data))
+                else:
+                    requests.append(('/lights/' + str(light) + '/state', data))
+            result = await self.bridge.put_many(requests)
+            for light, response in zip(light_id_array, result):
+                if 'error' in list(response[0].keys()):
+                    logger.warn("ERROR: {0} for light {1}".format(
+                        response[0]['error']['description'], light))
 
             logger.debug(result)
             return result
@@ -164,6 +467,9 @@ class Light(object):
         self._reset_bri_after_on = None
         self._reachable = None
         self._type = None
+        # the batch being collected, per thread (see batch())
+        self._local = threading.local() if threading is not None else NullLocal()
+        self._batch = None
 
     def __repr__(self):
         # like default python repr function, but add light name
@@ -173,12 +479,46 @@ class Light(object):
             self.name,
             hex(id(self)))
 
+    def batch(self):
+        """ Send all property settings made in a `with` block as one command,
+        with the transitiontime (if set) applied once:
+
+        >>> with light.batch():
+        ...     light.on = True
+        ...     light.hue = 46920
+        ...     light.saturation = 254
+
+        Nothing is sent if the block raises an exception.
+
+        """
+        return Light.Batch(self)
+
+    @property
+    def _batch(self):
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, value):
+        self._local.batch = value
+
+    def _collect(self, args):
+        """ Gather a setting into the batch, if one is being collected """
+        if self._batch is None or args[0] in ('name', 'lights'):
+            return False
+        if isinstance(args[0], dict):
+            merge_state(self._batch, args[0])
+        else:
+            merge_state(self._batch, {args[0]: args[1]})
+        return True
+
     # Wrapper functions for get/set through the bridge, adding support for
     # remembering the transitiontime parameter if the user has set it
     def _get(self, *args, **kwargs):
         return self.bridge.get_light(self.light_id, *args, **kwargs)
 
     def _set(self, *args, **kwargs):
+        if self._collect(args):
+            return
 
         if self.transitiontime is not None:
             kwargs['transitiontime'] = self.transitiontime
@@ -186,7 +526,8 @@ class Light(object):
                 self.transitiontime, float(self.transitiontime) / 10))
 
             if (args[0] == 'on' and args[1] is False) or (
-                    kwargs.get('on', True) is False):
+                    kwargs.get('on', True) is False) or (
+                    isinstance(args[0], dict) and args[0].get('on', True) is False):
                 self._reset_bri_after_on = True
         return self.bridge.set_light(self.light_id, *args, **kwargs)
 
@@ -204,8 +545,13 @@ class Light(object):
         logger.debug("Renaming light from '{0}' to '{1}'".format(
             old_name, value))
 
-        self.bridge.lights_by_name[self.name] = self
-        del self.bridge.lights_by_name[old_name]
+        new_name = self.name
+        with self.bridge.bridge.lock:
+            # the index may not have been built, if this object came from
+            # light(), [] or a query rather than get_light_objects()
+            self.bridge.lights_by_name.pop(old_name, None)
+            if self.bridge.lights_by_id:
+                self.bridge.lights_by_name[new_name] = self
 
     @property
     def on(self):
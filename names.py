@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from uPHue import *
+
+
+class NameIndex(object):
+
+    """ Name -> id lookups for one collection (lights, groups or sensors)
+
+    The index is built from one fetch of the collection (`fetch` returns it,
+    as the bridge does: id -> {'name': ..., ...}) and then kept until it is
+    invalidated, which the .Bridges do whenever they rename, create or
+    delete something. A name that isn't in the index rebuilds it once per
+    call, in case it was added behind our back.
+
+    ignore_case : match names whatever their case
+    prefix : a name also matches the one name (if only one) that starts with it
+
+    >>> lb = Light.Bridge(b)
+    >>> lb.light_names.ignore_case = True
+    >>> lb.light_names.resolve(['kitchen', 'hallway'])
+    {'kitchen': '1', 'hallway': '4'}
+
+    """
+
+    def __init__(self, fetch, ignore_case=False, prefix=False):
+        self.fetch = fetch
+        self.ignore_case = ignore_case
+        self.prefix = prefix
+        self.builds = 0
+        self._ids = None  # name -> id
+        self._all = set()  # every id, including ones sharing a name
+
+    def __repr__(self):
+        return '<{0}.{1} names={2} builds={3}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            'unbuilt' if self._ids is None else len(self._ids),
+            self.builds)
+
+    def build(self, collection):
+        """ Index a collection as the bridge returns it """
+        self._ids = dict((item['name'], key) for key, item in collection.items()
+                         if isinstance(item, dict) and 'name' in item)
+        self._all = set(key for key, item in collection.items() if isinstance(item, dict))
+        self.builds += 1
+
+    def invalidate(self):
+        self._ids = None
+
+    def _match(self, name, ids):
+        if name in ids:
+            return ids[name]
+        if not self.ignore_case and not self.prefix:
+            return False
+        wanted = name.lower() if self.ignore_case else name
+        exact = []
+        started = []
+        for candidate, key in ids.items():
+            if self.ignore_case:
+                candidate = candidate.lower()
+            if candidate == wanted:
+                exact.append(key)
+            elif self.prefix and candidate.startswith(wanted):
+                started.append(key)
+        matches = exact or started
+        if len(matches) > 1:
+            logger.warn("Name '{0}' is ambiguous".format(name))
+            return False
+        return matches[0] if matches else False
+
+    def resolve(self, names):
+        """ Look up several names at once. Returns a dict of name -> id,
+        or False for names that don't match """
+        if not names:
+            return {}
+        if self._ids is None:
+            self.build(self.fetch())
+        found = dict((name, self._match(name, self._ids)) for name in names)
+        if False in found.values():
+            self.build(self.fetch())
+            found = dict((name, self._match(name, self._ids)) for name in names)
+        return found
+
+    def ids(self):
+        """ The ids of everything in the collection """
+        if self._ids is None:
+            self.build(self.fetch())
+        return set(self._all)
+
+    def lookup(self, name):
+        """ The id of name, or False """
+        return self.resolve([name])[name]
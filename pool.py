@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import json
+import socket
+import http.client as httplib
+
+from uPHue import *
+
+
+class NullLock(object):
+
+    """ Stands in for a lock when a Bridge isn't shared between threads """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullLocal(object):
+
+    """ Stands in for threading.local() where there are no threads """
+
+
+class Latency(object):
+
+    """ Running per-request latency figures, in seconds
+
+    >>> b.latency.count, b.latency.mean, b.latency.max
+    (120, 0.0123, 0.0871)
+
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock or NullLock()
+        self.reset()
+
+    def __repr__(self):
+        return '<{0}.{1} count={2} mean={3:.4f}s min={4:.4f}s max={5:.4f}s>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.count,
+            self.mean,
+            self.min or 0.0,
+            self.max)
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = None
+        self.min = None
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    @property
+    def mean(self):
+        '''Get the mean latency over all recorded requests [seconds]'''
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class _Stream(object):
+
+    """ Hands the same buffered reader to every HTTPResponse on a pipelined
+    socket, so that bytes read ahead for one response aren't lost to the next.
+    Responses close their reader once read; that is left to the pool instead. """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def makefile(self, mode):
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def close(self):
+        pass
+
+
+class Pool(object):
+
+    """ Keep-alive HTTP connections to the bridge
+
+    Idle connections are kept open (up to `size` of them) and handed out again
+    for the next request, so most requests don't pay for a TCP handshake.
+    A `size` of 0 disables keep-alive: every connection is closed after use.
+    Pass a `lock` to share the pool between threads; each thread then has a
+    connection to itself for the duration of a request.
+
+    """
+
+    IDEMPOTENT = ('GET', 'PUT', 'DELETE')  # safe to send again if no answer came
+
+    @classmethod
+    def idempotent(cls, mode, body=None):
+        """ Whether a request can safely be sent again: not a POST, nor a PUT
+        of a relative change (bri_inc, ct_inc, ...), which would be applied twice """
+        if mode not in cls.IDEMPOTENT:
+            return False
+        if mode == 'PUT' and body:
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError:
+                return False
+            if isinstance(data, dict) and any(key.endswith('_inc') for key in data):
+                return False
+        return True
+
+    def __init__(self, host, size=1, timeout=10, lock=None):
+        self.host = host
+        self.size = size
+        self.timeout = timeout
+        self.connects = 0  # number of TCP connections opened so far
+        self.lock = lock or NullLock()
+        self._idle = []
+
+    def acquire(self):
+        """ Returns (connection, reused) - an idle connection if there is one,
+        otherwise a newly opened one """
+        with self.lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connect(), False
+
+    def connect(self):
+        """ Open a new connection to the bridge with Nagle's algorithm disabled """
+        connection = httplib.HTTPConnection(self.host, timeout=self.timeout)
+        connection.connect()
+        try:
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):
+            logger.debug('Unable to set TCP_NODELAY on connection to ' + self.host)
+        with self.lock:
+            self.connects += 1
+        return connection
+
+    def release(self, connection):
+        """ Return a connection for re-use, or close it if the pool is full """
+        with self.lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def discard(self, connection):
+        """ Close a connection that is broken or no longer wanted """
+        connection.close()
+
+    def close(self):
+        """ Close all idle connections """
+        with self.lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def request(self, mode, address, body=None):
+        """ Send a request and return the raw response body (bytes).
+
+        If the bridge has silently dropped a kept-alive connection, the request
+        is retried once on a fresh connection - unless it had already been sent
+        and isn't idempotent() (a POST, or a PUT of bri_inc and the like),
+        as the bridge may have acted on it.
+
+        """
+        while True:
+            connection, reused = self.acquire()
+            sent = False
+            try:
+                connection.request(mode, address, body)
+                sent = True
+                result = connection.getresponse()
+                response = result.read()
+            except socket.timeout:
+                self.discard(connection)
+                raise
+            except (httplib.HTTPException, OSError):
+                self.discard(connection)
+                if not reused or (sent and not self.idempotent(mode, body)):
+                    raise
+                logger.debug('Bridge dropped idle connection, reconnecting')
+                continue
+
+            if result.will_close:
+                self.discard(connection)
+            else:
+                self.release(connection)
+            return response
+
+    def pipeline(self, requests, depth=16):
+        """ Send (mode, address, body) requests back-to-back on one connection
+        and return the raw response bodies in the same order.
+
+        Up to `depth` requests are written before their responses are read.
+        Whatever the bridge doesn't answer (say, it closes the connection
+        part way) is sent again - unless any request of that window isn't
+        idempotent(), as the bridge may have acted on it, which raises an
+        HTTPException before anything is resent.
+
+        """
+        responses = []
+        while len(responses) < len(requests):
+            window = requests[len(responses):len(responses) + depth]
+            done = self._pipeline(window)
+            responses.extend(done)
+            if len(done) < len(window):
+                # the whole window was written, so the bridge may have acted
+                # on any of the unanswered requests, not just the first
+                for mode, address, body in window[len(done):]:
+                    if not self.idempotent(mode, body):
+                        raise httplib.HTTPException('No response to pipelined {0} {1}'.format(mode, address))
+                mode, address, body = window[len(done)]
+                logger.debug('Pipelined connection closed early, resending a single request')
+                responses.append(self.request(mode, address, body))
+        return responses
+
+    def _pipeline(self, window):
+        connection = self.acquire()[0]
+        messages = []
+        for mode, address, body in window:
+            lines = ['{0} {1} HTTP/1.1'.format(mode, address),
+                     'Host: ' + self.host,
+                     'Accept-Encoding: identity']
+            if body is not None:
+                lines.append('Content-Type: application/json')
+                lines.append('Content-Length: {0}'.format(len(body)))
+            messages.append(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+            if body is not None:
+                messages.append(body)
+
+        responses = []
+        fp = None
+        try:
+            connection.sock.sendall(b''.join(messages))
+            fp = connection.sock.makefile('rb')
+            for mode, address, body in window:
+                result = httplib.HTTPResponse(_Stream(fp), method=mode)
+                result.begin()
+                responses.append(result.read())
+                if result.will_close:
+                    break
+        except socket.timeout:
+            self.discard(connection)
+            raise
+        except (httplib.HTTPException, OSError):
+            self.discard(connection)
+            return responses
+        finally:
+            if fp is not None:
+                fp.close()
+
+        if len(responses) < len(window):
+            self.discard(connection)
+        else:
+            self.release(connection)
+        return responses
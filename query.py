@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+NESTED = ('state', 'action', 'config')  # where fields not at the top level live
+
+
+def field(item, name):
+    """ A field of a light, group or sensor as the bridge returns it,
+    looked for at the top level, then in its state, action or config """
+    if name in item:
+        return item[name]
+    for nested in NESTED:
+        if isinstance(item.get(nested), dict) and name in item[nested]:
+            return item[nested][name]
+    return None
+
+
+def select(manager, kind, collection):
+    """ A Selection of everything in collection (a snapshot of kind, as
+    the bridge returns it), reusing the manager's indexes over that same
+    snapshot if it has been queried before """
+    cached = manager._selections.get(kind)
+    if cached is None or cached[0] is not collection:
+        cached = (collection, Index(collection))
+        manager._selections[kind] = cached
+    return Selection(manager, kind, collection, [int(key) for key in collection], cached[1])
+
+
+class Index(object):
+
+    """ Value -> ids indexes over one snapshot of a collection, built
+    a field at a time as equality filters ask for them """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexes = {}
+
+    def equal(self, name, value):
+        """ The ids whose field name equals value """
+        index = self._indexes.get(name)
+        if index is None:
+            index = {}
+            for key, item in self.collection.items():
+                found = field(item, name)
+                try:
+                    index.setdefault(found, set()).add(int(key))
+                except TypeError:  # unhashable, e.g. xy
+                    index = False
+                    break
+            self._indexes[name] = index
+        if index is False:
+            return set(int(key) for key, item in self.collection.items() if field(item, name) == value)
+        try:
+            return index.get(value, set())
+        except TypeError:
+            return set()
+
+
+class Selection(object):
+
+    """ The lights (or groups, or sensors) matching a query, taken from one
+    snapshot of their collection, e.g.
+
+    >>> kitchen = gb.where(on=True, type='Extended color light', group='Kitchen')
+    >>> kitchen.ids
+    [1, 2]
+    >>> kitchen.set({'bri': 127}, transitiontime=10)
+
+    Each criterion is a field name (found at the top level or in the
+    state, action or config) and either the value to match, a list, tuple
+    or set of values to match any of, or a function of the value that
+    returns True to match (so list-valued fields like xy need a function).
+    Plain values are looked up in an index rather than compared one by one.
+
+    """
+
+    def __init__(self, manager, kind, collection, ids, index=None):
+        self.manager = manager
+        self.kind = kind
+        self.collection = collection
+        self.ids = sorted(ids)
+        self._index = index or Index(collection)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """ The Light, Group or Sensor objects selected """
+        make = getattr(self.manager, self.kind[:-1])
+        return iter([make(item_id) for item_id in self.ids])
+
+    def __repr__(self):
+        return '<{0}.{1} {2} {3}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.kind,
+            self.ids)
+
+    @property
+    def states(self):
+        '''Get what the snapshot holds for each selected id [dict]'''
+        return dict((item_id, self.collection[str(item_id)]) for item_id in self.ids)
+
+    def where(self, **criteria):
+        """ Narrow the selection down further """
+        ids = set(self.ids)
+        for name, wanted in criteria.items():
+            if name == 'group' and self.kind == 'lights':
+                ids &= self.manager._in_groups(wanted)
+            elif callable(wanted):
+                ids = set(item_id for item_id in ids
+                          if wanted(field(self.collection[str(item_id)], name)))
+            elif isinstance(wanted, (list, tuple, set, frozenset)):
+                matched = set()
+                for value in wanted:
+                    matched |= self._index.equal(name, value)
+                ids &= matched
+            else:
+                ids &= self._index.equal(name, wanted)
+        return Selection(self.manager, self.kind, self.collection, ids, self._index)
+
+    def set(self, parameter, value=None, transitiontime=None):
+        """ Change every selected light, group or sensor the same way, with
+        the .Bridge's bulk command: Light.Bridge.set_lights() for lights
+        (returning a Light.Result), set_group() for groups and
+        set_sensor_state() for sensors """
+        if isinstance(parameter, dict):
+            data = dict(parameter)
+        else:
+            data = {parameter: value}
+        if not self.ids:
+            return None
+        if self.kind == 'lights':
+            return self.manager.set_lights(dict((item_id, data) for item_id in self.ids), transitiontime)
+        if self.kind == 'groups':
+            return self.manager.set_group(self.ids, data, transitiontime=transitiontime)
+        return self.manager.set_sensor_state(self.ids, data)
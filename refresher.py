@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from uPHue import *
+from uPHue.cache import Cache, Transitions, patch
+
+try:
+    import threading
+except ImportError:
+    threading = None
+
+
+class Refresher(object):
+
+    """ Keeps a snapshot of the lights, groups and sensors up to date from a
+    background thread, so reading them costs no request at all
+
+    Every `interval` seconds the collections are fetched and a new snapshot
+    (a dict of path -> data, e.g. '/lights/1' -> that light) is built and
+    swapped in whole. A snapshot is never modified once published, so
+    readers just take `snapshot` and use it, without locking; treat what
+    they get from it as read-only.
+
+    A write through the Bridge is applied to a copy of the current snapshot,
+    which is published in its place (or, where its outcome can't be known
+    in advance, what it could change is left out, so those reads go to the
+    bridge). Writes made while a poll is under way are made again on top of
+    what it fetched before that is published, so a poll overtaken by a
+    write never undoes it, and a steady stream of writes doesn't hold polls
+    back.
+
+    >>> b = Bridge(ip='192.168.1.100', refresh=1.0)
+
+    """
+
+    def __init__(self, bridge, interval=1.0, collections=('lights', 'groups', 'sensors')):
+        if threading is None:
+            raise PhueException(None, 'refresh= needs the threading module')
+        self.bridge = bridge
+        self.interval = interval
+        self.collections = collections
+        self.polls = 0
+        self.snapshot = {}
+        self._generation = 0  # bumped by every write
+        self._writes = []  # (generation, write, args) made since the last poll
+        self._lock = threading.Lock()  # held to publish a snapshot
+        self.transitions = Transitions()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '<{0}.{1} interval={2:g}s polls={3}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.interval,
+            self.polls)
+
+    def get(self, req):
+        """ What the current snapshot holds for req, or None """
+        path = Cache.path(req)
+        return self.transitions.predict(path, self.snapshot.get(path))
+
+    def poll(self):
+        """ Fetch the collections and publish them as the new snapshot """
+        generation = self._generation
+        responses = self.bridge.get_many(['/' + collection for collection in self.collections])
+        snapshot = {}
+        for collection, data in zip(self.collections, responses):
+            if not isinstance(data, dict):
+                logger.warn("Unable to refresh {0}: {1}".format(collection, repr(data)))
+                continue
+            snapshot['/' + collection] = data
+            for key, value in data.items():
+                snapshot['/' + collection + '/' + key] = value
+        with self._lock:
+            # Writes that went out meanwhile may not be in what was fetched,
+            # so they are made again on top of it
+            for written, write, args in self._writes:
+                if written > generation:
+                    write(snapshot, *args)
+            self._writes = []
+            self.snapshot = snapshot
+            self.polls += 1
+        for path, value in snapshot.items():
+            if path.count('/') > 1:
+                self.transitions.correct(path, value)
+
+    def _write(self, write, *args):
+        """ Publish a copy of the snapshot with write(snapshot, *args) made
+        to it, and keep the write to make again on the next poll """
+        with self._lock:
+            self._generation += 1
+            self._writes.append((self._generation, write, args))
+            snapshot = dict(self.snapshot)
+            result = write(snapshot, *args)
+            self.snapshot = snapshot
+            return result
+
+    def expire(self, req):
+        """ Publish a snapshot without whatever req could change """
+        self._write(self._expire, Cache.path(req))
+
+    @staticmethod
+    def _expire(snapshot, path):
+        collection = path[:path.index('/', 1)] if path.count('/') > 1 else path
+        groups = collection == '/groups'  # a group command changes its lights as well
+        for key in list(snapshot):
+            if key == path or key == collection or (groups and key.startswith('/lights')):
+                del snapshot[key]
+
+    def update(self, path, changes):
+        """ Publish a snapshot with changes (see cache.patch()) applied to
+        path. Returns the changes that would undo them, or None if path
+        isn't in the snapshot """
+        return self._write(self._update, path, changes)
+
+    @staticmethod
+    def _update(snapshot, path, changes):
+        if path not in snapshot:
+            return None
+        snapshot[path], undo = patch(snapshot[path], changes)
+        collection, _, key = path.rpartition('/')
+        if collection in snapshot:
+            snapshot[collection] = dict(snapshot[collection])
+            snapshot[collection][key] = snapshot[path]
+        return undo
+
+    def discard(self, prefix):
+        """ Publish a snapshot without any path starting with prefix """
+        self._write(self._discard, prefix)
+
+    @staticmethod
+    def _discard(snapshot, prefix):
+        for key in list(snapshot):
+            if key.startswith(prefix):
+                del snapshot[key]
+
+    def start(self):
+        """ Take a first snapshot, then keep refreshing it in the background """
+        self.poll()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Background refresh failed")
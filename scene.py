@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import time
+
 from uPHue import *
 
 
@@ -8,13 +12,112 @@ class Scene(object):
 
     class Bridge(object):
 
+        COMPILED_PREFIX = 'uPHue '  # names of scenes made by compile_scene()
+
         def __init__(self, bridge):
             self.bridge = bridge
+            self._compiled = None  # content hash -> scene id
+            self.savings = {'compiled': 0, 'recalls': 0, 'commands_saved': 0}
+            self._scenes = None  # scene id -> ((version, lastupdated), Scene)
+            self._stale = True
+            self._indexed = None  # when the index was last brought up to date
+            self.ttl = None  # seconds the index is trusted for (None: until refresh_scenes() or a write)
+            self._lightstates = {}  # scene id -> ((version, lastupdated), lightstates)
+            self.scenes_by_name = {}  # name -> [scene ids]
+            self.scenes_by_group = {}  # group id -> [scene ids], for GroupScenes
 
         # Scenes #####
         @property
         def scenes(self):
-            return [Scene(k, **v) for k, v in self.get_scene().items()]
+            self.refresh_scenes(self.get_scene())
+            return [self._scenes[scene_id][1] for scene_id in sorted(self._scenes)]
+
+        @staticmethod
+        def _stamp(scene):
+            return (scene.get('version'), scene.get('lastupdated'))
+
+        def refresh_scenes(self, scenes=None):
+            """ Bring the scene index up to date with scenes (as GET /scenes
+            returns them; fetched if not given). Only scenes whose version or
+            lastupdated has changed get a new Scene object; the name and group
+            indexes are rebuilt only if something has changed. """
+            if scenes is None:
+                scenes = self.get_scene()
+            if not isinstance(scenes, dict):
+                raise PhueException(scenes[0]['error']['type'],
+                                    'Unable to fetch scenes: ' + scenes[0]['error']['description'])
+            old = self._scenes or {}
+            new = {}
+            changed = self._scenes is None or len(old) != len(scenes)
+            for scene_id, scene in scenes.items():
+                stamp = self._stamp(scene)
+                if scene_id in old and old[scene_id][0] == stamp:
+                    new[scene_id] = old[scene_id]
+                else:
+                    new[scene_id] = (stamp, Scene(scene_id, **scene))
+                    changed = True
+            for scene_id in list(self._lightstates):
+                if scene_id not in new or self._lightstates[scene_id][0] != new[scene_id][0]:
+                    del self._lightstates[scene_id]
+            if changed:
+                by_name = {}
+                by_group = {}
+                for scene_id in sorted(new):
+                    scene = new[scene_id][1]
+                    by_name.setdefault(scene.name, []).append(scene_id)
+                    if scene.group:
+                        by_group.setdefault(int(scene.group), []).append(scene_id)
+                self.scenes_by_name, self.scenes_by_group = by_name, by_group
+                logger.debug("Indexed {0} scenes".format(len(new)))
+            self._scenes = new
+            self._stale = False
+            self._indexed = time.time()
+
+        def _reconcile(self):
+            """ Bring the index up to date before a lookup, if it needs it:
+            /scenes is fetched the first time, after a write through this
+            Scene.Bridge, and once ttl (if set) has run out, in which case it
+            is read through the cache, if there is one. Otherwise lookups are
+            answered from the index; call refresh_scenes() to pick up scenes
+            changed by other apps. """
+            if self._stale:
+                self.refresh_scenes(self.bridge.bridge.get('/scenes'))
+            elif self.ttl is not None and time.time() - self._indexed > self.ttl:
+                self.refresh_scenes()
+
+        def find_scenes(self, name=None, group=None):
+            """ The Scenes with a name, and/or belonging to a group (id or name),
+            from the scene index (see _reconcile()) """
+            self._reconcile()
+            if is_string(group):
+                group = self.bridge.get_group_id_by_name(group)
+            ids = None
+            if name is not None:
+                ids = self.scenes_by_name.get(name, [])
+            if group is not None:
+                in_group = self.scenes_by_group.get(int(group), [])
+                ids = in_group if ids is None else [i for i in ids if i in in_group]
+            if ids is None:
+                ids = sorted(self._scenes)
+            return [self._scenes[scene_id][1] for scene_id in ids]
+
+        def get_lightstates(self, scene_id):
+            """ The light states a scene sets (fetched with GET /scenes/<id> the
+            first time, then kept until the index sees the scene's version
+            change) """
+            self._reconcile()
+            stamp = self._scenes[scene_id][0] if scene_id in self._scenes else None
+            cached = self._lightstates.get(scene_id)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            scene = self.bridge.bridge.get('/scenes/' + str(scene_id))
+            if not isinstance(scene, dict):
+                raise PhueException(scene[0]['error']['type'],
+                                    'Unable to fetch scene: ' + scene[0]['error']['description'])
+            # kept under the index's stamp, so the index catching up with a
+            # newer version than this is what has it fetched again
+            self._lightstates[scene_id] = (stamp, scene.get('lightstates', {}))
+            return self._lightstates[scene_id][1]
 
         def create_group_scene(self, name, group):
             """Create a Group Scene
@@ -37,21 +140,34 @@ class Scene(object):
                 "recycle": True,
                 "type": "GroupScene"
             }
+            self._stale = True
             return self.bridge.bridge.post('/scenes', data)
 
         def modify_scene(self, scene_id, data):
+            self._stale = True
             return self.bridge.bridge.put('/scenes/' + scene_id, data)
 
         def get_scene(self):
-            return self.bridge.bridge.get('/scenes')
+            return self.bridge.bridge.read('/scenes')
+
+        def populate(self, snapshot):
+            """ Index the scenes made by compile_scene() from a full datastore
+            snapshot (see Bridge.bootstrap()) rather than fetching them """
+            self._compiled = self._index(snapshot.get('scenes', {}))
+            self.refresh_scenes(snapshot.get('scenes', {}))
+
+        def _index(self, scenes):
+            compiled = {}
+            for scene_id, scene in scenes.items():
+                if scene.get('name', '').startswith(self.COMPILED_PREFIX):
+                    compiled[scene['name'][len(self.COMPILED_PREFIX):]] = scene_id
+            return compiled
 
         def activate_scene(self, group_id, scene_id, transition_time=4):
-            return self.bridge.bridge.put('/groups/' +
-                                str(group_id) + '/action',
-                                {
-                                    "scene": scene_id,
-                                    "transitiontime": transition_time
-                                })
+            data = {"scene": scene_id}
+            if transition_time is not None:
+                data["transitiontime"] = transition_time
+            return self.bridge.bridge.put('/groups/' + str(group_id) + '/action', data)
 
         def run_scene(self, group_name, scene_name, transition_time=4):
             """Run a scene by group and scene name.
@@ -74,32 +190,182 @@ class Scene(object):
             :returns True if a scene was run, False otherwise
 
             """
-            groups = [x for x in self.groups if x.name == group_name]
-            scenes = [x for x in self.scenes if x.name == scene_name]
+            group_id = self.bridge.get_group_id_by_name(group_name)
+            if group_id is False:
+                logger.warn("run_scene: No group found by name {}".format(group_name))
+                return False
+            # scenes belonging to another group can't be run on this one
+            scenes = [scene for scene in self.find_scenes(name=scene_name)
+                      if not scene.group or int(scene.group) == group_id]
+            if len(scenes) == 0:
+                logger.warn("run_scene: No scene found {} for group {}".format(scene_name, group_name))
+                return False
+            if len(scenes) == 1:
+                self.activate_scene(group_id, scenes[0].scene_id, transition_time)
+                return True
+            # otherwise, lets figure out if one of the named scenes belongs
+            # to, or uses all the lights of, the group
+            group_lights = self.bridge.get_membership()[group_id]
+            in_group = self.scenes_by_group.get(group_id, [])
+            for scene in sorted(scenes, key=lambda scene: scene.scene_id not in in_group):
+                if scene.scene_id in in_group or group_lights == scene.lights:
+                    self.activate_scene(group_id, scene.scene_id, transition_time)
+                    return True
+            logger.warn("run_scene: did not find a scene: {} "
+                        "that shared lights with group {}".format(scene_name, group_name))
+            return False
+
+        def delete_scene(self, scene_id):
+            self._stale = True
+            try:
+                return self.bridge.bridge.delete('/scenes/' + str(scene_id))
+            except:
+                logger.debug("Unable to delete scene with ID {0}".format(scene_id))
+
+        @staticmethod
+        def content_hash(states):
+            """ A short hash that is the same for the same {light id: state}, in any order """
+            content = json.dumps(sorted((str(light), state) for light, state in states.items()),
+                                 sort_keys=True)
+            return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+        def compile_scene(self, states):
+            """ Store a {light id or name: state} mapping on the bridge as a scene.
+
+            The scene is named after a hash of its content, so compiling the
+            same states again (in this or a later run) just returns the
+            existing scene's id. Returns the scene id.
+
+            """
+            light_ids = self.bridge.get_light_ids(states)
+            unknown = [light for light in light_ids if light_ids[light] is False]
+            if unknown:
+                logger.warn("compile_scene: lights not available: {0}".format(unknown))
+            states = dict((str(light_ids[light]), state) for light, state in states.items()
+                          if light_ids[light] is not False)
+            key = self.content_hash(states)
+
+            if self._compiled is None:
+                self._compiled = self._index(self.get_scene())
+            if key in self._compiled:
+                return self._compiled[key]
+
+            data = {
+                "name": self.COMPILED_PREFIX + key,
+                "type": "LightScene",
+                "lights": sorted(states, key=int),
+                "lightstates": states,
+                "recycle": True
+            }
+            response = self.bridge.bridge.post('/scenes', data)
+            if 'success' not in response[0]:
+                raise PhueException(response[0]['error']['type'],
+                                    'Unable to compile scene: ' + response[0]['error']['description'])
+            scene_id = response[0]['success']['id']
+            self._stale = True
+            self._compiled[key] = scene_id
+            self.savings['compiled'] += 1
+            self.savings['commands_saved'] -= 1  # the scene has to be stored first
+            logger.debug("Compiled {0} light states into scene {1}".format(len(states), scene_id))
+            return scene_id
+
+        def _forget(self, scene_id):
+            """ Drop a compiled scene the bridge no longer has """
+            for key in [key for key, value in self._compiled.items() if value == scene_id]:
+                del self._compiled[key]
+            self._stale = True
+
+        def apply_states(self, states, transition_time=4):
+            """ Set each light to its state (as Light.Bridge.set_lights()) with one
+            scene recall, compiling the scene the first time these states are used.
+            Returns the bridge's response to the recall.
+
+            Compiled scenes may be recycled by the bridge, so if the recall
+            fails the scene is compiled afresh and recalled once more. """
+            scene_id = self.compile_scene(states)
+            response = self.activate_scene(0, scene_id, transition_time)
+            errors = [item['error'] for item in response if 'error' in item]
+            if errors:
+                logger.debug("Scene {0} is gone, compiling it again".format(scene_id))
+                self._forget(scene_id)
+                scene_id = self.compile_scene(states)
+                response = self.activate_scene(0, scene_id, transition_time)
+                errors = [item['error'] for item in response if 'error' in item]
+            if errors:
+                logger.warn("ERROR: {0} recalling scene {1}".format(
+                    errors[0]['description'], scene_id))
+                return response
+            self.savings['recalls'] += 1
+            self.savings['commands_saved'] += len(states) - 1
+            logger.debug("Scene savings so far: {0}".format(self.savings))
+            return response
+
+    class AsyncBridge(object):
+
+        """ The asyncio counterpart of Scene.Bridge, for use with a Group.AsyncBridge """
+
+        def __init__(self, bridge):
+            self.bridge = bridge
+
+        async def get_scenes(self):
+            """ Access scenes as a list """
+            return [Scene(k, **v) for k, v in (await self.get_scene()).items()]
+
+        async def create_group_scene(self, name, group):
+            """ Create a Group Scene - see Scene.Bridge.create_group_scene() """
+            data = {
+                "name": name,
+                "group": group,
+                "recycle": True,
+                "type": "GroupScene"
+            }
+            return await self.bridge.bridge.post('/scenes', data)
+
+        async def modify_scene(self, scene_id, data):
+            return await self.bridge.bridge.put('/scenes/' + scene_id, data)
+
+        async def get_scene(self):
+            return await self.bridge.bridge.get('/scenes')
+
+        async def activate_scene(self, group_id, scene_id, transition_time=4):
+            data = {"scene": scene_id}
+            if transition_time is not None:
+                data["transitiontime"] = transition_time
+            return await self.bridge.bridge.put('/groups/' + str(group_id) + '/action', data)
+
+        async def run_scene(self, group_name, scene_name, transition_time=4):
+            """ Run a scene by group and scene name - see Scene.Bridge.run_scene()
+
+            :returns True if a scene was run, False otherwise
+
+            """
+            all_groups = await self.bridge.get_group()
+            groups = [x for x in all_groups if all_groups[x]['name'] == group_name]
+            scenes = [x for x in await self.get_scenes() if x.name == scene_name]
             if len(groups) != 1:
                 logger.warn("run_scene: More than 1 group found by name {}".format(group_name))
                 return False
-            group = groups[0]
+            group_id = groups[0]
             if len(scenes) == 0:
                 logger.warn("run_scene: No scene found {}".format(scene_name))
                 return False
             if len(scenes) == 1:
-                self.activate_scene(group.group_id, scenes[0].scene_id, transition_time)
+                await self.activate_scene(group_id, scenes[0].scene_id, transition_time)
                 return True
             # otherwise, lets figure out if one of the named scenes uses
             # all the lights of the group
-            group_lights = sorted([x.light_id for x in group.lights])
+            group_lights = sorted([int(x) for x in all_groups[group_id]['lights']])
             for scene in scenes:
                 if group_lights == scene.lights:
-                    self.activate_scene(group.group_id, scene.scene_id, transition_time)
+                    await self.activate_scene(group_id, scene.scene_id, transition_time)
                     return True
             logger.warn("run_scene: did not find a scene: {} "
                         "that shared lights with group {}".format(scene_name, group_name))
             return False
 
-        def delete_scene(self, scene_id):
+        async def delete_scene(self, scene_id):
             try:
-                return self.bridge.delete('/scenes/' + str(scene_id))
+                return await self.bridge.bridge.delete('/scenes/' + str(scene_id))
             except:
                 logger.debug("Unable to delete scene with ID {0}".format(scene_id))
 
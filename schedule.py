@@ -11,13 +11,23 @@ class Schedule(object):
 
         def __init__(self, bridge):
             self.bridge = bridge
+            self._schedules = None  # from the bootstrap snapshot, until first read
+
+        def populate(self, snapshot):
+            """ Keep the schedules from a full datastore snapshot (see
+            Bridge.bootstrap()) to answer the next get_schedule() with. Only
+            that one read, as schedules change by themselves (e.g. autodelete) """
+            self._schedules = snapshot.get('schedules')
 
         # Schedules #####
         def get_schedule(self, schedule_id=None, parameter=None):
             if schedule_id is None:
-                return self.bridge.get('/schedules')
+                schedules, self._schedules = self._schedules, None
+                if schedules is not None:
+                    return schedules
+                return self.bridge.read('/schedules')
             if parameter is None:
-                return self.bridge.get('/schedules/' + str(schedule_id))
+                return self.bridge.read('/schedules/' + str(schedule_id))
 
         def create_schedule(self, name, time, light_id, data, description=' '):
             schedule = {
@@ -32,6 +42,7 @@ class Schedule(object):
                     'body': data
                 }
             }
+            self._schedules = None
             return self.bridge.post('/schedules', schedule)
 
         def set_schedule_attributes(self, schedule_id, attributes):
@@ -39,6 +50,7 @@ class Schedule(object):
             :param schedule_id: The ID of the schedule
             :param attributes: Dictionary with attributes and their new values
             """
+            self._schedules = None
             return self.bridge.put('/schedules/' + str(schedule_id), data=attributes)
 
         def create_group_schedule(self, name, time, group_id, data, description=' '):
@@ -54,7 +66,31 @@ class Schedule(object):
                     'body': data
                 }
             }
+            self._schedules = None
             return self.bridge.post('/schedules', schedule)
 
         def delete_schedule(self, schedule_id):
+            self._schedules = None
             return self.bridge.delete('/schedules/' + str(schedule_id))
+
+    class AsyncBridge(Bridge):
+
+        """ The asyncio counterpart of Schedule.Bridge, for use with an AsyncBridge """
+
+        async def get_schedule(self, schedule_id=None, parameter=None):
+            if schedule_id is None:
+                return await self.bridge.get('/schedules')
+            if parameter is None:
+                return await self.bridge.get('/schedules/' + str(schedule_id))
+
+        async def create_schedule(self, name, time, light_id, data, description=' '):
+            return await Schedule.Bridge.create_schedule(self, name, time, light_id, data, description)
+
+        async def set_schedule_attributes(self, schedule_id, attributes):
+            return await Schedule.Bridge.set_schedule_attributes(self, schedule_id, attributes)
+
+        async def create_group_schedule(self, name, time, group_id, data, description=' '):
+            return await Schedule.Bridge.create_group_schedule(self, name, time, group_id, data, description)
+
+        async def delete_schedule(self, schedule_id):
+            return await Schedule.Bridge.delete_schedule(self, schedule_id)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from uPHue import *
+from uPHue.changes import Changes
+from uPHue.identity import shared
+from uPHue.names import NameIndex
+from uPHue.query import select
 
 
 class Sensor(object):
@@ -35,25 +39,30 @@ class Sensor(object):
             self.bridge = bridge
             self.sensors_by_id = {}
             self.sensors_by_name = {}
+            self.sensor_names = NameIndex(lambda: self.get_sensor())
+            self._sensors = shared(bridge, 'sensors', lambda sensor_id: Sensor(self, sensor_id))
+            self._known_sensors = {}  # id -> (name, type) as last indexed
+            self.listeners = []  # called as listener(collection, event, id, name) by refresh()
+            self._selections = {}  # kind -> (snapshot, query.Index over it)
+
+        def sensor(self, sensor_id):
+            """ The Sensor object for sensor_id: the same one for as long as it's in use """
+            return self._sensors.get(int(sensor_id))
 
         def get_sensor_id_by_name(self, name):
-            """ Lookup a sensor id based on string name. Case-sensitive. """
-            sensors = self.get_sensor()
-            for sensor_id in sensors:
-                if name == sensors[sensor_id]['name']:
-                    return sensor_id
-            return False
+            """ Lookup a sensor id based on string name. Case-sensitive,
+            unless sensor_names.ignore_case is set """
+            return self.sensor_names.lookup(name)
 
         def get_sensor_objects(self, mode='list'):
             """Returns a collection containing the sensors, either by name or id (use 'id' or 'name' as the mode)
             The returned collection can be either a list (default), or a dict.
             Set mode='id' for a dict by sensor ID, or mode='name' for a dict by sensor name.   """
             if self.sensors_by_id == {}:
-                sensors = self.bridge.get('/sensors/')
-                for sensor in sensors:
-                    self.sensors_by_id[int(sensor)] = Sensor(self, int(sensor))
-                    self.sensors_by_name[sensors[sensor][
-                        'name']] = self.sensors_by_id[int(sensor)]
+                sensors = self.bridge.read('/sensors/')
+                with self.bridge.lock:
+                    if self.sensors_by_id == {}:
+                        self._index(sensors)
             if mode == 'id':
                 return self.sensors_by_id
             if mode == 'name':
@@ -61,6 +70,53 @@ class Sensor(object):
             if mode == 'list':
                 return self.sensors_by_id.values()
 
+        def _index(self, sensors):
+            self.sensor_names.build(sensors)
+            self._known_sensors = Changes.known(sensors)
+            for sensor in sensors:
+                self.sensors_by_id[int(sensor)] = self.sensor(sensor)
+                self.sensors_by_name[sensors[sensor][
+                    'name']] = self.sensors_by_id[int(sensor)]
+
+        def where(self, **criteria):
+            """ Select sensors by their fields, e.g. where(type='ZLLPresence'),
+            as Light.Bridge.where() does lights. Returns a query.Selection """
+            return select(self, 'sensors', self.get_sensor()).where(**criteria)
+
+        def refresh(self):
+            """ Bring the sensor index up to date with the bridge, patching in
+            only the sensors that have been added, removed or renamed, as
+            Light.Bridge.refresh() does for lights. Returns a changes.Changes """
+            sensors = self.bridge.get('/sensors/')
+            if not isinstance(sensors, dict):
+                raise PhueException(sensors[0]['error']['type'],
+                                    'Unable to refresh sensors: ' + sensors[0]['error']['description'])
+            changes = Changes()
+            with self.bridge.lock:
+                self._known_sensors = changes.diff('sensors', self._known_sensors, sensors)
+                self.sensor_names.build(sensors)
+                for collection, sensor_id, name in changes.removed:
+                    self.sensors_by_id.pop(sensor_id, None)
+                    self.sensors_by_name.pop(name, None)
+                    self._sensors.discard(sensor_id)
+                for collection, sensor_id, name in changes.added:
+                    self.sensors_by_id[sensor_id] = self.sensor(sensor_id)
+                    self.sensors_by_name[name] = self.sensors_by_id[sensor_id]
+                for collection, sensor_id, old_name, new_name in changes.renamed:
+                    self.sensors_by_name.pop(old_name, None)
+                    self.sensors_by_name[new_name] = self.sensor(sensor_id)
+                    self.sensors_by_id.setdefault(sensor_id, self.sensors_by_name[new_name])
+            changes.notify(self.listeners)
+            return changes
+
+        def populate(self, snapshot):
+            """ Build the sensor index from a full datastore snapshot
+            (see Bridge.bootstrap()) rather than fetching it """
+            with self.bridge.lock:
+                self.sensors_by_id.clear()
+                self.sensors_by_name.clear()
+                self._index(snapshot.get('sensors', {}))
+
         @property
         def sensors(self):
             """ Access sensors as a list """
@@ -88,9 +144,11 @@ class Sensor(object):
             if ("success" in result[0].keys()):
                 new_id = result[0]["success"]["id"]
                 logger.debug("Created sensor with ID " + new_id)
-                new_sensor = Sensor(self, int(new_id))
-                self.sensors_by_id[new_id] = new_sensor
-                self.sensors_by_name[name] = new_sensor
+                self.sensor_names.invalidate()
+                new_sensor = self.sensor(new_id)
+                with self.bridge.lock:
+                    self.sensors_by_id[new_id] = new_sensor
+                    self.sensors_by_name[name] = new_sensor
                 return new_id, None
             else:
                 logger.debug("Failed to create sensor:" + repr(result[0]))
@@ -102,8 +160,8 @@ class Sensor(object):
             if is_string(sensor_id):
                 sensor_id = self.get_sensor_id_by_name(sensor_id)
             if sensor_id is None:
-                return self.bridge.get('/sensors/')
-            data = self.bridge.get('/sensors/' + str(sensor_id))
+                return self.bridge.read('/sensors/')
+            data = self.bridge.read('/sensors/' + str(sensor_id), parameter)
 
             if isinstance(data, list):
                 logger.debug("Unable to read sensor with ID {0}: {1}".format(sensor_id, repr(data)))
@@ -113,10 +171,30 @@ class Sensor(object):
                 return data
             return data[parameter]
 
+        def _put(self, sensor_id, address, data):
+            """ PUT data to one sensor, or to each of a list of sensors.
+            Returns one response, or a list of them for a list of sensors. """
+            sensor_id_array = sensor_id
+            if not isinstance(sensor_id, (list, tuple)):
+                sensor_id_array = [sensor_id]
+
+            logger.debug(str(data))
+            result = self.bridge.put_many(
+                [('/sensors/' + str(sensor) + address, data) for sensor in sensor_id_array])
+            for sensor, response in zip(sensor_id_array, result):
+                if 'error' in list(response[0].keys()):
+                    logger.warn("ERROR: {0} for sensor {1}".format(
+                        response[0]['error']['description'], sensor))
+
+            logger.debug(result)
+            if sensor_id_array is sensor_id:
+                return result
+            return result[0]
+
         def set_sensor(self, sensor_id, parameter, value=None):
             """ Adjust properties of a sensor
 
-            sensor_id must be a single sensor.
+            sensor_id can be a single sensor or a list of sensors.
             parameters: 'name' : string
 
             """
@@ -125,34 +203,28 @@ class Sensor(object):
             else:
                 data = {parameter: value}
 
-            result = None
-            logger.debug(str(data))
-            result = self.bridge.put('/sensors/' + str(
-                sensor_id), data)
-            if 'error' in list(result[0].keys()):
-                logger.warn("ERROR: {0} for sensor {1}".format(
-                    result[0]['error']['description'], sensor_id))
-
-            logger.debug(result)
+            result = self._put(sensor_id, '', data)
+            if 'name' in data:
+                self.sensor_names.invalidate()
             return result
 
         def set_sensor_state(self, sensor_id, parameter, value=None):
             """ Adjust the "state" object of a sensor
 
-            sensor_id must be a single sensor.
+            sensor_id can be a single sensor or a list of sensors.
             parameters: any parameter(s) present in the sensor's "state" dictionary.
 
             """
-            self.set_sensor_content(sensor_id, parameter, value, "state")
+            return self.set_sensor_content(sensor_id, parameter, value, "state")
 
         def set_sensor_config(self, sensor_id, parameter, value=None):
             """ Adjust the "config" object of a sensor
 
-            sensor_id must be a single sensor.
+            sensor_id can be a single sensor or a list of sensors.
             parameters: any parameter(s) present in the sensor's "config" dictionary.
 
             """
-            self.set_sensor_content(sensor_id, parameter, value, "config")
+            return self.set_sensor_content(sensor_id, parameter, value, "config")
 
         def set_sensor_content(self, sensor_id, parameter, value=None, structure="state"):
             """ Adjust the "state" or "config" structures of a sensor
@@ -170,26 +242,133 @@ class Sensor(object):
             if "lastupdated" in data:
                 del data["lastupdated"]
 
-            result = None
-            logger.debug(str(data))
-            result = self.bridge.put('/sensors/' + str(
-                sensor_id) + "/" + structure, data)
-            if 'error' in list(result[0].keys()):
-                logger.warn("ERROR: {0} for sensor {1}".format(
-                    result[0]['error']['description'], sensor_id))
-
-            logger.debug(result)
-            return result
+            return self._put(sensor_id, "/" + structure, data)
 
         def delete_sensor(self, sensor_id):
+            self.sensor_names.invalidate()
             try:
                 name = self.sensors_by_id[sensor_id].name
-                del self.sensors_by_name[name]
-                del self.sensors_by_id[sensor_id]
+                with self.bridge.lock:
+                    del self.sensors_by_name[name]
+                    del self.sensors_by_id[sensor_id]
+                self._sensors.discard(int(sensor_id))
                 return self.bridge.delete('/sensors/' + str(sensor_id))
             except:
                 logger.debug("Unable to delete nonexistent sensor with ID {0}".format(sensor_id))
 
+    class AsyncBridge(object):
+
+        """ The asyncio counterpart of Sensor.Bridge, for use with an AsyncBridge """
+
+        def __init__(self, bridge):
+            self.bridge = bridge
+
+        async def get_sensor_id_by_name(self, name):
+            """ Lookup a sensor id based on string name. Case-sensitive. """
+            sensors = await self.get_sensor()
+            for sensor_id in sensors:
+                if name == sensors[sensor_id]['name']:
+                    return sensor_id
+            return False
+
+        async def get_sensor(self, sensor_id=None, parameter=None):
+            """ Gets state by sensor_id and parameter"""
+
+            if is_string(sensor_id):
+                sensor_id = await self.get_sensor_id_by_name(sensor_id)
+            if sensor_id is None:
+                return await self.bridge.get('/sensors/')
+            data = await self.bridge.get('/sensors/' + str(sensor_id))
+
+            if isinstance(data, list):
+                logger.debug("Unable to read sensor with ID {0}: {1}".format(sensor_id, repr(data)))
+                return None
+
+            if parameter is None:
+                return data
+            return data[parameter]
+
+        async def create_sensor(self, name, modelid, swversion, sensor_type, uniqueid, manufacturername, state={}, config={}, recycle=False):
+            """ Create a new sensor in the bridge. Returns (ID,None) of the new sensor or (None,message) if creation failed. """
+            data = {
+                "name": name,
+                "modelid": modelid,
+                "swversion": swversion,
+                "type": sensor_type,
+                "uniqueid": uniqueid,
+                "manufacturername": manufacturername,
+                "recycle": recycle
+            }
+            if (isinstance(state, dict) and state != {}):
+                data["state"] = state
+
+            if (isinstance(config, dict) and config != {}):
+                data["config"] = config
+
+            result = await self.bridge.post('/sensors/', data)
+
+            if ("success" in result[0].keys()):
+                new_id = result[0]["success"]["id"]
+                logger.debug("Created sensor with ID " + new_id)
+                return new_id, None
+            else:
+                logger.debug("Failed to create sensor:" + repr(result[0]))
+                return None, result[0]
+
+        async def _put(self, sensor_id, address, data):
+            sensor_id_array = sensor_id
+            if not isinstance(sensor_id, (list, tuple)):
+                sensor_id_array = [sensor_id]
+
+            logger.debug(str(data))
+            result = await self.bridge.put_many(
+                [('/sensors/' + str(sensor) + address, data) for sensor in sensor_id_array])
+            for sensor, response in zip(sensor_id_array, result):
+                if 'error' in list(response[0].keys()):
+                    logger.warn("ERROR: {0} for sensor {1}".format(
+                        response[0]['error']['description'], sensor))
+
+            logger.debug(result)
+            if sensor_id_array is sensor_id:
+                return result
+            return result[0]
+
+        async def set_sensor(self, sensor_id, parameter, value=None):
+            """ Adjust properties of one or more sensors - see Sensor.Bridge.set_sensor() """
+            if isinstance(parameter, dict):
+                data = parameter
+            else:
+                data = {parameter: value}
+
+            return await self._put(sensor_id, '', data)
+
+        async def set_sensor_state(self, sensor_id, parameter, value=None):
+            return await self.set_sensor_content(sensor_id, parameter, value, "state")
+
+        async def set_sensor_config(self, sensor_id, parameter, value=None):
+            return await self.set_sensor_content(sensor_id, parameter, value, "config")
+
+        async def set_sensor_content(self, sensor_id, parameter, value=None, structure="state"):
+            """ Adjust the "state" or "config" structures of one or more sensors
+            """
+            if (structure != "state" and structure != "config"):
+                logger.debug("set_sensor_current expects structure 'state' or 'config'.")
+                return False
+
+            if isinstance(parameter, dict):
+                data = parameter.copy()
+            else:
+                data = {parameter: value}
+
+            # Attempting to set this causes an error.
+            if "lastupdated" in data:
+                del data["lastupdated"]
+
+            return await self._put(sensor_id, "/" + structure, data)
+
+        async def delete_sensor(self, sensor_id):
+            return await self.bridge.delete('/sensors/' + str(sensor_id))
+
     def __init__(self, sensor_bridge, sensor_id):
         self.bridge = sensor_bridge
         self.sensor_id = sensor_id
@@ -233,8 +412,13 @@ class Sensor(object):
         logger.debug("Renaming sensor from '{0}' to '{1}'".format(
             old_name, value))
 
-        self.bridge.sensors_by_name[self.name] = self
-        del self.bridge.sensors_by_name[old_name]
+        new_name = self.name
+        with self.bridge.bridge.lock:
+            # the index may not have been built, if this object came from
+            # sensor(), [] or a query rather than get_sensor_objects()
+            self.bridge.sensors_by_name.pop(old_name, None)
+            if self.bridge.sensors_by_id:
+                self.bridge.sensors_by_name[new_name] = self
 
     @property
     def modelid(self):
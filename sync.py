@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from uPHue import *
+from uPHue.light import Light
+from uPHue.scene import Scene
+from uPHue.schedule import Schedule
+
+
+class Sync(object):
+
+    """ This is merely a container for `Sync.Bridge`"""
+
+    class Bridge(object):
+
+        """
+            Changes several lights at (as near as possible) the same moment,
+            instead of one after another:
+
+            >>> gb = group.Group.Bridge(b)
+            >>> sb = sync.Sync.Bridge(gb)
+            >>> sb.apply({1: {'on': True, 'bri': 254}, 2: {'on': False}}, transitiontime=4)
+
+            method='scene' (the default) stores the states as a scene and
+            recalls it, so the bridge changes all the lights itself.
+
+            method='schedule' has the bridge run one schedule per light at the
+            same second, a few seconds from now.
+
+            method='stagger' sends a command per light, but gives the earlier
+            lights correspondingly longer transitiontimes, based on how long
+            each command takes, so they all finish their transitions together.
+            It is also what the other two fall back on when the bridge won't
+            store the scene or the schedules (e.g. its tables are full).
+        """
+
+        def __init__(self, group_bridge):
+            self.bridge = group_bridge
+            self.scenes = Scene.Bridge(group_bridge)
+            self.schedules = Schedule.Bridge(group_bridge.bridge)
+
+        def _spacing(self):
+            """ Estimated seconds between consecutive light commands """
+            spacing = self.bridge.bridge.latency.mean or 0.1
+            capacity = self.bridge.bridge.capacity
+            if capacity is not None:
+                spacing = max(spacing, 1.0 / capacity['lights'])
+            return spacing
+
+        def apply(self, states, transitiontime=4, method='scene'):
+            """ Set each light to its own state, all landing together.
+
+            states : dict of light id (or name) -> state dict
+            transitiontime : in **deciseconds**
+            method : 'scene', 'schedule' or 'stagger' (see Sync.Bridge)
+
+            Returns a Light.Result.
+
+            """
+            light_ids = self.bridge.get_light_ids(states)
+            sent = {}
+            responses = {}
+            for light in states:
+                sent[light] = dict(states[light])
+                if transitiontime is not None:
+                    sent[light]['transitiontime'] = int(round(transitiontime))
+                if light_ids[light] is False:
+                    responses[light] = [{'error': {
+                        'type': 3, 'address': '/lights/' + str(light),
+                        'description': 'light, ' + str(light) + ', not available'}}]
+            lights = [light for light in states if light not in responses]
+
+            if method == 'scene':
+                try:
+                    response = self.scenes.apply_states(
+                        dict((light_ids[light], states[light]) for light in lights),
+                        transitiontime)
+                except PhueException as e:
+                    logger.warn(e.message)
+                    response = None
+                if self._failed(response):
+                    logger.warn("Scene recall failed, staggering {0} lights instead".format(len(lights)))
+                    responses.update(self._stagger(lights, light_ids, sent, transitiontime or 0))
+                else:
+                    for light in lights:
+                        responses[light] = response
+            elif method == 'schedule':
+                responses.update(self._schedule(lights, light_ids, sent))
+                failed = [light for light in lights if self._failed(responses[light])]
+                if failed:
+                    logger.warn("Unable to schedule {0} lights, staggering them instead".format(len(failed)))
+                    responses.update(self._stagger(failed, light_ids, sent, transitiontime or 0))
+            elif method == 'stagger':
+                responses.update(self._stagger(lights, light_ids, sent, transitiontime or 0))
+            else:
+                raise ValueError("method must be 'scene', 'schedule' or 'stagger'")
+            return Light.Result(self.bridge, sent, responses)
+
+        @staticmethod
+        def _failed(response):
+            """ Whether a response is missing or holds an error """
+            return response is None or any('error' in item for item in response)
+
+        def _schedule(self, lights, light_ids, sent):
+            localtime = self.bridge.bridge.get('/config')['localtime']
+            lead = int(len(lights) * self._spacing()) + 2  # time to create the schedules
+            date, clock = localtime.split('T')
+            when = time.localtime(time.mktime(tuple(
+                [int(x) for x in date.split('-')] + [int(x) for x in clock.split(':')] +
+                [0, 0, -1])) + lead)
+            when = '{0:04d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}'.format(*when[:6])
+
+            responses = {}
+            for light in lights:
+                try:
+                    responses[light] = self.schedules.create_schedule(
+                        'uPHue sync', when, light_ids[light], sent[light])
+                except PhueException as e:
+                    logger.warn("Unable to schedule light {0}: {1}".format(light, e.message))
+                    responses[light] = None
+            logger.debug("Scheduled {0} lights for {1}".format(len(lights), when))
+            return responses
+
+        def _stagger(self, lights, light_ids, sent, transitiontime):
+            spacing = self._spacing()
+            responses = {}
+            start = time.time()
+            for i, light in enumerate(lights):
+                if i > 0:
+                    # learn the real spacing as we go
+                    spacing = (time.time() - start) / i
+                remaining = len(lights) - 1 - i
+                data = dict(sent[light])
+                data['transitiontime'] = int(round(transitiontime + remaining * spacing * 10))
+                responses[light] = self.bridge.bridge.put(
+                    '/lights/' + str(light_ids[light]) + '/state', data)
+            return responses
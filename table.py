@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from uPHue import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class StateTable(object):
+
+    """ The state of every light as columns of NumPy arrays, one row per light
+
+    Built from a single `/lights` response (see Light.Bridge.get_state_table()).
+    Columns are read by field name, and filtered with ordinary NumPy masks:
+
+    >>> t = lb.get_state_table()
+    >>> t['bri']
+    array([254, 127,  10])
+    >>> t.ids[t['on'] & (t['bri'] > 100)]
+    array([1, 2])
+
+    Writes are made a column at a time, to every light or just the ones a
+    mask selects; only lights whose value actually changes are kept, and
+    commit() sends each of them one command with all its changes (or, from
+    a Group.Bridge, one group command wherever that covers several lights):
+
+    >>> t.set('bri', t['bri'] // 2, mask=t['on'])
+    >>> t.set('xy', [0.3, 0.3], mask=t['colormode'] == 'xy')
+    >>> t.commit(transitiontime=10)
+
+    Fields a light doesn't have (e.g. hue on a white bulb) read as -1, or
+    nan for xy, and are never written to it.
+
+    """
+
+    INTS = ('bri', 'hue', 'sat', 'ct')
+    BOOLS = ('on', 'reachable')
+    STRINGS = ('colormode', 'effect', 'alert')
+    FIELDS = INTS + BOOLS + STRINGS + ('xy',)
+
+    def __init__(self, light_bridge, lights):
+        if numpy is None:
+            raise ImportError('StateTable needs numpy')
+        self.bridge = light_bridge
+        keys = sorted(lights, key=int)
+        states = [lights[key].get('state', {}) for key in keys]
+        self.ids = numpy.array([int(key) for key in keys], dtype=int)
+        self.rows = dict((light_id, row) for row, light_id in enumerate(self.ids.tolist()))
+        self.columns = {}
+        for field in self.INTS:
+            self.columns[field] = numpy.array([state.get(field, -1) for state in states], dtype=int)
+        for field in self.BOOLS:
+            self.columns[field] = numpy.array([bool(state.get(field, False)) for state in states], dtype=bool)
+        for field in self.STRINGS:
+            self.columns[field] = numpy.array([state.get(field, '') for state in states], dtype=object)
+        self.columns['xy'] = numpy.array([state.get('xy', [numpy.nan, numpy.nan]) for state in states],
+                                         dtype=float).reshape(len(states), 2)
+        self._has = dict((field, numpy.array([field in state for state in states], dtype=bool))
+                         for field in self.FIELDS)
+        self.pending = {}  # light id -> state to send
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return '<{0}.{1} lights={2} pending={3}>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            len(self.ids),
+            len(self.pending))
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def row(self, light_id):
+        """ The row of the table holding light_id """
+        return self.rows[int(light_id)]
+
+    def where(self, mask):
+        """ The ids of the lights mask selects """
+        return self.ids[numpy.asarray(mask, dtype=bool)]
+
+    def set(self, field, values, mask=None):
+        """ Set a column to values (one value, or one per light), for every
+        light or only those mask selects. Returns the ids of the lights
+        whose value changed, which commit() will send """
+        if field not in self.FIELDS or field in ('reachable', 'colormode'):
+            raise ValueError('{0} is not a writable field'.format(field))
+        column = self.columns[field]
+        new = numpy.array(numpy.broadcast_to(numpy.asarray(values, dtype=column.dtype), column.shape))
+        selected = self._has[field].copy()
+        if mask is not None:
+            selected &= numpy.asarray(mask, dtype=bool)
+        differs = new != column
+        if differs.ndim > 1:
+            differs = differs.any(axis=1)
+        changed = selected & differs
+        for row in numpy.flatnonzero(changed).tolist():
+            value = new[row]
+            if isinstance(value, (numpy.ndarray, numpy.generic)):
+                value = value.tolist()  # a plain Python value, for the JSON
+            merge_state(self.pending.setdefault(int(self.ids[row]), {}), {field: value})
+            column[row] = new[row]
+        return self.ids[changed]
+
+    def commit(self, transitiontime=None):
+        """ Send the changes made with set(): one command per changed light,
+        or through the group planner if the table came from a Group.Bridge
+        (see Group.Bridge.set_lights_planned()). Returns a Light.Result for
+        the per-light commands (or None if nothing has changed) """
+        if not self.pending:
+            return None
+        pending, self.pending = self.pending, {}
+        if hasattr(self.bridge, 'set_lights_planned'):
+            return self.bridge.set_lights_planned(pending, transitiontime)
+        return self.bridge.set_lights(pending, transitiontime)
@@ -34,3 +34,20 @@ class FakeHTTP(object):
 
     def close(self):
         pass
+
+
+def load_uphue():
+    """Import the uPHue package from this checkout, whatever its directory
+    is called (uPHue.py, the single-file version, would otherwise be found
+    under the same name)."""
+    import importlib.util
+    import os
+    if 'uPHue' in sys.modules and hasattr(sys.modules['uPHue'], '__path__'):
+        return sys.modules['uPHue']
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        'uPHue', os.path.join(root, '__init__.py'), submodule_search_locations=[root])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['uPHue'] = package
+    spec.loader.exec_module(package)
+    return package
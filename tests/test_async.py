@@ -0,0 +1,192 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for async_bridge.AsyncBridge and the async managers, over fake
+# asyncio streams.
+
+import asyncio
+import json
+import os
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.async_bridge import AsyncBridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+from uPHue.scene import Scene  # noqa: E402
+
+
+def response(data, close=False, chunked=False):
+    body = json.dumps(data).encode('utf-8')
+    headers = 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+    if close:
+        headers += 'Connection: close\r\n'
+    if chunked:
+        headers += 'Transfer-Encoding: chunked\r\n'
+        body = '{0:x}\r\n'.format(len(body)).encode('ascii') + body + b'\r\n0\r\n\r\n'
+    else:
+        headers += 'Content-Length: {0}\r\n'.format(len(body))
+    return (headers + '\r\n').encode('ascii') + body
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def write(self, data):
+        self.sent.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStream(object):
+
+    """One connection to the bridge: replies are fed to the reader as each
+    request is written, and once they run out the connection is dropped"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.reader = asyncio.StreamReader()
+        self.writer = FakeWriter()
+        write = self.writer.write
+
+        def reply(data):
+            write(data)
+            if self.replies:
+                self.reader.feed_data(self.replies.pop(0))
+            else:
+                self.reader.feed_eof()
+        self.writer.write = reply
+
+    def requests(self):
+        return [data.split(b'\r\n', 1)[0].decode('ascii') for data in self.writer.sent]
+
+
+class TestAsyncBridge(testtools.TestCase):
+
+    def setUp(self):
+        super(TestAsyncBridge, self).setUp()
+        self.bridge = AsyncBridge(ip="10.0.0.0", username="username", pool_size=2)
+        self.replies = []  # replies for each connection opened
+        self.streams = []
+        self.useFixture(fixtures.MonkeyPatch('asyncio.open_connection', self.open_connection))
+
+    async def open_connection(self, host, port):
+        stream = FakeStream(self.replies.pop(0))
+        self.streams.append(stream)
+        return stream.reader, stream.writer
+
+    def run_requests(self, *requests):
+        async def send():
+            return [await self.bridge.arequest(*request) for request in requests]
+        return asyncio.run(send())
+
+    def test_keep_alive_reused(self):
+        self.replies = [[response({'name': 'Hall'}), response([{'success': {}}])]]
+        responses = self.run_requests(('GET', '/api/username/lights/1'),
+                                      ('PUT', '/api/username/lights/1/state', {'on': True}))
+        self.assertEqual(responses, [{'name': 'Hall'}, [{'success': {}}]])
+        self.assertEqual(len(self.streams), 1)
+        self.assertEqual(self.streams[0].requests(), ['GET /api/username/lights/1 HTTP/1.1',
+                                                      'PUT /api/username/lights/1/state HTTP/1.1'])
+        self.assertTrue(self.streams[0].writer.sent[1].endswith(b'{"on": true}'))
+
+    def test_chunked_and_close(self):
+        self.replies = [[response([1, 2], chunked=True), response([3], close=True)], [response([4])]]
+        responses = self.run_requests(('GET', '/a'), ('GET', '/b'), ('GET', '/c'))
+        self.assertEqual(responses, [[1, 2], [3], [4]])
+        self.assertTrue(self.streams[0].writer.closed)
+        self.assertEqual(len(self.streams), 2)
+
+    def test_dropped_connection_resends_get(self):
+        self.replies = [[response([1])], [response([2])]]
+        self.assertEqual(self.run_requests(('GET', '/a'), ('GET', '/b')), [[1], [2]])
+        self.assertEqual(self.streams[1].requests(), ['GET /b HTTP/1.1'])
+
+    def test_dropped_connection_post_not_resent(self):
+        self.replies = [[response([1])], [response([2])]]
+        self.assertRaises(EOFError, self.run_requests, ('GET', '/a'), ('POST', '/b', {}))
+        self.assertEqual(len(self.streams), 1)
+
+    def test_dropped_connection_increment_not_resent(self):
+        self.replies = [[response([1])], [response([2])]]
+        self.assertRaises(EOFError, self.run_requests,
+                          ('GET', '/a'), ('PUT', '/b', {'bri_inc': 10}))
+        self.assertEqual(len(self.streams), 1)
+
+    def test_fresh_connection_failure_raised(self):
+        self.replies = [[]]
+        self.assertRaises(EOFError, self.run_requests, ('GET', '/a'))
+
+    def test_set_light_concurrent(self):
+        """Each of the pool_size connections carries its share of the commands."""
+        self.replies = [[response([{'success': {}}])] * 2, [response([{'success': {}}])] * 2]
+        lb = Light.AsyncBridge(self.bridge)
+        result = asyncio.run(lb.set_light([1, 2, 3, 4], 'on', True, transitiontime=4))
+        self.assertEqual(result, [[{'success': {}}]] * 4)
+        self.assertEqual(len(self.streams), 2)
+        sent = sorted(request for stream in self.streams for request in stream.requests())
+        self.assertEqual(sent, ['PUT /api/username/lights/{0}/state HTTP/1.1'.format(n) for n in range(1, 5)])
+
+    def test_get_light_by_name(self):
+        lights = {'1': {'name': 'Hall', 'state': {'bri': 10}}, '2': {'name': 'Porch', 'state': {'bri': 20}}}
+        self.replies = [[response(lights), response(lights['2'])]]
+        lb = Light.AsyncBridge(self.bridge)
+        self.assertEqual(asyncio.run(lb.get_light('Porch', 'bri')), 20)
+        self.assertEqual(self.streams[0].requests(), ['GET /api/username/lights/ HTTP/1.1',
+                                                      'GET /api/username/lights/2 HTTP/1.1'])
+
+    def test_get_many(self):
+        self.replies = [[response({'name': 'Hall'})], [response({'name': 'Porch'})]]
+        responses = asyncio.run(self.bridge.get_many(['/lights/1', '/lights/2']))
+        self.assertEqual(responses, [{'name': 'Hall'}, {'name': 'Porch'}])
+        self.assertEqual(asyncio.run(self.bridge.read_many([])), [])
+
+    def test_bootstrap(self):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.bridge.topology_file_path = os.path.join(tempdir, 'topology')
+        snapshot = {'lights': {'1': {'name': 'Hall', 'type': 'Dimmable light', 'state': {}}}, 'config': {}}
+        self.replies = [[response(snapshot)]]
+        manager = mock.Mock(spec=['populate'])
+        self.assertEqual(asyncio.run(self.bridge.bootstrap(manager)), snapshot)
+        manager.populate.assert_called_once_with(snapshot)
+        self.assertEqual(self.streams[0].requests(), ['GET /api/username HTTP/1.1'])
+
+
+    def test_warm_bootstrap(self):
+        """The saved topology is used straight away, and checked from a task."""
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.bridge = AsyncBridge(ip="10.0.0.0", username="username", pool_size=1)
+        self.bridge.topology_file_path = os.path.join(tempdir, 'topology')
+        self.bridge.save_topology({'lights': {'1': {'name': 'Hall'}}})
+        manager = mock.Mock(spec=['populate'])
+
+        async def warm():
+            topology = await self.bridge.bootstrap(manager, warm=True)
+            manager.populate.assert_called_once_with(topology)
+            self.assertEqual(self.streams, [])
+            await self.bridge._check
+            return topology
+        self.replies = [[response({}), response({'1': {'name': 'Hob'}}), response({}), response({})]]
+        self.assertEqual(asyncio.run(warm()), {'lights': {'1': {'name': 'Hall'}}})
+        self.assertEqual(self.streams[0].requests(),
+                         ['GET /api/username/{0} HTTP/1.1'.format(collection)
+                          for collection in ('groups', 'lights', 'scenes', 'sensors')])
+        asyncio.run(self.bridge.get_many([]))
+        self.assertEqual(manager.populate.call_args[0][0]['lights'], {'1': {'name': 'Hob'}})
+
+    def test_activate_scene_without_transition(self):
+        self.replies = [[response([{'success': {}}])]]
+        scenes = Scene.AsyncBridge(Group.AsyncBridge(self.bridge))
+        asyncio.run(scenes.activate_scene(1, 'abc', transition_time=None))
+        self.assertTrue(self.streams[0].writer.sent[0].endswith(b'{"scene": "abc"}'))
@@ -0,0 +1,178 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for Bridge.bootstrap(), which builds the managers from one GET /api,
+# and the topology it saves to warm start from.
+
+import copy
+import json
+import os
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue import PhueException  # noqa: E402
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.cache import Cache  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+from uPHue.scene import Scene  # noqa: E402
+from uPHue.schedule import Schedule  # noqa: E402
+from uPHue.sensor import Sensor  # noqa: E402
+
+API = {
+    'lights': {'1': {'name': 'Hob', 'type': 'Dimmable light', 'state': {'on': True, 'bri': 100}},
+               '2': {'name': 'Sink', 'type': 'Dimmable light', 'state': {'on': False, 'bri': 1}}},
+    'groups': {'1': {'name': 'Kitchen', 'type': 'Room', 'lights': ['1', '2'], 'action': {'on': True}}},
+    'sensors': {'5': {'name': 'Motion', 'type': 'ZLLPresence', 'state': {'presence': False}}},
+    'scenes': {'abc': {'name': 'Relax', 'type': 'GroupScene', 'group': '1', 'lights': ['1', '2'],
+                       'version': 2, 'lastupdated': '2020-01-01T00:00:00'}},
+    'schedules': {'1': {'name': 'Wake', 'localtime': 'W127/T07:00:00'}},
+    'config': {'name': 'Philips hue'},
+}
+
+
+class BootstrapTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(BootstrapTestCase, self).setUp()
+        self.config_file_path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'config')
+        self.api = copy.deepcopy(API)
+        self.requests = []
+
+    def bridge(self, **kwargs):
+        bridge = Bridge(ip="10.0.0.0", username="username", config_file_path=self.config_file_path, **kwargs)
+        self.useFixture(fixtures.MockPatchObject(bridge, 'request', side_effect=self.request))
+        self.addCleanup(bridge.close)
+        return bridge
+
+    def request(self, mode, address, data=None):
+        address = address[len('/api/username'):]
+        self.requests.append((mode, address))
+        parts = address.strip('/').split('/')
+        if not parts[0]:
+            return copy.deepcopy(self.api)
+        data = self.api[parts[0]]
+        return copy.deepcopy(data[parts[1]] if len(parts) > 1 else data)
+
+
+class TestBootstrap(BootstrapTestCase):
+
+    def test_one_request_fills_everything(self):
+        bridge = self.bridge(cache=Cache(ttl=10))
+        gb = Group.Bridge(bridge)
+        sb = Sensor.Bridge(bridge)
+        scb = Scene.Bridge(gb)
+        schb = Schedule.Bridge(bridge)
+        bridge.bootstrap(gb, sb, scb, schb)
+        self.assertEqual(sorted(gb.get_light_objects('name')), ['Hob', 'Sink'])
+        self.assertEqual(gb.get_membership()[1], [1, 2])
+        self.assertEqual(gb.get_group_id_by_name('Kitchen'), 1)
+        self.assertEqual(sorted(sb.get_sensor_objects('name')), ['Motion'])
+        self.assertEqual([scene.scene_id for scene in scb.find_scenes(name='Relax', group='Kitchen')], ['abc'])
+        self.assertEqual(schb.get_schedule(), self.api['schedules'])
+        self.assertEqual(gb.get_light(1, 'bri'), 100)
+        self.assertEqual(gb.get_group(1, 'name'), 'Kitchen')
+        self.assertEqual(bridge.read('/sensors/5'), self.api['sensors']['5'])
+        self.assertEqual(schb.get_schedule(), self.api['schedules'])  # now from the cache
+        self.assertEqual(self.requests, [('GET', '')])
+
+    def test_schedules_without_cache(self):
+        """Without a cache the snapshot answers only the first schedule read."""
+        bridge = self.bridge()
+        schb = Schedule.Bridge(bridge)
+        bridge.bootstrap(schb)
+        self.assertEqual(schb.get_schedule(), self.api['schedules'])
+        schb.get_schedule()
+        self.assertEqual(self.requests, [('GET', ''), ('GET', '/schedules')])
+
+    def test_error_raised(self):
+        bridge = self.bridge()
+        self.api = [{'error': {'type': 1, 'address': '/', 'description': 'unauthorized user'}}]
+        self.assertRaises(PhueException, bridge.bootstrap, Light.Bridge(bridge))
+
+
+class TestTopology(BootstrapTestCase):
+
+    def test_cold_bootstrap_saves_topology(self):
+        bridge = self.bridge()
+        lb = Light.Bridge(bridge)
+        self.assertEqual(bridge.bootstrap(lb), self.api)
+        self.assertEqual(self.requests, [('GET', '')])
+        self.assertEqual(sorted(lb.lights_by_name), ['Hob', 'Sink'])
+        with open(self.config_file_path + '.topology') as f:
+            saved = json.loads(f.read())
+        self.assertEqual(saved, {'10.0.0.0': Bridge.topology(self.api)})
+        self.assertEqual(saved['10.0.0.0']['lights']['1'], {'name': 'Hob', 'type': 'Dimmable light'})
+        self.assertNotIn('schedules', saved['10.0.0.0'])
+
+    def test_load_topology(self):
+        bridge = self.bridge()
+        self.assertIsNone(bridge.load_topology())
+        bridge.save_topology({'lights': {}})
+        self.assertEqual(bridge.load_topology(), {'lights': {}})
+        other = Bridge(ip="10.0.0.1", username="username", config_file_path=self.config_file_path)
+        self.assertIsNone(other.load_topology())
+
+    def warm_start(self, *managers):
+        """Warm start, returning the background check without running it"""
+        bridge = managers[0].bridge
+        with mock.patch('uPHue.bridge.threading.Thread') as thread:
+            topology = bridge.bootstrap(*managers, warm=True)
+        return topology, thread.call_args[1]['target']
+
+    def test_warm_start_without_requests(self):
+        self.bridge().bootstrap()
+        self.requests = []
+        gb = Group.Bridge(self.bridge())
+        topology, check = self.warm_start(gb)
+        self.assertEqual(topology, Bridge.topology(self.api))
+        self.assertEqual(self.requests, [])
+        self.assertEqual(sorted(gb.lights_by_name), ['Hob', 'Sink'])
+        self.assertEqual(gb.get_membership()[1], [1, 2])
+        self.assertEqual(gb.get_group_id_by_name('Kitchen'), 1)
+        self.assertEqual(self.requests, [])
+
+    def test_warm_start_without_topology(self):
+        """With nothing saved, a warm start is a cold one."""
+        lb = Light.Bridge(self.bridge())
+        self.assertEqual(lb.bridge.bootstrap(lb, warm=True), self.api)
+        self.assertEqual(self.requests, [('GET', '')])
+
+    def test_unchanged_topology_kept(self):
+        self.bridge().bootstrap()
+        lb = Light.Bridge(self.bridge())
+        topology, check = self.warm_start(lb)
+        light = lb.lights_by_name['Hob']
+        self.api['lights']['1']['state']['bri'] = 200  # state isn't topology
+        check()
+        self.assertEqual(sorted(self.requests[1:]), [('GET', '/groups'), ('GET', '/lights'),
+                                                     ('GET', '/scenes'), ('GET', '/sensors')])
+        lb.bridge.get('/config')
+        self.assertIs(lb.lights_by_name['Hob'], light)
+        self.assertIsNone(lb.bridge._revalidation)
+
+    def test_changed_topology_rebuilds(self):
+        """A rename found by the check is picked up on the next get."""
+        self.bridge().bootstrap()
+        lb = Light.Bridge(self.bridge())
+        topology, check = self.warm_start(lb)
+        self.api['lights']['1']['name'] = 'Oven'
+        self.api['lights']['3'] = {'name': 'Desk', 'type': 'Dimmable light', 'state': {}}
+        check()
+        self.assertEqual(sorted(lb.lights_by_name), ['Hob', 'Sink'])
+        lb.bridge.get('/config')
+        self.assertEqual(sorted(lb.lights_by_name), ['Desk', 'Oven', 'Sink'])
+        self.assertEqual(lb.bridge.load_topology()['lights']['1']['name'], 'Oven')
+
+    def test_failed_check_ignored(self):
+        self.bridge().bootstrap()
+        lb = Light.Bridge(self.bridge())
+        topology, check = self.warm_start(lb)
+        self.api['lights'] = [{'error': {'type': 1, 'address': '/lights', 'description': 'unauthorized user'}}]
+        check()
+        self.assertIsNone(lb.bridge._revalidation)
+        self.assertEqual(sorted(lb.lights_by_name), ['Hob', 'Sink'])
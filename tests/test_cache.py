@@ -0,0 +1,151 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for cache.Cache, the read-through cache with a ttl per field.
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.cache import Cache, Transitions, patch  # noqa: E402
+
+LIGHT = {'name': 'Hall', 'type': 'Extended color light',
+         'state': {'on': True, 'bri': 100}}
+
+
+class TestCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCache, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+
+    def lookup(self, cache, field, data=LIGHT):
+        fetch = mock.Mock(return_value=data)
+        result = cache.lookup('/lights/1', field, fetch)
+        return result, fetch.call_count
+
+    def test_fresh_hit(self):
+        cache = Cache(ttl=1.0)
+        self.assertEqual(self.lookup(cache, 'state'), (LIGHT, 1))
+        self.now += 0.5
+        self.assertEqual(self.lookup(cache, 'state'), (LIGHT, 0))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired_refetched(self):
+        cache = Cache(ttl=1.0)
+        self.lookup(cache, 'state')
+        self.now += 1.5
+        self.assertEqual(self.lookup(cache, 'state'), (LIGHT, 1))
+
+    def test_static_field_kept(self):
+        cache = Cache(ttl=1.0)
+        self.lookup(cache, 'state')
+        self.now += 3600
+        self.assertEqual(self.lookup(cache, 'type'), (LIGHT, 0))
+        self.assertIsNone(cache.get('/lights/1', 'state'))
+
+    def test_policy_per_field(self):
+        cache = Cache(ttl=1.0, policies={'name': 60, 'state': 0.1})
+        self.lookup(cache, 'state')
+        self.now += 0.5
+        self.assertEqual(self.lookup(cache, 'name'), (LIGHT, 0))
+        self.assertEqual(self.lookup(cache, 'state'), (LIGHT, 1))
+        self.assertEqual(cache.policy('type'), None)
+        self.assertEqual(cache.policy('bri'), 1.0)
+
+    def test_stale_returned_while_revalidated(self):
+        cache = Cache(ttl=1.0, stale=5.0)
+        self.lookup(cache, 'state')
+        self.now += 3
+        newer = {'name': 'Hall', 'state': {'on': False}}
+        with mock.patch('uPHue.cache.threading', None):
+            self.assertEqual(self.lookup(cache, 'state', newer), (LIGHT, 1))
+        self.assertEqual(cache.get('/lights/1', 'state'), newer)
+        self.assertEqual(cache.hits, 1)
+
+    def test_too_stale_fetched(self):
+        cache = Cache(ttl=1.0, stale=5.0)
+        self.lookup(cache, 'state')
+        self.now += 10
+        newer = {'name': 'Hall', 'state': {'on': False}}
+        self.assertEqual(self.lookup(cache, 'state', newer), (newer, 1))
+
+    def test_collection_stores_members(self):
+        cache = Cache(ttl=1.0)
+        cache.store('/lights', {'1': LIGHT, '2': LIGHT})
+        self.assertEqual(cache.get('/lights/2', 'state'), LIGHT)
+
+    def test_error_response_not_stored(self):
+        cache = Cache(ttl=1.0)
+        error = [{'error': {'type': 3, 'description': 'resource not available'}}]
+        self.assertEqual(self.lookup(cache, 'state', error), (error, 1))
+        self.assertIsNone(cache.get('/lights/1'))
+
+    def test_group_command_invalidates_lights(self):
+        cache = Cache(ttl=1.0)
+        cache.store('/lights/1', LIGHT)
+        cache.store('/groups/1', {'name': 'Kitchen'})
+        cache.invalidate('/groups/1/action')
+        self.assertIsNone(cache.get('/groups/1'))
+        self.assertIsNone(cache.get('/lights/1'))
+
+
+class TestTransitions(testtools.TestCase):
+
+    def setUp(self):
+        super(TestTransitions, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+        self.transitions = Transitions()
+
+    def fade(self, data, state, duration):
+        changes = [(('state', key), value) for key, value in state.items()]
+        undo = patch(data, changes)[1]
+        self.transitions.start('/lights/1', changes, undo, duration)
+
+    def state(self, data):
+        return self.transitions.predict('/lights/1', data)['state']
+
+    def test_interpolated(self):
+        data = {'state': {'bri': 100, 'xy': [0.2, 0.4], 'on': True}}
+        self.fade(data, {'bri': 200, 'xy': [0.4, 0.2], 'on': False}, 2.0)
+        self.now += 0.5
+        self.assertEqual(self.state(data), {'bri': 125, 'xy': [0.25, 0.35], 'on': True})
+        self.assertEqual(data['state']['bri'], 100)
+
+    def test_finished(self):
+        data = {'state': {'bri': 100}}
+        self.fade(data, {'bri': 200}, 1.0)
+        self.now += 1.0
+        self.assertIs(self.transitions.predict('/lights/1', data), data)
+        self.assertEqual(len(self.transitions), 0)
+
+    def test_hue_wraps(self):
+        """A fade from 65000 to 1000 goes up through 0, not down through 33000."""
+        data = {'state': {'hue': 65000}}
+        self.fade(data, {'hue': 1000}, 2.0)
+        self.now += 0.5
+        self.assertEqual(self.state(data)['hue'], 65384)
+        self.now += 1.0
+        self.assertEqual(self.state(data)['hue'], 616)
+
+    def test_correct_rebases(self):
+        """A polled value becomes the start of the rest of the fade."""
+        data = {'state': {'bri': 0}}
+        self.fade(data, {'bri': 200}, 2.0)
+        self.now += 1.0
+        polled = {'state': {'bri': 150}}
+        self.transitions.correct('/lights/1', polled)
+        self.now += 0.5
+        self.assertEqual(self.state(polled)['bri'], 175)
+
+    def test_correct_at_target_ends(self):
+        data = {'state': {'bri': 0}}
+        self.fade(data, {'bri': 200}, 2.0)
+        self.transitions.correct('/lights/1', {'state': {'bri': 200}})
+        self.assertEqual(len(self.transitions), 0)
+        self.transitions.correct('/lights/1', {'state': {'bri': 200}})
+        self.transitions.stop('/lights/1')
@@ -0,0 +1,106 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for changes.Changes, which works out what a refresh of the lights,
+# groups or sensors found had changed.
+
+import copy
+
+import mock
+import testtools
+
+import fakes
+import samples
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.changes import Changes  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+
+LIGHTS = {
+    '1': {'name': 'Hall', 'type': 'Extended color light'},
+    '2': {'name': 'Porch', 'type': 'Dimmable light'},
+    '3': {'name': 'Desk', 'type': 'Color temperature light'},
+}
+
+
+class TestDiff(testtools.TestCase):
+
+    def diff(self, current, known=LIGHTS):
+        changes = Changes()
+        now = changes.diff('lights', Changes.known(known), current)
+        return changes, now
+
+    def test_nothing_changed(self):
+        changes, now = self.diff(copy.deepcopy(LIGHTS))
+        self.assertFalse(changes)
+        self.assertEqual(now, Changes.known(LIGHTS))
+
+    def test_added(self):
+        current = copy.deepcopy(LIGHTS)
+        current['4'] = {'name': 'Shed', 'type': 'On/Off plug-in unit'}
+        changes, now = self.diff(current)
+        self.assertEqual((changes.added, changes.removed, changes.renamed),
+                         ([('lights', 4, 'Shed')], [], []))
+        self.assertEqual(now[4], ('Shed', 'On/Off plug-in unit'))
+
+    def test_removed(self):
+        current = copy.deepcopy(LIGHTS)
+        del current['2']
+        changes, now = self.diff(current)
+        self.assertEqual((changes.added, changes.removed, changes.renamed),
+                         ([], [('lights', 2, 'Porch')], []))
+        self.assertNotIn(2, now)
+
+    def test_renamed(self):
+        current = copy.deepcopy(LIGHTS)
+        current['3']['name'] = 'Study'
+        changes, now = self.diff(current)
+        self.assertEqual((changes.added, changes.removed, changes.renamed),
+                         ([], [], [('lights', 3, 'Desk', 'Study')]))
+
+    def test_type_change_is_remove_and_add(self):
+        """A bulb swapped for another kind under the same id."""
+        current = copy.deepcopy(LIGHTS)
+        current['1'] = {'name': 'Hall', 'type': 'Dimmable light'}
+        changes, now = self.diff(current)
+        self.assertEqual((changes.added, changes.removed, changes.renamed),
+                         ([('lights', 1, 'Hall')], [('lights', 1, 'Hall')], []))
+
+    def test_ignores_non_resources(self):
+        current = copy.deepcopy(LIGHTS)
+        current['bogus'] = 'not a light'
+        changes, now = self.diff(current)
+        self.assertFalse(changes)
+
+    def test_notify_order(self):
+        """Removals are reported before additions and renames, and a
+        failing listener doesn't stop the others."""
+        current = copy.deepcopy(LIGHTS)
+        del current['2']
+        current['3']['name'] = 'Study'
+        current['4'] = {'name': 'Shed', 'type': 'On/Off plug-in unit'}
+        changes, now = self.diff(current)
+        seen = []
+        changes.notify([mock.Mock(side_effect=ValueError), lambda *event: seen.append(event)])
+        self.assertEqual(seen, [('lights', 'removed', 2, 'Porch'),
+                                ('lights', 'added', 4, 'Shed'),
+                                ('lights', 'renamed', 3, 'Study')])
+
+
+class TestRefresh(testtools.TestCase):
+
+    def test_refresh_patches_index(self):
+        bridge = Bridge(ip="10.0.0.0", username="username")
+        lb = Light.Bridge(bridge)
+        lights = copy.deepcopy(samples.LIGHTS1)
+        with mock.patch.object(bridge, 'request', return_value=lights):
+            lb.refresh()
+            kept = lb.lights_by_id[1]
+            lights['1']['name'] = 'Renamed Bulb'
+            del lights['10']
+            changes = lb.refresh()
+        self.assertEqual(changes.renamed, [('lights', 1, 'Living Room Bulb', 'Renamed Bulb')])
+        self.assertEqual(changes.removed, [('lights', 10, 'Porch 4')])
+        self.assertIs(lb.lights_by_name['Renamed Bulb'], kept)
+        self.assertNotIn('Living Room Bulb', lb.lights_by_name)
+        self.assertNotIn(10, lb.lights_by_id)
@@ -0,0 +1,91 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for dispatch.Dispatcher, the last-write-wins queue behind
+# Bridge(queued=True).
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+
+
+class TestDispatcher(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDispatcher, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username", queued=True)
+        self.dispatcher = self.bridge.dispatcher
+
+    def hold(self):
+        """Keep the queue from being sent until the test lets it go"""
+        return mock.patch('uPHue.dispatch.threading.Thread')
+
+    def test_response_as_the_bridge_gives_it(self):
+        with self.hold():
+            response = self.bridge.put('/lights/1/state', {'bri': 10, 'transitiontime': 4})
+        self.assertEqual(response, [{'success': {'/lights/1/state/bri': 10}}])
+
+    def test_other_puts_not_queued(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[]) as request:
+            self.bridge.put('/lights/1', {'name': 'Hall'})
+        request.assert_called_once_with('PUT', '/api/username/lights/1', {'name': 'Hall'})
+        self.assertEqual(len(self.dispatcher), 0)
+
+    def test_merged(self):
+        with self.hold():
+            self.bridge.put('/lights/1/state', {'bri': 10, 'on': True})
+            self.bridge.put('/lights/1/state', {'bri': 20, 'xy': [0.3, 0.3]})
+            self.bridge.put('/lights/1/state', {'hue': 100})
+        self.assertEqual(self.dispatcher._pending['/lights/1/state'],
+                         {'bri': 20, 'on': True, 'hue': 100})
+        self.assertEqual(self.dispatcher.merged, 2)
+
+    def test_queue_depth_bounded(self):
+        """However many commands are written, one is queued per light or group."""
+        with self.hold():
+            for bri in range(100):
+                for light in (1, 2, 3):
+                    self.bridge.put('/lights/{0}/state'.format(light), {'bri': bri})
+                self.bridge.put('/groups/1/action', {'bri': bri})
+        self.assertEqual(len(self.dispatcher), 4)
+        self.assertEqual(self.dispatcher._order, ['/lights/1/state', '/lights/2/state',
+                                                  '/lights/3/state', '/groups/1/action'])
+        self.assertEqual(self.dispatcher._pending['/lights/2/state'], {'bri': 99})
+
+    def test_sent_in_order(self):
+        sent = []
+        with mock.patch.object(self.bridge, 'request',
+                               side_effect=lambda mode, address, data: sent.append((address, data)) or []):
+            with self.hold():
+                self.bridge.put('/lights/1/state', {'bri': 10})
+                self.bridge.put('/lights/2/state', {'on': False})
+                self.bridge.put('/lights/1/state', {'bri': 30})
+            self.dispatcher._thread = None
+            self.bridge.put('/groups/1/action', {'on': True})
+            self.assertTrue(self.bridge.flush(5))
+        self.assertEqual(sent, [('/api/username/lights/1/state', {'bri': 30}),
+                                ('/api/username/lights/2/state', {'on': False}),
+                                ('/api/username/groups/1/action', {'on': True})])
+
+    def test_error_invalidates(self):
+        error = [{'error': {'type': 7, 'address': '/lights/1/state/bri', 'description': 'invalid value'}}]
+        with mock.patch.object(self.bridge, 'request', return_value=error):
+            with mock.patch.object(self.bridge, '_invalidate') as invalidate:
+                self.bridge.put('/lights/1/state', {'bri': 300})
+                self.assertTrue(self.bridge.flush(5))
+        invalidate.assert_called_with('/lights/1/state')
+
+    def test_close_sends_queue_and_stops(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[{'success': {}}]) as request:
+            self.bridge.put('/lights/1/state', {'bri': 10})
+            thread = self.dispatcher._thread
+            self.bridge.close()
+            request.assert_called_once_with('PUT', '/api/username/lights/1/state', {'bri': 10})
+            self.assertFalse(thread.is_alive())
+            self.assertIsNone(self.dispatcher._thread)
+            self.bridge.put('/lights/1/state', {'bri': 20})
+            self.assertTrue(self.bridge.flush(5))
+        self.assertEqual(request.call_count, 2)
@@ -0,0 +1,81 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for the identity maps that let every .Bridge over one Bridge hand
+# out the same Light, Group and Sensor objects.
+
+import copy
+import gc
+
+import fixtures
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+from uPHue.sensor import Sensor  # noqa: E402
+
+GROUPS = {'1': {'name': 'Kitchen', 'lights': ['1', '2']}}
+LIGHTS = {'1': {'name': 'Hob'}, '2': {'name': 'Sink'}}
+
+
+class TestIdentity(testtools.TestCase):
+
+    def setUp(self):
+        super(TestIdentity, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.lights = copy.deepcopy(LIGHTS)
+        self.sensors = {'5': {'name': 'Motion', 'state': {}}}
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.get))
+
+    def get(self, mode, address, data=None):
+        parts = address[len(self.bridge.api):].strip('/').split('/')
+        collection = {'lights': self.lights, 'groups': GROUPS, 'sensors': self.sensors}[parts[0]]
+        if mode == 'PUT':
+            collection[parts[1]].update(data)
+            return [{'success': {'/' + '/'.join(parts) + '/' + key: value}} for key, value in data.items()]
+        return collection[parts[1]] if len(parts) > 1 else collection
+
+    def test_same_object_per_id(self):
+        lb = Light.Bridge(self.bridge)
+        self.assertIs(lb.light(1), lb.light('1'))
+        self.assertIsNot(lb.light(1), lb.light(2))
+
+    def test_shared_between_managers(self):
+        lb = Light.Bridge(self.bridge)
+        gb = Group.Bridge(self.bridge)
+        light = lb.light(1)
+        self.assertIs(gb.light(1), light)
+        self.assertIs(gb.group(1).lights[0], light)
+        self.assertIs(Group.Bridge(self.bridge).group(1), gb.group(1))
+        self.assertIs(Sensor.Bridge(self.bridge).sensor(5), Sensor.Bridge(self.bridge).sensor(5))
+
+    def test_not_shared_between_bridges(self):
+        other = Bridge(ip="10.0.0.1", username="username")
+        self.assertIsNot(Light.Bridge(self.bridge).light(1), Light.Bridge(other).light(1))
+
+    def test_unused_objects_dropped(self):
+        lb = Light.Bridge(self.bridge)
+        lb.light(1)
+        gc.collect()
+        self.assertNotIn(1, self.bridge.identities['lights'])
+
+    def test_rename_before_index_built(self):
+        """Objects from [] or light() can be renamed without get_light_objects()."""
+        lb = Light.Bridge(self.bridge)
+        lb[1].name = 'Oven'
+        self.assertEqual(self.lights['1']['name'], 'Oven')
+        self.assertEqual(lb.lights_by_name, {})
+        self.assertIs(lb['Oven'], lb.light(1))
+        sb = Sensor.Bridge(self.bridge)
+        sb.sensor(5).name = 'Presence'
+        self.assertEqual(self.sensors['5']['name'], 'Presence')
+
+    def test_rename_reindexes(self):
+        lb = Light.Bridge(self.bridge)
+        light = lb.get_light_objects('name')['Hob']
+        light.name = 'Oven'
+        self.assertEqual(sorted(lb.lights_by_name), ['Oven', 'Sink'])
+        self.assertIs(lb.lights_by_name['Oven'], light)
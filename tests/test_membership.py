@@ -0,0 +1,79 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for the group membership index kept by Group.Bridge, in both
+# directions (group -> lights and light -> groups).
+
+import copy
+
+import fixtures
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+
+LIGHTS = {'1': {'name': 'Hob'}, '2': {'name': 'Sink'}, '3': {'name': 'Desk'}}
+GROUPS = {'1': {'name': 'Kitchen', 'lights': ['1', '2']}, '2': {'name': 'Study', 'lights': ['3']}}
+
+
+class TestMembership(testtools.TestCase):
+
+    def setUp(self):
+        super(TestMembership, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.groups = copy.deepcopy(GROUPS)
+        self.requests = []
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.request))
+        self.gb = Group.Bridge(self.bridge)
+        self.gb.get_membership()
+        self.requests = []
+
+    def request(self, mode, address, data=None):
+        address = address[len(self.bridge.api):].rstrip('/')
+        self.requests.append((mode, address))
+        parts = address.strip('/').split('/')
+        if mode == 'GET':
+            collection = {'lights': LIGHTS, 'groups': self.groups}[parts[0]]
+            return copy.deepcopy(collection[parts[1]] if len(parts) > 1 else collection)
+        if mode == 'POST':
+            return [{'success': {'id': '3'}}]
+        if mode == 'DELETE':
+            return [{'success': address + ' deleted'}]
+        return [{'success': {address + '/' + key: value}} for key, value in data.items()]
+
+    def test_built_from_one_fetch(self):
+        self.assertEqual(self.gb.get_membership(), {0: [1, 2, 3], 1: [1, 2], 2: [3]})
+        self.assertEqual(self.gb.get_groups_of(1), [0, 1])
+        self.assertEqual(self.gb.get_groups_of(3), [0, 2])
+        self.assertEqual(self.requests, [])
+
+    def test_create_group(self):
+        self.gb.create_group('Evening', [3, 1])
+        self.assertEqual(self.gb.get_membership()[3], [1, 3])
+        self.assertEqual(self.gb.get_groups_of(1), [0, 1, 3])
+        self.assertEqual(self.gb.get_groups_of(3), [0, 2, 3])
+        self.assertEqual(self.requests, [('POST', '/groups')])
+
+    def test_delete_group(self):
+        self.gb.delete_group(1)
+        self.assertNotIn(1, self.gb.get_membership())
+        self.assertEqual(self.gb.get_groups_of(1), [0])
+        self.assertEqual(self.gb.get_groups_of(2), [0])
+        self.assertEqual(self.requests, [('DELETE', '/groups/1')])
+
+    def test_lights_setter(self):
+        self.gb.group(1).lights = ['2', '3']
+        self.assertEqual(self.gb.get_membership()[1], [2, 3])
+        self.assertEqual(self.gb.get_groups_of(1), [0])
+        self.assertEqual(self.gb.get_groups_of(3), [0, 1, 2])
+        self.assertEqual([light.light_id for light in self.gb.group(1).lights], [2, 3])
+        self.assertEqual(self.requests, [('PUT', '/groups/1')])
+
+    def test_failed_change_not_recorded(self):
+        self.bridge.request.side_effect = lambda mode, address, data=None: [
+            {'error': {'type': 7, 'address': '/groups/1/lights', 'description': 'invalid value'}}]
+        self.gb.set_group(1, 'lights', ['3'])
+        self.assertEqual(self.gb.get_membership()[1], [1, 2])
+        self.assertEqual(self.gb.get_groups_of(3), [0, 2])
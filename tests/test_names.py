@@ -0,0 +1,74 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for names.NameIndex, the name -> id lookups of the .Bridges.
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.names import NameIndex  # noqa: E402
+
+LIGHTS = {'1': {'name': 'Kitchen ceiling'}, '2': {'name': 'Kitchen counter'},
+          '3': {'name': 'Hallway'}, '4': {'name': 'hallway'}, '5': {'name': 'Desk'}}
+
+
+class TestNameIndex(testtools.TestCase):
+
+    def setUp(self):
+        super(TestNameIndex, self).setUp()
+        self.lights = dict(LIGHTS)
+        self.fetch = mock.Mock(side_effect=lambda: self.lights)
+
+    def test_exact(self):
+        names = NameIndex(self.fetch)
+        self.assertEqual(names.resolve(['Desk', 'Hallway']), {'Desk': '5', 'Hallway': '3'})
+        self.assertEqual(names.lookup('hallway'), '4')
+        self.assertEqual(names.lookup('desk'), False)
+        self.assertEqual(names.ids(), {'1', '2', '3', '4', '5'})
+
+    def test_ignore_case(self):
+        names = NameIndex(self.fetch, ignore_case=True)
+        self.assertEqual(names.lookup('DESK'), '5')
+        self.assertEqual(names.lookup('Hallway'), '3')  # an exact match wins
+        self.assertEqual(names.lookup('HALLWAY'), False)  # Hallway or hallway?
+
+    def test_prefix(self):
+        names = NameIndex(self.fetch, prefix=True)
+        self.assertEqual(names.lookup('De'), '5')
+        self.assertEqual(names.lookup('Kitchen ce'), '1')
+        self.assertEqual(names.lookup('Kitchen'), False)  # ceiling or counter?
+        self.assertEqual(names.lookup('de'), False)
+
+    def test_prefix_and_ignore_case(self):
+        names = NameIndex(self.fetch, ignore_case=True, prefix=True)
+        self.assertEqual(names.lookup('kitchen co'), '2')
+        self.assertEqual(names.lookup('desk'), '5')
+
+    def test_built_once(self):
+        names = NameIndex(self.fetch)
+        self.assertEqual(names.resolve([]), {})
+        self.assertEqual(self.fetch.call_count, 0)
+        for name in ('Desk', 'Hallway', 'Desk'):
+            names.lookup(name)
+        self.assertEqual(names.builds, 1)
+
+    def test_unknown_rebuilds_once_per_call(self):
+        """Names missing from the index are looked for in one fresh fetch."""
+        names = NameIndex(self.fetch)
+        names.lookup('Desk')
+        self.lights['6'] = {'name': 'Porch'}
+        self.assertEqual(names.resolve(['Porch', 'Shed', 'Desk']), {'Porch': '6', 'Shed': False, 'Desk': '5'})
+        self.assertEqual(names.builds, 2)
+        self.assertEqual(names.lookup('Shed'), False)
+        self.assertEqual(names.builds, 3)
+
+    def test_invalidate(self):
+        names = NameIndex(self.fetch)
+        names.lookup('Desk')
+        self.lights['5'] = {'name': 'Study'}
+        self.assertEqual(names.lookup('Desk'), '5')  # still indexed
+        names.invalidate()
+        self.assertEqual(names.lookup('Desk'), False)
+        self.assertEqual(names.lookup('Study'), '5')
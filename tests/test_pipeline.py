@@ -0,0 +1,145 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for HTTP/1.1 pipelining in pool.Pool and Bridge.request_many().
+
+import http.client as httplib
+import io
+import json
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.pool import Pool  # noqa: E402
+
+
+def response(data, close=False):
+    body = json.dumps(data).encode('utf-8')
+    headers = 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {0}\r\n'.format(len(body))
+    if close:
+        headers += 'Connection: close\r\n'
+    return (headers + '\r\n').encode('ascii') + body
+
+
+class FakeSocket(object):
+
+    def __init__(self, replies):
+        self.sent = []
+        self.replies = replies
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def makefile(self, mode):
+        return io.BytesIO(b''.join(self.replies))
+
+
+class FakeConnection(object):
+
+    """A kept-alive connection: pipelined requests are written to sock,
+    single ones answered with the next of singles"""
+
+    def __init__(self, replies, singles=()):
+        self.sock = FakeSocket(replies)
+        self.singles = list(singles)
+        self.requests = []
+        self.closed = False
+
+    def request(self, mode, address, body=None):
+        self.requests.append((mode, address, body))
+
+    def getresponse(self):
+        reply = mock.Mock(will_close=False)
+        reply.read.return_value = json.dumps(self.singles.pop(0)).encode('utf-8')
+        return reply
+
+    def close(self):
+        self.closed = True
+
+
+class TestPoolPipeline(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPoolPipeline, self).setUp()
+        self.pool = Pool('10.0.0.0')
+
+    def test_one_write_in_order(self):
+        """All requests go out in one write, responses come back in order."""
+        connection = FakeConnection([response([{'success': n}]) for n in range(3)])
+        self.pool.connect = lambda: connection
+        requests = [('PUT', '/api/u/lights/{0}/state'.format(n), b'{"on": true}') for n in range(3)]
+        responses = self.pool.pipeline(requests)
+        self.assertEqual([json.loads(r.decode('utf-8')) for r in responses],
+                         [[{'success': n}] for n in range(3)])
+        self.assertEqual(len(connection.sock.sent), 1)
+        sent = connection.sock.sent[0].decode('ascii')
+        self.assertEqual(sent.count('PUT /api/u/lights/'), 3)
+        self.assertLess(sent.index('lights/0/'), sent.index('lights/1/'))
+        self.assertEqual(self.pool._idle, [connection])
+
+    def test_depth(self):
+        """No more than depth requests are written before reading."""
+        connections = [FakeConnection([response([]), response([])]),
+                       FakeConnection([response([])])]
+        self.pool.size = 0
+        self.pool.connect = lambda: connections.pop(0)
+        requests = [('GET', '/api/u/lights/{0}'.format(n), None) for n in range(3)]
+        self.assertEqual(len(self.pool.pipeline(requests, depth=2)), 3)
+        self.assertEqual(connections, [])
+
+    def test_closed_early_resends_rest(self):
+        """What the bridge doesn't answer before closing is sent again."""
+        first = FakeConnection([response([{'success': 0}], close=True)])
+        second = FakeConnection([response([{'success': 2}])], singles=[[{'success': 1}]])
+        connections = [first, second]
+        self.pool.connect = lambda: connections.pop(0)
+        requests = [('PUT', '/api/u/lights/{0}/state'.format(n), b'{}') for n in range(3)]
+        responses = self.pool.pipeline(requests)
+        self.assertEqual([json.loads(r.decode('utf-8')) for r in responses],
+                         [[{'success': n}] for n in range(3)])
+        self.assertTrue(first.closed)
+        self.assertEqual(second.requests, [requests[1]])
+
+    def test_unanswered_post_not_resent(self):
+        """A POST may have been acted on, so it isn't sent twice."""
+        first = FakeConnection([response([{'success': 0}], close=True)])
+        self.pool.connect = lambda: first
+        requests = [('GET', '/api/u/lights', None), ('POST', '/api/u/groups', b'{}')]
+        self.assertRaises(httplib.HTTPException, self.pool.pipeline, requests)
+
+    def test_unanswered_increment_not_resent(self):
+        """Every unanswered request of the window may have been acted on,
+        not just the first, so a bri_inc behind a plain PUT isn't resent."""
+        first = FakeConnection([response([{'success': 0}], close=True)])
+        connections = [first]
+        self.pool.connect = lambda: connections.pop(0)
+        requests = [('PUT', '/api/u/lights/1/state', b'{"on": true}'),
+                    ('PUT', '/api/u/lights/2/state', b'{"bri": 10}'),
+                    ('PUT', '/api/u/lights/3/state', b'{"bri_inc": 20}')]
+        self.assertRaises(httplib.HTTPException, self.pool.pipeline, requests)
+        self.assertEqual(connections, [])
+        self.assertEqual(first.sock.sent[0].count(b'bri_inc'), 1)
+
+
+class TestRequestMany(testtools.TestCase):
+
+    def test_pipelined_when_enabled(self):
+        bridge = Bridge(ip="10.0.0.0", username="username", pipelining=True)
+        replies = [b'[{"success": 1}]', b'[{"success": 2}]']
+        with mock.patch.object(Pool, 'pipeline', return_value=replies) as pipeline:
+            with mock.patch.object(Bridge, 'request') as request:
+                responses = bridge.request_many([('GET', '/a', None), ('PUT', '/b', {'on': True})])
+        self.assertEqual(responses, [[{'success': 1}], [{'success': 2}]])
+        self.assertEqual(pipeline.call_args[0][0], [('GET', '/a', None), ('PUT', '/b', b'{"on": true}')])
+        self.assertFalse(request.called)
+
+    def test_sequential_without_pipelining(self):
+        bridge = Bridge(ip="10.0.0.0", username="username")
+        with mock.patch.object(Pool, 'pipeline') as pipeline:
+            with mock.patch.object(Bridge, 'request', return_value=[]) as request:
+                bridge.request_many([('GET', '/a', None), ('GET', '/b', None)])
+        self.assertFalse(pipeline.called)
+        self.assertEqual(request.call_count, 2)
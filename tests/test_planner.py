@@ -0,0 +1,112 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for Group.Bridge.plan(), which turns per-light states into group
+# commands plus per-light fix-ups.
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+
+MEMBERSHIP = {
+    0: [1, 2, 3, 4, 5],
+    1: [1, 2, 3],
+    2: [4, 5],
+    3: [3, 4],
+}
+
+ON = {'on': True}
+OFF = {'on': False}
+DIM = {'on': True, 'bri': 10}
+
+
+class TestPlan(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.gb = Group.Bridge(self.bridge)
+
+    def plan(self, states, group_cost=0.1, light_cost=0.1):
+        return self.gb.plan(states, MEMBERSHIP, light_cost=light_cost, group_cost=group_cost)
+
+    def test_whole_group_same_state(self):
+        """A group all of whose lights want the same state is one command."""
+        self.assertEqual(self.plan({1: ON, 2: ON, 3: ON}),
+                         [('groups', 1, ON)])
+
+    def test_group_zero_for_every_light(self):
+        states = dict((light, OFF) for light in MEMBERSHIP[0])
+        self.assertEqual(self.plan(states), [('groups', 0, OFF)])
+
+    def test_partial_group_not_used(self):
+        """A group is never used unless all its lights are in states, as
+        that would change a light nobody asked to."""
+        self.assertEqual(self.plan({1: ON, 2: ON}),
+                         [('lights', 1, ON), ('lights', 2, ON)])
+
+    def test_fixups_after_group(self):
+        """The odd one out gets its own command, after the group's."""
+        self.assertEqual(self.plan({1: ON, 2: ON, 3: OFF}, group_cost=0.05),
+                         [('groups', 1, ON), ('lights', 3, OFF)])
+
+    def test_candidate_must_be_overwritten(self):
+        """A group state is only a candidate if every other light's state
+        overwrites all it sets: DIM sets bri, which ON would leave behind."""
+        plan = self.plan({1: DIM, 2: ON, 3: ON}, group_cost=0.05)
+        self.assertEqual(plan, [('groups', 1, ON), ('lights', 1, DIM)])
+        self.assertNotIn(('groups', 1, DIM), plan)
+
+    def test_group_dearer_than_lights(self):
+        """Without a throttle a group command costs 1s against 0.1s a light,
+        so a three light group isn't worth it."""
+        self.bridge.throttle = None
+        self.assertEqual(self.gb.plan({1: ON, 2: ON, 3: ON}, MEMBERSHIP),
+                         [('lights', 1, ON), ('lights', 2, ON), ('lights', 3, ON)])
+
+    def test_later_group_overrides_earlier(self):
+        """Group commands go out in order, so a later one can correct
+        part of an earlier, larger one."""
+        states = {1: ON, 2: ON, 3: ON, 4: OFF, 5: OFF}
+        self.assertEqual(self.plan(states, group_cost=0.01),
+                         [('groups', 0, ON), ('groups', 2, OFF)])
+
+    def test_every_light_reaches_its_state(self):
+        states = {1: ON, 2: OFF, 3: DIM, 4: DIM, 5: ON}
+        final = {}
+        for kind, target, state in self.plan(states, group_cost=0.01):
+            for light in (MEMBERSHIP[target] if kind == 'groups' else [target]):
+                final[light] = state
+        self.assertEqual(final, states)
+
+
+class TestSetLightsPlanned(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSetLightsPlanned, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.gb = Group.Bridge(self.bridge)
+        self.gb.get_light_ids = lambda states: dict((light, light) for light in states)
+        self.gb.plan = lambda states, membership: Group.Bridge.plan(
+            self.gb, states, membership, light_cost=0.1, group_cost=0.05)
+
+    def test_group_error_falls_back_to_lights(self):
+        """Lights whose group command fails are sent their own command."""
+        def request(mode, address, data=None):
+            if '/groups/' in address:
+                return [{'error': {'type': 901, 'address': '/groups/1/action',
+                                   'description': 'internal error'}}]
+            return [{'success': {address[len('/api/username'):] + '/on': True}}]
+
+        with mock.patch.object(self.bridge, 'request', side_effect=request) as req:
+            result = self.gb.set_lights_planned({1: ON, 2: ON, 3: ON}, membership=MEMBERSHIP)
+        addresses = [call[0][1] for call in req.call_args_list]
+        self.assertEqual(addresses, ['/api/username/groups/1/action',
+                                     '/api/username/lights/1/state',
+                                     '/api/username/lights/2/state',
+                                     '/api/username/lights/3/state'])
+        self.assertEqual(sorted(result.succeeded), [1, 2, 3])
@@ -0,0 +1,165 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for the keep-alive connections kept by pool.Pool.
+
+import http.client as httplib
+import socket
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+from uPHue.pool import Pool  # noqa: E402
+
+
+class FakeConnection(object):
+
+    """An HTTPConnection whose request() or getresponse() can be made to
+    fail, as they do on a connection the bridge has dropped"""
+
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.sock = mock.Mock()
+        self.requests = []
+        self.closed = False
+        self.fail = None  # 'request' or 'response'
+        self.will_close = False
+
+    def connect(self):
+        pass
+
+    def request(self, mode, address, body=None):
+        if self.fail == 'request':
+            raise BrokenPipeError()
+        self.requests.append((mode, address, body))
+
+    def getresponse(self):
+        if self.fail == 'response':
+            raise httplib.RemoteDisconnected('Remote end closed connection without response')
+        reply = mock.Mock(will_close=self.will_close)
+        reply.read.return_value = b'[]'
+        return reply
+
+    def close(self):
+        self.closed = True
+
+
+class TestPool(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPool, self).setUp()
+        self.connections = []
+        self.useFixture(fixtures.MonkeyPatch('http.client.HTTPConnection', self.connection))
+        self.pool = Pool('10.0.0.0')
+
+    def connection(self, host, timeout=None):
+        connection = FakeConnection(host, timeout)
+        self.connections.append(connection)
+        return connection
+
+    def dropped(self, fail='response'):
+        """Make a first request, then have the bridge drop the idle connection"""
+        self.pool.request('GET', '/api/u/lights')
+        self.connections[0].fail = fail
+
+    def test_keep_alive_reused(self):
+        for n in range(3):
+            self.assertEqual(self.pool.request('GET', '/api/u/lights'), b'[]')
+        self.assertEqual(self.pool.connects, 1)
+        self.assertEqual(len(self.connections[0].requests), 3)
+
+    def test_nodelay(self):
+        self.pool.request('GET', '/api/u/lights')
+        self.connections[0].sock.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def test_size_zero_closes(self):
+        self.pool.size = 0
+        self.pool.request('GET', '/api/u/lights')
+        self.pool.request('GET', '/api/u/lights')
+        self.assertEqual(self.pool.connects, 2)
+        self.assertTrue(all(connection.closed for connection in self.connections))
+
+    def test_will_close_not_kept(self):
+        self.pool.request('GET', '/api/u/lights')
+        self.connections[0].will_close = True
+        self.pool.request('GET', '/api/u/lights')
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(self.pool._idle, [])
+
+    def test_dropped_connection_reconnects(self):
+        self.dropped()
+        self.pool.request('PUT', '/api/u/lights/1/state', b'{"bri": 10}')
+        self.assertEqual(self.pool.connects, 2)
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(self.connections[1].requests, [('PUT', '/api/u/lights/1/state', b'{"bri": 10}')])
+
+    def test_post_not_resent(self):
+        self.dropped()
+        self.assertRaises(httplib.RemoteDisconnected, self.pool.request,
+                          'POST', '/api/u/groups', b'{}')
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_post_resent_if_never_sent(self):
+        self.dropped('request')
+        self.pool.request('POST', '/api/u/groups', b'{}')
+        self.assertEqual(self.connections[1].requests, [('POST', '/api/u/groups', b'{}')])
+
+    def test_increment_not_resent(self):
+        """bri_inc would be applied twice."""
+        self.dropped()
+        self.assertRaises(httplib.RemoteDisconnected, self.pool.request,
+                          'PUT', '/api/u/lights/1/state', b'{"bri_inc": 10}')
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_fresh_connection_failure_raised(self):
+        self.connection = mock.Mock(side_effect=OSError('unreachable'))
+        self.useFixture(fixtures.MonkeyPatch('http.client.HTTPConnection', self.connection))
+        self.assertRaises(OSError, self.pool.request, 'GET', '/api/u/lights')
+
+    def test_idempotent(self):
+        self.assertTrue(Pool.idempotent('GET'))
+        self.assertTrue(Pool.idempotent('DELETE'))
+        self.assertTrue(Pool.idempotent('PUT', b'{"bri": 10, "transitiontime": 4}'))
+        self.assertFalse(Pool.idempotent('POST', b'{}'))
+        for key in ('bri_inc', 'hue_inc', 'sat_inc', 'ct_inc', 'xy_inc'):
+            self.assertFalse(Pool.idempotent('PUT', ('{"on": true, "%s": 1}' % key).encode('utf-8')))
+
+    def test_pipeline_increment_not_resent(self):
+        requests = [('GET', '/api/u/lights', None),
+                    ('PUT', '/api/u/lights/1/state', b'{"bri_inc": 10}')]
+        with mock.patch.object(self.pool, '_pipeline', return_value=[b'{}']):
+            self.assertRaises(httplib.HTTPException, self.pool.pipeline, requests)
+
+
+class TestThreads(testtools.TestCase):
+
+    def setUp(self):
+        super(TestThreads, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username", pool_size=1, threads=2)
+        self.addCleanup(self.bridge.close)
+
+    def test_pool_size_raised(self):
+        """Each thread gets a connection of its own."""
+        self.assertEqual(self.bridge.pool_size, 2)
+        self.assertEqual(Bridge(ip="10.0.0.0", username="username", pool_size=4, threads=2).pool_size, 4)
+
+    def test_set_light_fan_out(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[{'success': {}}]) as request:
+            Light.Bridge(self.bridge).set_light([1, 2, 3, 4, 5], 'on', True)
+        self.assertEqual(sorted(call[0][1] for call in request.call_args_list),
+                         ['/api/username/lights/{0}/state'.format(n) for n in range(1, 6)])
+        self.assertEqual(self.bridge.executor._max_workers, 2)
+
+    def test_close_shuts_down_threads(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[{'success': {}}]):
+            Light.Bridge(self.bridge).set_light([1, 2], 'on', True)
+        executor = self.bridge.executor
+        self.bridge.close()
+        self.assertIsNone(self.bridge.executor)
+        self.assertRaises(RuntimeError, executor.submit, len, [])
@@ -0,0 +1,94 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for query.Selection, what where() returns on the .Bridges.
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+from uPHue.query import Index, field  # noqa: E402
+
+LIGHTS = {
+    '1': {'name': 'Hob', 'type': 'Extended color light',
+          'state': {'on': True, 'bri': 200, 'xy': [0.3, 0.3]}},
+    '2': {'name': 'Sink', 'type': 'Dimmable light', 'state': {'on': True, 'bri': 50}},
+    '3': {'name': 'Desk', 'type': 'Dimmable light', 'state': {'on': True, 'bri': 254}},
+    '4': {'name': 'Porch', 'type': 'Dimmable light', 'state': {'on': False, 'bri': 1}},
+}
+
+GROUPS = {'1': {'name': 'Kitchen', 'type': 'Room', 'lights': ['1', '2', '4'], 'action': {'on': True}},
+          '2': {'name': 'Study', 'type': 'Room', 'lights': ['3'], 'action': {'on': True}},
+          '3': {'name': 'Evening', 'type': 'LightGroup', 'lights': ['3', '4'], 'action': {'on': False}}}
+
+
+class TestQuery(testtools.TestCase):
+
+    def setUp(self):
+        super(TestQuery, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.get))
+        self.gb = Group.Bridge(self.bridge)
+
+    def get(self, mode, address, data=None):
+        parts = address[len(self.bridge.api):].strip('/').split('/')
+        collection = {'lights': LIGHTS, 'groups': GROUPS}[parts[0]]
+        return collection[parts[1]] if len(parts) > 1 else collection
+
+    def test_field(self):
+        self.assertEqual(field(LIGHTS['1'], 'type'), 'Extended color light')
+        self.assertEqual(field(LIGHTS['1'], 'bri'), 200)
+        self.assertIsNone(field(LIGHTS['1'], 'ct'))
+
+    def test_index_equal(self):
+        index = Index(LIGHTS)
+        self.assertEqual(index.equal('type', 'Dimmable light'), {2, 3, 4})
+        self.assertEqual(index.equal('xy', [0.3, 0.3]), {1})
+        self.assertEqual(index.equal('on', [True]), set())
+
+    def test_where(self):
+        self.assertEqual(self.gb.where(on=True, type='Dimmable light').ids, [2, 3])
+        self.assertEqual(self.gb.where(name=('Hob', 'Porch')).ids, [1, 4])
+        self.assertEqual(self.gb.where(bri=lambda bri: bri > 100).ids, [1, 3])
+        self.assertEqual(self.gb.where(on=True).where(bri=50).ids, [2])
+
+    def test_where_group(self):
+        """The example in the README."""
+        selection = self.gb.where(on=True, type='Dimmable light', group='Kitchen')
+        self.assertEqual(selection.ids, [2])
+        self.assertEqual(self.gb.where(group=['Study', 3]).ids, [3, 4])
+        self.assertEqual([light.name for light in selection], ['Sink'])
+
+    def test_light_bridge_needs_group_bridge(self):
+        lb = Light.Bridge(self.bridge)
+        self.assertEqual(lb.where(on=False).ids, [4])
+        self.assertRaises(ValueError, lb.where, group='Kitchen')
+
+    def test_where_groups(self):
+        self.assertEqual(self.gb.where_groups(type='Room').ids, [1, 2])
+        self.assertEqual(self.gb.where_groups(on=False).ids, [3])
+
+    def test_index_reused_for_same_snapshot(self):
+        first = self.gb.where(on=True)
+        second = self.gb.where_groups(type='Room')
+        self.assertIs(first._index, self.gb.where(bri=1)._index)
+        self.assertIsNot(first._index, second._index)
+
+    def test_set_lights(self):
+        with mock.patch.object(self.gb, 'set_lights') as set_lights:
+            self.gb.where(type='Dimmable light').set('on', False, transitiontime=4)
+        set_lights.assert_called_once_with({2: {'on': False}, 3: {'on': False}, 4: {'on': False}}, 4)
+
+    def test_set_groups(self):
+        with mock.patch.object(self.gb, 'set_group') as set_group:
+            self.gb.where_groups(type='Room').set({'bri': 127})
+        set_group.assert_called_once_with([1, 2], {'bri': 127}, transitiontime=None)
+
+    def test_set_nothing(self):
+        self.assertIsNone(self.gb.where(name='Shed').set('on', True))
+
@@ -0,0 +1,142 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for refresher.Refresher, which keeps a snapshot of the lights,
+# groups and sensors up to date from a background thread.
+
+import copy
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.cache import Cache  # noqa: E402
+from uPHue.pool import NullLock  # noqa: E402
+from uPHue.refresher import Refresher  # noqa: E402
+
+LIGHTS = {'1': {'name': 'Hall', 'state': {'on': True, 'bri': 100}},
+          '2': {'name': 'Porch', 'state': {'on': False, 'bri': 10}}}
+GROUPS = {'1': {'name': 'Kitchen', 'lights': ['1', '2'], 'action': {'on': True}}}
+SENSORS = {'1': {'name': 'Hall motion', 'state': {'presence': False}}}
+
+
+class TestRefresher(testtools.TestCase):
+
+    def setUp(self):
+        super(TestRefresher, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.refresher = Refresher(self.bridge)
+        self.collections = [copy.deepcopy(LIGHTS), copy.deepcopy(GROUPS), copy.deepcopy(SENSORS)]
+
+    def poll(self, during=None):
+        """Poll, making the writes in during() after the bridge was asked"""
+        def get_many(requests):
+            responses = copy.deepcopy(self.collections)
+            if during is not None:
+                during()
+            return responses
+        with mock.patch.object(self.bridge, 'get_many', side_effect=get_many):
+            self.refresher.poll()
+
+    def test_poll_publishes(self):
+        self.poll()
+        self.assertEqual(self.refresher.polls, 1)
+        self.assertEqual(self.refresher.get('/lights/1/state'), LIGHTS['1'])
+        self.assertEqual(self.refresher.get('/sensors')['1'], SENSORS['1'])
+        self.assertIsNone(self.refresher.get('/scenes/abc'))
+
+    def test_update(self):
+        self.poll()
+        undo = self.refresher.update('/lights/1', [(('state', 'bri'), 50)])
+        self.assertEqual(undo, [(('state', 'bri'), 100)])
+        self.assertEqual(self.refresher.get('/lights/1')['state']['bri'], 50)
+        self.assertEqual(self.refresher.get('/lights')['1']['state']['bri'], 50)
+        self.assertIsNone(self.refresher.update('/lights/9', [(('state', 'bri'), 50)]))
+
+    def test_update_leaves_published_snapshot_alone(self):
+        self.poll()
+        before = self.refresher.snapshot
+        self.refresher.update('/lights/1', [(('state', 'bri'), 50)])
+        self.assertEqual(before['/lights/1']['state']['bri'], 100)
+        self.assertIsNot(self.refresher.snapshot, before)
+
+    def test_expire(self):
+        self.poll()
+        self.refresher.expire('/lights/1/state')
+        self.assertIsNone(self.refresher.get('/lights/1'))
+        self.assertIsNone(self.refresher.get('/lights'))
+        self.assertIsNotNone(self.refresher.get('/lights/2'))
+
+    def test_expire_group_drops_lights(self):
+        self.poll()
+        self.refresher.expire('/groups/1/action')
+        self.assertIsNone(self.refresher.get('/groups/1'))
+        self.assertIsNone(self.refresher.get('/lights/2'))
+        self.assertIsNotNone(self.refresher.get('/sensors/1'))
+
+    def test_write_during_poll_made_again(self):
+        """A poll overtaken by a write is published, with the write on top."""
+        self.poll()
+        self.collections[2]['1']['state']['presence'] = True
+        self.poll(lambda: self.refresher.update('/lights/1', [(('state', 'bri'), 50)]))
+        self.assertEqual(self.refresher.polls, 2)
+        self.assertEqual(self.refresher.get('/lights/1')['state']['bri'], 50)
+        self.assertEqual(self.refresher.get('/lights')['1']['state']['bri'], 50)
+        self.assertTrue(self.refresher.get('/sensors/1')['state']['presence'])
+
+    def test_expire_during_poll_made_again(self):
+        self.poll()
+        self.poll(lambda: self.refresher.expire('/groups/1/action'))
+        self.assertIsNone(self.refresher.get('/lights/1'))
+        self.assertIsNotNone(self.refresher.get('/sensors/1'))
+
+    def test_steady_writes_dont_hold_polls_back(self):
+        self.poll()
+        for bri in range(5):
+            self.collections[2]['1']['state']['presence'] = bool(bri % 2)
+            self.poll(lambda: self.refresher.update('/lights/2', [(('state', 'bri'), bri)]))
+            self.assertEqual(self.refresher.get('/sensors/1')['state']['presence'], bool(bri % 2))
+        self.assertEqual(self.refresher.polls, 6)
+
+    def test_writes_before_poll_not_made_again(self):
+        """The bridge had them by the time it was asked."""
+        self.poll()
+        self.refresher.update('/lights/1', [(('state', 'bri'), 50)])
+        self.collections[0]['1']['state']['bri'] = 60
+        self.poll()
+        self.assertEqual(self.refresher.get('/lights/1')['state']['bri'], 60)
+
+    def test_error_response_skipped(self):
+        self.collections[1] = [{'error': {'type': 1, 'description': 'unauthorized user'}}]
+        self.poll()
+        self.assertIsNone(self.refresher.get('/groups/1'))
+        self.assertIsNotNone(self.refresher.get('/lights/1'))
+
+
+class TestSharedPool(testtools.TestCase):
+
+    def test_unshared_by_default(self):
+        bridge = Bridge(ip="10.0.0.0", username="username")
+        self.assertIsInstance(bridge.pool_lock, NullLock)
+
+    def test_refresh_shares_pool(self):
+        with mock.patch.object(Refresher, 'start'):
+            bridge = Bridge(ip="10.0.0.0", username="username", refresh=1.0)
+        self.assertNotIsInstance(bridge.pool_lock, NullLock)
+        self.assertIs(bridge.latency.lock, bridge.pool_lock)
+        self.assertIs(bridge._pool().lock, bridge.pool_lock)
+        self.assertIsInstance(bridge.lock, NullLock)
+
+    def test_stale_cache_shares_pool(self):
+        bridge = Bridge(ip="10.0.0.0", username="username", cache=Cache(stale=5))
+        self.assertNotIsInstance(bridge.pool_lock, NullLock)
+
+    def test_revalidation_shares_existing_pool(self):
+        bridge = Bridge(ip="10.0.0.0", username="username")
+        pool = bridge._pool()
+        with mock.patch('uPHue.bridge.threading.Thread'):
+            bridge._revalidate([], {})
+        self.assertIs(pool.lock, bridge.pool_lock)
+        self.assertNotIsInstance(pool.lock, NullLock)
@@ -0,0 +1,188 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for the scene index kept by Scene.Bridge, and the light states it
+# loads on first use.
+
+import copy
+
+import fixtures
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.scene import Scene  # noqa: E402
+
+SCENES = {
+    'abc': {'name': 'Relax', 'type': 'GroupScene', 'group': '1', 'lights': ['1', '2'],
+            'version': 2, 'lastupdated': '2020-01-01T00:00:00'},
+    'def': {'name': 'Relax', 'type': 'LightScene', 'lights': ['3'],
+            'version': 2, 'lastupdated': '2020-01-01T00:00:00'},
+    'ghi': {'name': 'Bright', 'type': 'GroupScene', 'group': '2', 'lights': ['3'],
+            'version': 2, 'lastupdated': '2020-01-01T00:00:00'},
+}
+
+GROUPS = {'1': {'name': 'Kitchen', 'lights': ['1', '2']},
+          '2': {'name': 'Study', 'lights': ['3']}}
+
+LIGHTS = {'1': {'name': 'Hob'}, '2': {'name': 'Sink'}, '3': {'name': 'Desk'}}
+
+LIGHTSTATES = {'1': {'on': True, 'bri': 100}, '2': {'on': False}}
+
+
+class TestSceneIndex(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSceneIndex, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.scenes = copy.deepcopy(SCENES)
+        self.requests = []
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.request))
+        self.sb = Scene.Bridge(Group.Bridge(self.bridge))
+
+    def request(self, mode, address, data=None):
+        address = address[len(self.bridge.api):]
+        self.requests.append((mode, address))
+        if mode == 'PUT':
+            return [{'success': {address + '/' + key: value}} for key, value in data.items()]
+        if address == '/scenes':
+            return copy.deepcopy(self.scenes)
+        if address.startswith('/scenes/'):
+            scene = dict(self.scenes[address[len('/scenes/'):]])
+            scene['lightstates'] = LIGHTSTATES
+            return scene
+        if address.rstrip('/') == '/groups':
+            return GROUPS
+        if address.rstrip('/') == '/lights':
+            return LIGHTS
+        raise AssertionError('Unexpected request: {0} {1}'.format(mode, address))
+
+    def test_find_scenes(self):
+        self.assertEqual(sorted(s.scene_id for s in self.sb.find_scenes(name='Relax')), ['abc', 'def'])
+        self.assertEqual([s.scene_id for s in self.sb.find_scenes(group=2)], ['ghi'])
+        self.assertEqual([s.scene_id for s in self.sb.find_scenes(name='Relax', group='Kitchen')], ['abc'])
+        self.assertEqual(self.sb.find_scenes(name='Party'), [])
+        self.assertEqual(self.requests.count(('GET', '/scenes')), 1)
+
+    def test_lightstates_fetched_once(self):
+        for i in range(3):
+            self.assertEqual(self.sb.get_lightstates('abc'), LIGHTSTATES)
+        self.assertEqual(self.requests, [('GET', '/scenes'), ('GET', '/scenes/abc')])
+
+    def test_refresh_picks_up_new_version(self):
+        self.sb.get_lightstates('abc')
+        kept = self.sb.find_scenes(name='Bright')[0]
+        self.scenes['abc']['version'] = 3
+        self.scenes['abc']['name'] = 'Unwind'
+        self.sb.refresh_scenes()
+        self.assertEqual(self.sb.find_scenes(name='Relax')[0].scene_id, 'def')
+        self.assertEqual(self.sb.find_scenes(name='Unwind')[0].scene_id, 'abc')
+        self.assertIs(self.sb.find_scenes(name='Bright')[0], kept)
+        del self.requests[:]
+        self.sb.get_lightstates('abc')
+        self.assertEqual(self.requests, [('GET', '/scenes/abc')])
+
+    def test_ttl(self):
+        self.sb.ttl = 10
+        self.sb.find_scenes(name='Relax')
+        self.now += 5
+        self.sb.find_scenes(name='Relax')
+        self.assertEqual(self.requests.count(('GET', '/scenes')), 1)
+        self.now += 10
+        self.sb.find_scenes(name='Relax')
+        self.assertEqual(self.requests.count(('GET', '/scenes')), 2)
+
+    def test_write_reconciles(self):
+        self.sb.find_scenes()
+        self.sb.modify_scene('abc', {'name': 'Unwind'})
+        self.scenes['abc']['name'] = 'Unwind'
+        self.scenes['abc']['version'] = 3
+        self.assertEqual(self.sb.find_scenes(name='Unwind')[0].scene_id, 'abc')
+        self.assertEqual(self.requests.count(('GET', '/scenes')), 2)
+
+    def test_run_scene_from_index(self):
+        self.assertTrue(self.sb.run_scene('Kitchen', 'Relax'))
+        self.assertTrue(self.sb.run_scene('Kitchen', 'Relax'))
+        self.assertEqual(self.requests.count(('GET', '/scenes')), 1)
+        self.assertEqual(self.requests.count(('PUT', '/groups/1/action')), 2)
+        self.assertFalse(self.sb.run_scene('Kitchen', 'Bright'))
+
+    def test_populate(self):
+        self.sb.populate({'scenes': copy.deepcopy(SCENES)})
+        self.assertEqual([s.scene_id for s in self.sb.find_scenes(name='Bright')], ['ghi'])
+        self.assertEqual(self.requests, [])
+
+
+class TestCompiledScenes(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCompiledScenes, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.scenes = {}
+        self.posts = 0
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.request))
+        self.sb = Scene.Bridge(Group.Bridge(self.bridge))
+
+    def request(self, mode, address, data=None):
+        address = address[len(self.bridge.api):]
+        if mode == 'GET' and address == '/scenes':
+            return copy.deepcopy(self.scenes)
+        if mode == 'GET' and address.rstrip('/') == '/lights':
+            return LIGHTS
+        if mode == 'POST' and address == '/scenes':
+            self.posts += 1
+            scene_id = 'compiled{0}'.format(self.posts)
+            self.scenes[scene_id] = dict(data)
+            return [{'success': {'id': scene_id}}]
+        if mode == 'PUT' and address == '/groups/0/action':
+            if data['scene'] not in self.scenes:
+                return [{'error': {'type': 7, 'address': '/groups/0/action/scene',
+                                   'description': 'invalid value, ' + data['scene'] + ', for parameter, scene'}}]
+            return [{'success': {'/groups/0/action/scene': data['scene']}}]
+        raise AssertionError('Unexpected request: {0} {1}'.format(mode, address))
+
+    def test_content_hash(self):
+        states = {1: {'on': True}, '2': {'bri': 10, 'on': True}}
+        same = {'2': {'on': True, 'bri': 10}, '1': {'on': True}}
+        self.assertEqual(Scene.Bridge.content_hash(states), Scene.Bridge.content_hash(same))
+        self.assertNotEqual(Scene.Bridge.content_hash(states), Scene.Bridge.content_hash({1: {'on': False}}))
+
+    def test_compiled_once(self):
+        scene_id = self.sb.compile_scene({1: {'on': True}, 'Sink': {'bri': 10}})
+        self.assertEqual(self.sb.compile_scene({'Hob': {'on': True}, 2: {'bri': 10}}), scene_id)
+        self.assertEqual(self.posts, 1)
+        self.assertEqual(self.scenes[scene_id]['lights'], ['1', '2'])
+        self.assertTrue(self.scenes[scene_id]['name'].startswith(Scene.Bridge.COMPILED_PREFIX))
+
+    def test_reused_from_an_earlier_run(self):
+        """A scene compiled before is found by its name, not compiled again."""
+        scene_id = self.sb.compile_scene({1: {'on': True}})
+        later = Scene.Bridge(Group.Bridge(self.bridge))
+        self.assertEqual(later.compile_scene({1: {'on': True}}), scene_id)
+        self.assertEqual(self.posts, 1)
+
+    def test_apply_states_savings(self):
+        states = {1: {'on': True}, 2: {'on': True}, 3: {'on': False}}
+        self.sb.apply_states(states)
+        self.assertEqual(self.sb.savings, {'compiled': 1, 'recalls': 1, 'commands_saved': 1})
+        self.sb.apply_states(states)
+        self.assertEqual(self.sb.savings, {'compiled': 1, 'recalls': 2, 'commands_saved': 3})
+
+    def test_recycled_scene_recompiled(self):
+        states = {1: {'on': True}, 2: {'on': False}}
+        self.sb.apply_states(states)
+        self.scenes.clear()  # recycled by the bridge
+        response = self.sb.apply_states(states)
+        self.assertEqual(response, [{'success': {'/groups/0/action/scene': 'compiled2'}}])
+        self.assertEqual(self.posts, 2)
+        self.assertEqual(self.sb.savings, {'compiled': 2, 'recalls': 2, 'commands_saved': 0})
+
+    def test_forget(self):
+        scene_id = self.sb.compile_scene({1: {'on': True}})
+        self.sb._forget(scene_id)
+        self.assertNotIn(scene_id, self.sb._compiled.values())
+        self.assertTrue(self.sb._stale)
@@ -0,0 +1,84 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for Light.Bridge.set_lights() and the Light.Result it returns.
+
+import fixtures
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+
+LIGHTS = {'1': {'name': 'Hob'}, '2': {'name': 'Sink'}, '3': {'name': 'Desk'}}
+
+
+class TestSetLights(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSetLights, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.puts = []
+        self.errors = {}  # address -> error type, for attributes to reject
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.request))
+        self.lb = Light.Bridge(self.bridge)
+
+    def request(self, mode, address, data=None):
+        address = address[len(self.bridge.api):]
+        if mode == 'GET':
+            return LIGHTS
+        self.puts.append((address, data))
+        response = []
+        for key, value in data.items():
+            if address + '/' + key in self.errors:
+                response.append({'error': {'type': self.errors[address + '/' + key],
+                                           'address': address + '/' + key,
+                                           'description': 'parameter, ' + key + ', is not available'}})
+            elif key != 'transitiontime':
+                response.append({'success': {address + '/' + key: value}})
+        return response
+
+    def test_all_succeed(self):
+        result = self.lb.set_lights({1: {'on': True}, 'Sink': {'bri': 10}}, transitiontime=4)
+        self.assertTrue(result)
+        self.assertEqual(sorted(result.succeeded, key=str), [1, 'Sink'])
+        self.assertEqual(sorted(self.puts), [('/lights/1/state', {'on': True, 'transitiontime': 4}),
+                                             ('/lights/2/state', {'bri': 10, 'transitiontime': 4})])
+
+    def test_own_transitiontime_kept(self):
+        self.lb.set_lights({1: {'on': True, 'transitiontime': 0}}, transitiontime=4)
+        self.assertEqual(self.puts, [('/lights/1/state', {'on': True, 'transitiontime': 0})])
+
+    def test_attribute_error_retried_alone(self):
+        """Only the attribute the bridge rejected is resent, with the transitiontime."""
+        self.errors['/lights/2/state/hue'] = 6
+        result = self.lb.set_lights({1: {'on': True, 'hue': 100},
+                                     2: {'on': True, 'hue': 100, 'bri': 50}}, transitiontime=10)
+        self.assertFalse(result)
+        self.assertEqual(result.succeeded, [1])
+        self.assertEqual(result.failed, {2: {'hue': 100, 'transitiontime': 10}})
+        self.assertEqual(result.errors[2][0]['type'], 6)
+
+        del self.errors['/lights/2/state/hue']
+        self.puts = []
+        retried = result.retry()
+        self.assertTrue(retried)
+        self.assertEqual(self.puts, [('/lights/2/state', {'hue': 100, 'transitiontime': 10})])
+
+    def test_resource_error_retries_everything(self):
+        self.bridge.request.side_effect = lambda mode, address, data=None: (
+            LIGHTS if mode == 'GET' else
+            [{'error': {'type': 201, 'address': '/lights/2/state', 'description': 'device is off'}}]
+            if address.endswith('/2/state') else [{'success': {}}])
+        result = self.lb.set_lights({1: {'on': True}, 2: {'bri': 50}})
+        self.assertEqual(result.failed, {2: {'bri': 50}})
+
+    def test_unknown_name(self):
+        """A name with no light gets the type 3 error the bridge gives for an unknown id."""
+        result = self.lb.set_lights({'Oven': {'on': True}, 3: {'on': True}})
+        self.assertEqual(result.succeeded, [3])
+        self.assertEqual(result.errors, {'Oven': [{
+            'type': 3, 'address': '/lights/Oven', 'description': 'light, Oven, not available'}]})
+        self.assertEqual(result.failed, {'Oven': {'on': True}})
+        self.assertEqual(self.puts, [('/lights/3/state', {'on': True})])
@@ -0,0 +1,110 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for merge_state(), which folds a newer state command into one
+# that hasn't been sent yet (used by the dispatcher queue and batches).
+
+import threading
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue import merge_state  # noqa: E402
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.light import Light  # noqa: E402
+
+
+def merged(pending, data):
+    pending = dict(pending)
+    merge_state(pending, data)
+    return pending
+
+
+class TestMergeState(testtools.TestCase):
+
+    def test_newer_value_wins(self):
+        self.assertEqual(merged({'bri': 10, 'on': True}, {'bri': 20}),
+                         {'bri': 20, 'on': True})
+
+    def test_increments_add_up(self):
+        self.assertEqual(merged({'bri_inc': 10}, {'bri_inc': 5}), {'bri_inc': 15})
+
+    def test_increment_applies_to_absolute(self):
+        """An increment after an absolute value is still an absolute value."""
+        self.assertEqual(merged({'bri': 100}, {'bri_inc': -20}), {'bri': 80})
+
+    def test_sum_clamped(self):
+        self.assertEqual(merged({'bri': 250}, {'bri_inc': 20}), {'bri': 254})
+        self.assertEqual(merged({'bri': 10}, {'bri_inc': -20}), {'bri': 1})
+        self.assertEqual(merged({'sat': 10}, {'sat_inc': -20}), {'sat': 0})
+        self.assertEqual(merged({'ct': 480}, {'ct_inc': 50}), {'ct': 500})
+
+    def test_hue_wraps(self):
+        self.assertEqual(merged({'hue': 65000}, {'hue_inc': 1000}), {'hue': 464})
+        self.assertEqual(merged({'hue': 100}, {'hue_inc': -200}), {'hue': 65436})
+
+    def test_increments_clamped(self):
+        self.assertEqual(merged({'bri_inc': 200}, {'bri_inc': 200}), {'bri_inc': 254})
+        self.assertEqual(merged({'hue_inc': -40000}, {'hue_inc': -40000}), {'hue_inc': -65534})
+
+    def test_absolute_replaces_increment(self):
+        self.assertEqual(merged({'bri_inc': 10}, {'bri': 50}), {'bri': 50})
+
+    def test_xy_increment_not_added(self):
+        """List-valued increments aren't summed, the newer one is kept."""
+        self.assertEqual(merged({'xy_inc': [0.1, 0.1]}, {'xy_inc': [0.2, 0.0]}),
+                         {'xy_inc': [0.2, 0.0]})
+
+    def test_color_mode_replaces_other_modes(self):
+        """Setting ct puts the light in ct mode, so pending hue/sat/xy go."""
+        self.assertEqual(merged({'hue': 100, 'sat': 50, 'xy': [0.3, 0.3], 'bri': 5}, {'ct': 300}),
+                         {'ct': 300, 'bri': 5})
+        self.assertEqual(merged({'ct': 300, 'ct_inc': 10}, {'hue': 100}), {'hue': 100})
+
+    def test_same_mode_kept(self):
+        self.assertEqual(merged({'hue': 100}, {'sat': 50}), {'hue': 100, 'sat': 50})
+
+    def test_scene_replaces_everything(self):
+        self.assertEqual(merged({'bri': 10, 'on': True}, {'scene': 'abc'}), {'scene': 'abc'})
+
+
+class TestBatch(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.light = Light(Light.Bridge(self.bridge), 1)
+
+    def test_one_command(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[{'success': {}}]) as request:
+            with self.light.batch():
+                self.light.on = True
+                self.light.brightness = 10
+                self.light.brightness = 20
+                self.light.xy = [0.3, 0.3]
+                self.light.colortemp = 300
+        request.assert_called_once_with('PUT', '/api/username/lights/1/state',
+                                        {'on': True, 'bri': 20, 'ct': 300})
+
+    def test_nothing_sent_on_error(self):
+        with mock.patch.object(self.bridge, 'request', return_value=[]) as request:
+            try:
+                with self.light.batch():
+                    self.light.on = True
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertFalse(request.called)
+
+    def test_other_threads_not_batched(self):
+        """Settings made from another thread during a batch are sent at once."""
+        with mock.patch.object(self.bridge, 'request', return_value=[{'success': {}}]) as request:
+            with self.light.batch():
+                self.light.brightness = 10
+                thread = threading.Thread(target=setattr, args=(self.light, 'on', False))
+                thread.start()
+                thread.join()
+                request.assert_called_once_with('PUT', '/api/username/lights/1/state', {'on': False})
+        self.assertEqual(request.call_args, mock.call('PUT', '/api/username/lights/1/state', {'bri': 10}))
@@ -0,0 +1,96 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for Sync.Bridge.apply(), which changes several lights together by
+# scene, schedule or staggered commands.
+
+import fixtures
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.group import Group  # noqa: E402
+from uPHue.sync import Sync  # noqa: E402
+
+LIGHTS = {'1': {'name': 'Hob'}, '2': {'name': 'Sink'}, '3': {'name': 'Desk'}}
+FULL = [{'error': {'type': 301, 'address': '/scenes', 'description': 'resource, scenes, table full'}}]
+
+
+class TestSync(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSync, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+        self.bridge = Bridge(ip="10.0.0.0", username="username")
+        self.requests = []
+        self.full = set()  # collections the bridge won't add to
+        self.useFixture(fixtures.MockPatchObject(self.bridge, 'request', side_effect=self.request))
+        self.sb = Sync.Bridge(Group.Bridge(self.bridge))
+
+    def request(self, mode, address, data=None):
+        address = address[len(self.bridge.api):]
+        self.requests.append((mode, address, data))
+        if mode == 'GET' and address.rstrip('/') == '/lights':
+            return LIGHTS
+        if mode == 'GET' and address == '/scenes':
+            return {}
+        if mode == 'GET' and address == '/config':
+            return {'localtime': '2020-01-01T12:00:00'}
+        if mode == 'POST':
+            if address in self.full:
+                return FULL
+            return [{'success': {'id': str(len(self.requests))}}]
+        self.now += 0.2  # each command takes a while
+        return [{'success': {address + '/' + key: value}} for key, value in data.items()]
+
+    def sent(self, mode, prefix):
+        return [(address, data) for m, address, data in self.requests if m == mode and address.startswith(prefix)]
+
+    def test_scene(self):
+        result = self.sb.apply({1: {'on': True}, 'Sink': {'on': False}}, transitiontime=4)
+        self.assertTrue(result)
+        self.assertEqual(len(self.sent('POST', '/scenes')), 1)
+        self.assertEqual([data['scene'] for address, data in self.sent('PUT', '/groups/0/action')], ['3'])
+        self.assertEqual(self.sent('PUT', '/lights/'), [])
+
+    def test_scene_falls_back_to_stagger(self):
+        self.full.add('/scenes')
+        result = self.sb.apply({1: {'on': True}, 2: {'on': True}}, transitiontime=4)
+        self.assertTrue(result)
+        self.assertEqual(self.sent('PUT', '/groups/'), [])
+        self.assertEqual([address for address, data in self.sent('PUT', '/lights/')],
+                         ['/lights/1/state', '/lights/2/state'])
+
+    def test_schedule(self):
+        result = self.sb.apply({1: {'on': True}, 2: {'on': False}, 3: {'bri': 10}},
+                               transitiontime=4, method='schedule')
+        self.assertTrue(result)
+        schedules = [data for address, data in self.sent('POST', '/schedules')]
+        self.assertEqual([schedule['localtime'] for schedule in schedules], ['2020-01-01T12:00:02'] * 3)
+        self.assertEqual(schedules[0]['command'], {'method': 'PUT', 'address': '/api/username/lights/1/state',
+                                                   'body': {'on': True, 'transitiontime': 4}})
+        self.assertEqual(self.sent('PUT', '/lights/'), [])
+
+    def test_schedule_falls_back_to_stagger(self):
+        self.full.add('/schedules')
+        result = self.sb.apply({1: {'on': True}, 2: {'on': False}}, method='schedule')
+        self.assertTrue(result)
+        self.assertEqual(len(self.sent('POST', '/schedules')), 2)
+        self.assertEqual(len(self.sent('PUT', '/lights/')), 2)
+
+    def test_stagger(self):
+        """Earlier lights get longer transitions, by the measured spacing."""
+        result = self.sb.apply({1: {'on': True}, 2: {'on': True}, 3: {'on': True}},
+                               transitiontime=4, method='stagger')
+        self.assertTrue(result)
+        self.assertEqual([data['transitiontime'] for address, data in self.sent('PUT', '/lights/')], [6, 6, 4])
+
+    def test_unknown_light(self):
+        result = self.sb.apply({'Oven': {'on': True}, 1: {'on': True}}, method='stagger')
+        self.assertEqual(result.succeeded, [1])
+        self.assertEqual(result.errors['Oven'][0]['type'], 3)
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, self.sb.apply, {1: {'on': True}}, method='telepathy')
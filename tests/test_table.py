@@ -0,0 +1,68 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for table.StateTable, the column view of every light's state.
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.table import StateTable, numpy  # noqa: E402
+
+LIGHTS = {
+    '1': {'name': 'Hob', 'state': {'on': True, 'bri': 200, 'hue': 100, 'colormode': 'xy',
+                                   'xy': [0.3, 0.3], 'effect': 'none', 'alert': 'none'}},
+    '2': {'name': 'Sink', 'state': {'on': True, 'bri': 50, 'alert': 'none'}},
+    '10': {'name': 'Porch', 'state': {'on': False, 'bri': 1, 'alert': 'none'}},
+}
+
+
+@testtools.skipIf(numpy is None, 'StateTable needs numpy')
+class TestStateTable(testtools.TestCase):
+
+    def setUp(self):
+        super(TestStateTable, self).setUp()
+        self.bridge = mock.Mock(spec=['set_lights'])
+        self.table = StateTable(self.bridge, LIGHTS)
+
+    def test_columns(self):
+        self.assertEqual(self.table.ids.tolist(), [1, 2, 10])
+        self.assertEqual(self.table['bri'].tolist(), [200, 50, 1])
+        self.assertEqual(self.table['hue'].tolist(), [100, -1, -1])
+        self.assertEqual(self.table.row(10), 2)
+        self.assertEqual(self.table.where(self.table['on']).tolist(), [1, 2])
+
+    def test_set_ints(self):
+        changed = self.table.set('bri', self.table['bri'] // 2, mask=self.table['on'])
+        self.assertEqual(changed.tolist(), [1, 2])
+        self.assertEqual(self.table.pending, {1: {'bri': 100}, 2: {'bri': 25}})
+        self.assertIs(type(self.table.pending[1]['bri']), int)
+
+    def test_set_unchanged_skipped(self):
+        self.assertEqual(self.table.set('bri', 1, mask=~self.table['on']).tolist(), [])
+        self.assertEqual(self.table.pending, {})
+
+    def test_set_missing_field_skipped(self):
+        self.assertEqual(self.table.set('hue', 500).tolist(), [1])
+
+    def test_set_strings(self):
+        changed = self.table.set('alert', 'select', mask=self.table['on'])
+        self.assertEqual(changed.tolist(), [1, 2])
+        self.assertEqual(self.table.pending, {1: {'alert': 'select'}, 2: {'alert': 'select'}})
+        self.assertEqual(self.table['alert'].tolist(), ['select', 'select', 'none'])
+
+    def test_set_xy(self):
+        self.table.set('xy', [0.5, 0.4])
+        self.assertEqual(self.table.pending, {1: {'xy': [0.5, 0.4]}})
+
+    def test_read_only_fields(self):
+        self.assertRaises(ValueError, self.table.set, 'colormode', 'ct')
+        self.assertRaises(ValueError, self.table.set, 'name', 'Oven')
+
+    def test_commit(self):
+        self.assertIsNone(self.table.commit())
+        self.table.set('on', False)
+        self.table.commit(transitiontime=10)
+        self.bridge.set_lights.assert_called_once_with({1: {'on': False}, 2: {'on': False}}, 10)
+        self.assertEqual(self.table.pending, {})
@@ -0,0 +1,168 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for the command throttles in throttle.py, against a clock that
+# only moves when the test says so.
+
+import fixtures
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue import PhueException  # noqa: E402
+from uPHue.throttle import AdaptiveThrottle, Throttle, TokenBucket, command_kind  # noqa: E402
+
+LIGHT = ('PUT', '/api/u/lights/1/state')
+GROUP = ('PUT', '/api/u/groups/1/action')
+OK = [{'success': {'/lights/1/state/on': True}}]
+INTERNAL_ERROR = [{'error': {'type': 901, 'address': '/lights/1/state', 'description': 'Internal error, 404'}}]
+
+
+class ClockTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(ClockTestCase, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('time.time', lambda: self.now))
+
+
+class TestTokenBucket(ClockTestCase):
+
+    def test_spacing(self):
+        """Back-to-back commands are booked 1/rate apart."""
+        bucket = TokenBucket(10)
+        delays = [bucket.reserve() for n in range(4)]
+        self.assertEqual([round(delay, 6) for delay in delays], [0.0, 0.1, 0.2, 0.3])
+        self.assertAlmostEqual(bucket.backlog, 0.4)
+
+    def test_idle_time_not_saved_up(self):
+        bucket = TokenBucket(10)
+        bucket.reserve()
+        self.now += 5
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+
+    def test_paced_commands_not_delayed(self):
+        bucket = TokenBucket(2)
+        for n in range(5):
+            self.assertEqual(bucket.reserve(), 0.0)
+            self.now += 0.5
+
+    def test_burst(self):
+        """Up to burst commands go out at once, then they are spaced out."""
+        bucket = TokenBucket(10, burst=3)
+        delays = [round(bucket.reserve(), 6) for n in range(5)]
+        self.assertEqual(delays, [0.0, 0.0, 0.0, 0.1, 0.2])
+
+    def test_burst_refills(self):
+        bucket = TokenBucket(10, burst=3)
+        for n in range(3):
+            bucket.reserve()
+        self.now += 0.3
+        self.assertEqual([round(bucket.reserve(), 6) for n in range(4)], [0.0, 0.0, 0.0, 0.1])
+
+    def test_max_wait(self):
+        bucket = TokenBucket(10, max_wait=0.25)
+        for n in range(3):
+            bucket.reserve()
+        self.assertRaises(PhueException, bucket.reserve)
+        self.now += 0.1
+        self.assertAlmostEqual(bucket.reserve(), 0.2)
+
+
+class TestThrottle(ClockTestCase):
+
+    def test_command_kind(self):
+        self.assertEqual(command_kind(*LIGHT), 'lights')
+        self.assertEqual(command_kind(*GROUP), 'groups')
+        self.assertIsNone(command_kind('GET', '/api/u/lights/1/state'))
+        self.assertIsNone(command_kind('PUT', '/api/u/lights/1'))
+        self.assertIsNone(command_kind('PUT', '/api/u/sensors/1/state'))
+
+    def test_buckets_separate(self):
+        throttle = Throttle(light_rate=10, group_rate=1)
+        self.assertEqual(throttle.reserve(*LIGHT), 0.0)
+        self.assertEqual(throttle.reserve(*GROUP), 0.0)
+        self.assertAlmostEqual(throttle.reserve(*LIGHT), 0.1)
+        self.assertAlmostEqual(throttle.reserve(*GROUP), 1.0)
+        self.assertEqual(throttle.reserve('GET', '/api/u/lights'), 0.0)
+        self.assertEqual(throttle.capacity, {'lights': 10.0, 'groups': 1.0})
+
+    def test_wait_sleeps(self):
+        throttle = Throttle(light_rate=4)
+        with mock.patch('time.sleep') as sleep:
+            throttle.wait(*LIGHT)
+            self.assertFalse(sleep.called)
+            throttle.wait(*LIGHT)
+        sleep.assert_called_once_with(0.25)
+
+
+class TestAdaptiveThrottle(ClockTestCase):
+
+    def setUp(self):
+        super(TestAdaptiveThrottle, self).setUp()
+        self.throttle = AdaptiveThrottle(light_rate=10, group_rate=1)
+
+    def test_additive_increase(self):
+        """A second's worth of quick answers adds about `increase` per second."""
+        for n in range(10):
+            self.throttle.observe(*LIGHT, latency=0.05, response=OK)
+        self.assertAlmostEqual(self.throttle.lights.rate, 10.96, places=2)
+        self.assertEqual(self.throttle.groups.rate, 1.0)
+
+    def test_increase_capped(self):
+        for n in range(1000):
+            self.throttle.observe(*GROUP, latency=0.05, response=OK)
+        self.assertEqual(self.throttle.groups.rate, 5.0)
+
+    def test_timeout_halves(self):
+        self.throttle.observe(*LIGHT, latency=None, response=None)
+        self.assertEqual(self.throttle.capacity, {'lights': 5.0, 'groups': 1.0})
+
+    def test_internal_error_halves(self):
+        self.throttle.observe(*LIGHT, latency=0.05, response=INTERNAL_ERROR)
+        self.assertEqual(self.throttle.lights.rate, 5.0)
+
+    def test_other_errors_ignored(self):
+        error = [{'error': {'type': 7, 'address': '/lights/1/state/hue', 'description': 'invalid value'}}]
+        self.throttle.observe(*LIGHT, latency=0.05, response=error)
+        self.assertAlmostEqual(self.throttle.lights.rate, 10.1)
+
+    def test_slow_response_halves(self):
+        self.throttle.observe(*LIGHT, latency=1.5, response=OK)
+        self.assertEqual(self.throttle.lights.rate, 5.0)
+
+    def test_one_cut_per_backoff(self):
+        """Failures of commands already in flight don't cut the rate again."""
+        self.throttle.observe(*LIGHT, latency=None, response=None)
+        self.now += 0.1
+        self.throttle.observe(*LIGHT, latency=None, response=None)
+        self.assertEqual(self.throttle.lights.rate, 5.0)
+        self.now += 0.15  # past 1 / 5.0 seconds
+        self.throttle.observe(*LIGHT, latency=None, response=None)
+        self.assertEqual(self.throttle.lights.rate, 2.5)
+
+    def test_backoff_covers_slow_response(self):
+        self.throttle.observe(*LIGHT, latency=3.0, response=OK)
+        self.now += 2.0
+        self.throttle.observe(*LIGHT, latency=3.0, response=OK)
+        self.assertEqual(self.throttle.lights.rate, 5.0)
+        self.now += 1.5
+        self.throttle.observe(*LIGHT, latency=3.0, response=OK)
+        self.assertEqual(self.throttle.lights.rate, 2.5)
+
+    def test_decrease_floored(self):
+        throttle = AdaptiveThrottle(min_rate=4, decrease=0.1)
+        throttle.observe(*LIGHT, latency=None, response=None)
+        throttle.observe(*GROUP, latency=None, response=None)
+        self.assertEqual(throttle.capacity, {'lights': 4.0, 'groups': 4.0})
+
+    def test_unthrottled_requests_ignored(self):
+        self.throttle.observe('GET', '/api/u/lights', latency=None, response=None)
+        self.assertEqual(self.throttle.capacity, {'lights': 10.0, 'groups': 1.0})
+
+    def test_new_rate_spaces_commands(self):
+        self.throttle.observe(*LIGHT, latency=None, response=None)
+        self.throttle.reserve(*LIGHT)
+        self.assertAlmostEqual(self.throttle.reserve(*LIGHT), 0.2)
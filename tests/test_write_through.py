@@ -0,0 +1,98 @@
+# Published under the MIT license - See LICENSE file for more detail
+#
+# Tests for writing PUTs through to the cache before they are sent, and
+# settling them against the bridge's response afterwards.
+
+import copy
+
+import mock
+import testtools
+
+import fakes
+
+fakes.load_uphue()
+from uPHue.bridge import Bridge  # noqa: E402
+from uPHue.cache import Cache  # noqa: E402
+
+LIGHT = {'name': 'Hall', 'type': 'Extended color light',
+         'state': {'on': True, 'bri': 100, 'hue': 1000, 'sat': 100,
+                   'xy': [0.3, 0.3], 'colormode': 'hs', 'reachable': True}}
+
+ADDRESS = '/api/username/lights/1/state'
+
+
+def success(**values):
+    return [{'success': {'/lights/1/state/' + key: value}} for key, value in values.items()]
+
+
+def error(address, type=7, description='invalid value'):
+    return {'error': {'type': type, 'address': address, 'description': description}}
+
+
+class TestWriteThrough(testtools.TestCase):
+
+    def setUp(self):
+        super(TestWriteThrough, self).setUp()
+        self.bridge = Bridge(ip="10.0.0.0", username="username", cache=Cache(ttl=60))
+        self.bridge.cache.store('/lights/1', copy.deepcopy(LIGHT))
+
+    def put(self, data, response):
+        with mock.patch.object(self.bridge, 'request', return_value=response) as request:
+            self.assertEqual(self.bridge.put('/lights/1/state', data), response)
+        request.assert_called_once_with('PUT', ADDRESS, data)
+
+    def state(self):
+        """What a read returns now; there must be no need to ask the bridge"""
+        with mock.patch.object(self.bridge, 'request') as request:
+            state = self.bridge.read('/lights/1', 'bri')['state']
+        self.assertFalse(request.called)
+        return state
+
+    def test_success(self):
+        self.put({'bri': 50, 'on': False, 'transitiontime': 0},
+                 success(bri=50, on=False, transitiontime=0))
+        state = self.state()
+        self.assertEqual((state['bri'], state['on']), (50, False))
+        self.assertNotIn('transitiontime', state)
+
+    def test_colormode_follows(self):
+        self.put({'xy': [0.5, 0.4]}, success(xy=[0.5, 0.4]))
+        self.assertEqual(self.state()['colormode'], 'xy')
+
+    def test_bridge_value_kept(self):
+        """The bridge may clamp a value; what it reports is what is kept."""
+        self.put({'bri': 300}, success(bri=254))
+        self.assertEqual(self.state()['bri'], 254)
+
+    def test_attribute_error_rolled_back(self):
+        """Only the attribute the bridge refused goes back to its old value."""
+        self.put({'bri': 50, 'hue': 70000},
+                 success(bri=50) + [error('/lights/1/state/hue')])
+        state = self.state()
+        self.assertEqual((state['bri'], state['hue']), (50, 1000))
+
+    def test_colormode_rolled_back_with_attribute(self):
+        self.put({'xy': [2, 2]}, [error('/lights/1/state/xy')])
+        state = self.state()
+        self.assertEqual((state['xy'], state['colormode']), ([0.3, 0.3], 'hs'))
+
+    def test_resource_error_rolled_back(self):
+        """An error for the whole resource undoes every attribute."""
+        self.put({'bri': 50, 'on': False},
+                 [error('/lights/1/state', 201, 'parameter, bri, is not modifiable. Device is set to off.')])
+        state = self.state()
+        self.assertEqual((state['bri'], state['on']), (100, True))
+
+    def test_unexpected_response_invalidates(self):
+        self.put({'bri': 50}, {'unexpected': True})
+        self.assertIsNone(self.bridge.cache.get('/lights/1'))
+
+    def test_incremental_invalidates(self):
+        """The outcome of bri_inc isn't known until the bridge is asked."""
+        self.put({'bri_inc': 10}, success(bri=110))
+        self.assertIsNone(self.bridge.cache.get('/lights/1'))
+
+    def test_uncached_resource_untouched(self):
+        with mock.patch.object(self.bridge, 'request', return_value=success(bri=5)):
+            self.bridge.put('/lights/2/state', {'bri': 5})
+        self.assertIsNone(self.bridge.cache.get('/lights/2'))
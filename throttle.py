@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from uPHue import *
+from uPHue.pool import NullLock
+
+try:
+    import threading
+except ImportError:
+    threading = None
+
+
+def command_kind(mode, address):
+    """ Returns 'lights' for a light state PUT, 'groups' for a group action PUT,
+    or None for any other request """
+    if mode != 'PUT':
+        return None
+    parts = address.rstrip('/').split('/')
+    if len(parts) < 3:
+        return None
+    if parts[-3] == 'lights' and parts[-1] == 'state':
+        return 'lights'
+    if parts[-3] == 'groups' and parts[-1] == 'action':
+        return 'groups'
+    return None
+
+
+class TokenBucket(object):
+
+    """ Spaces commands out to `rate` per second, allowing bursts of `burst`
+
+    Each caller reserves the next free slot, so callers waiting on the same
+    bucket (from different threads or tasks) go out in the order they asked.
+    If reserving a slot would mean waiting longer than `max_wait` seconds,
+    PhueException is raised instead of queueing.
+
+    """
+
+    def __init__(self, rate, burst=1, max_wait=None):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_wait = max_wait
+        self.lock = threading.Lock() if threading is not None else NullLock()
+        self._tat = 0.0  # theoretical arrival time of the next command
+
+    def __repr__(self):
+        return '<{0}.{1} rate={2:g}/s burst={3} backlog={4:.2f}s>'.format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.rate,
+            self.burst,
+            self.backlog)
+
+    @property
+    def backlog(self):
+        '''Get how far ahead commands have been booked [seconds]'''
+        return max(0.0, self._tat - time.time())
+
+    def reserve(self):
+        """ Book a slot for one command. Returns the seconds to wait before sending it """
+        with self.lock:
+            now = time.time()
+            tat = max(self._tat, now)
+            delay = max(0.0, tat - (self.burst - 1) / self.rate - now)
+            if self.max_wait is not None and delay > self.max_wait:
+                raise PhueException(None, 'Command queue full: next slot is {0:.1f}s away'.format(delay))
+            self._tat = tat + 1 / self.rate
+            return delay
+
+
+class Throttle(object):
+
+    """ Holds commands to the bridge's sustainable throughput
+
+    Hue bridges handle roughly 10 light commands and 1 group command per
+    second; beyond that commands start getting dropped. Light state PUTs
+    (`/lights/<id>/state`) and group action PUTs (`/groups/<id>/action`) each
+    go through their own TokenBucket. Everything else is sent straight away.
+
+    >>> b = Bridge(ip='192.168.1.100', throttle=Throttle(light_rate=10, group_rate=1))
+
+    """
+
+    def __init__(self, light_rate=10, group_rate=1, burst=1, max_wait=None):
+        self.lights = TokenBucket(light_rate, burst, max_wait)
+        self.groups = TokenBucket(group_rate, burst, max_wait)
+
+    def bucket(self, mode, address):
+        """ Returns the TokenBucket for a request, or None if it isn't throttled """
+        kind = command_kind(mode, address)
+        if kind is None:
+            return None
+        return getattr(self, kind)
+
+    @property
+    def capacity(self):
+        '''Get the commands per second currently allowed [dict of 'lights', 'groups']'''
+        return {'lights': self.lights.rate, 'groups': self.groups.rate}
+
+    def observe(self, mode, address, latency, response):
+        """ Called with the outcome of every request: its latency in seconds
+        and decoded response, or None for both if it timed out """
+        pass
+
+    def reserve(self, mode, address):
+        """ Book a slot for a request. Returns the seconds to wait before sending it """
+        bucket = self.bucket(mode, address)
+        if bucket is None:
+            return 0.0
+        return bucket.reserve()
+
+    def wait(self, mode, address):
+        """ Block until a request may be sent """
+        delay = self.reserve(mode, address)
+        if delay > 0:
+            logger.debug("Throttling {0} {1} for {2:.3f}s".format(mode, address, delay))
+            time.sleep(delay)
+
+
+class AdaptiveThrottle(Throttle):
+
+    """ A Throttle that learns how fast the bridge can really go
+
+    The sustainable rate depends on the Zigbee mesh, so rather than fixing it
+    each bucket's rate is adjusted additive-increase/multiplicative-decrease:
+    every command that is answered quickly raises the rate by `increase`
+    commands per second (spread over a second's worth of commands), while a
+    timeout, an "internal error" from the bridge or a response slower than
+    `slow` seconds cuts it by `decrease`. Rates stay between `min_rate` and
+    `max_rate` (per-bucket dicts, or one value for both).
+
+    >>> t = AdaptiveThrottle()
+    >>> b = Bridge(ip='192.168.1.100', throttle=t)
+    >>> b.capacity
+    {'lights': 10.0, 'groups': 1.0}
+
+    """
+
+    OVERLOAD_ERRORS = (901,)  # Internal error; the bridge is struggling
+
+    def __init__(self, light_rate=10, group_rate=1, burst=1, max_wait=None,
+                 min_rate=None, max_rate=None, increase=1.0, decrease=0.5, slow=1.0):
+        Throttle.__init__(self, light_rate, group_rate, burst, max_wait)
+        self.min_rate = min_rate or {'lights': 1.0, 'groups': 0.2}
+        self.max_rate = max_rate or {'lights': 25.0, 'groups': 5.0}
+        self.increase = increase
+        self.decrease = decrease
+        self.slow = slow
+        self._backoff = {}  # bucket -> time before which it won't be cut again
+
+    def _limits(self, bucket):
+        key = 'lights' if bucket is self.lights else 'groups'
+        low, high = self.min_rate, self.max_rate
+        if isinstance(low, dict):
+            low = low[key]
+        if isinstance(high, dict):
+            high = high[key]
+        return float(low), float(high)
+
+    def observe(self, mode, address, latency, response):
+        bucket = self.bucket(mode, address)
+        if bucket is None:
+            return
+        overloaded = latency is None or latency > self.slow
+        if not overloaded and isinstance(response, list):
+            for item in response:
+                if isinstance(item, dict) and 'error' in item and \
+                        item['error'].get('type') in self.OVERLOAD_ERRORS:
+                    overloaded = True
+                    break
+
+        low, high = self._limits(bucket)
+        with bucket.lock:
+            now = time.time()
+            if overloaded:
+                # one cut per round of in-flight commands, not one per failure
+                if now < self._backoff.get(bucket, 0.0):
+                    return
+                bucket.rate = max(low, bucket.rate * self.decrease)
+                self._backoff[bucket] = now + max(1 / bucket.rate, latency or 0.0)
+                logger.info("Bridge overloaded, slowing to {0:.2f} commands/s".format(bucket.rate))
+            else:
+                bucket.rate = min(high, bucket.rate + self.increase / bucket.rate)